@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Category, Product
+from django.db import transaction
+from .models import Category, ExchangeRate, Job, Product
+from . import currency, jobs, search
+from .changelist import CachedCategoryFilter, CurrencyFilter, HighScaleAdminMixin
 from unfold.admin import ModelAdmin
 @admin.register(Category)
 class CategoryAdmin(ModelAdmin):
@@ -7,8 +10,45 @@ class CategoryAdmin(ModelAdmin):
     search_fields = ('name',)
 
 @admin.register(Product)
-class ProductAdmin(ModelAdmin):
-    list_display = ('name', 'price', 'category', 'stock_quantity', 'created_at')
-    list_filter = ('category', 'currency')
+class ProductAdmin(HighScaleAdminMixin, ModelAdmin):
+    list_display = ('name', 'price', 'currency', 'price_base', 'category', 'stock_quantity', 'created_at')
+    list_select_related = ('category',)
+    list_filter = (('category', CachedCategoryFilter), CurrencyFilter)
+    # Only here so the search box shows; get_search_results uses the full-text index
     search_fields = ('name', 'description')
-    raw_id_fields = ('category',) 
\ No newline at end of file
+    raw_id_fields = ('category',)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search.search_products(queryset, search_term), False
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(ModelAdmin):
+    list_display = ('currency', 'rate', 'updated_at')
+
+    def get_readonly_fields(self, request, obj=None):
+        return ('currency',) if obj else ()
+
+    def has_delete_permission(self, request, obj=None):
+        # Products in the currency could no longer be priced
+        return False
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            currency.forget_rates()
+            job = jobs.enqueue('reprice', currencies=[obj.currency])
+        self.message_user(request, f"{obj.currency} products are being re-priced in the background (job {job.pk}).")
+
+@admin.register(Job)
+class JobAdmin(ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress', 'total', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+
+    def has_add_permission(self, request):
+        # Jobs are queued by the operations that need them
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
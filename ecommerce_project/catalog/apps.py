@@ -1,6 +1,28 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def ensure_search_index(sender, using, plan=None, **kwargs):
+    from django.db import connections
+
+    from . import search
+
+    # Only once the catalog tables exist, i.e. not after `migrate catalog zero`
+    if plan and all(backwards for _, backwards in plan):
+        return
+    connection = connections[using]
+    if 'catalog_product' in connection.introspection.table_names():
+        search.install(connection)
 
 
 class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'catalog'
+
+    def ready(self):
+        from . import signals, sqlite
+
+        connection_created.connect(sqlite.configure_connection, dispatch_uid='catalog-sqlite-tuning')
+        post_migrate.connect(ensure_search_index, sender=self)
+        signals.connect()
@@ -0,0 +1,185 @@
+"""
+Admin changelist pieces for tables too big for the stock ones (see ProductAdmin).
+
+* EstimatedCountPaginator: counts exactly up to CATALOG_ADMIN_COUNT_LIMIT rows.
+  Past that, an unfiltered list shows the planner's row estimate (pg_class.reltuples,
+  or sqlite_stat1 -- run ANALYZE now and then) and a filtered one shows "N+".
+* KeysetChangeList: sorted by a column with a (column, id) index, pages are fetched
+  from a cursor ("Next") instead of with OFFSET, so every page costs the same.
+* CachedCategoryFilter / CurrencyFilter: filter choices that don't enumerate the
+  category or product table on every request.
+"""
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from . import currency
+from .pagination import ORDER_COLUMNS, ORDERABLE_FIELDS, encode_cursor, seek
+
+CURSOR_VAR = 'after'
+CURSOR_ATTR = '_changelist_cursor'
+CATEGORY_CHOICES_KEY = 'catalog:admin:category-choices'
+
+# Columns with a (column, id) index, see Product.Meta.indexes
+KEYSET_COLUMNS = {ORDER_COLUMNS.get(name, name) for name in ORDERABLE_FIELDS}
+
+
+def count_limit():
+    return getattr(settings, 'CATALOG_ADMIN_COUNT_LIMIT', 10000)
+
+
+def estimated_count(model, using):
+    """The database's own row estimate for `model`'s table, or None if it has none."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            # -1 until the table is first vacuumed or analyzed
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # sqlite_stat1 only exists once ANALYZE has run
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            counts = [int(stat.split()[0]) for (stat,) in cursor.fetchall() if stat]
+            return max(counts) if counts else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    estimated = False
+    capped = False
+
+    @cached_property
+    def count(self):
+        limit = count_limit()
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                self.estimated = True
+                return estimate
+        # COUNT(*) over at most limit + 1 rows
+        count = queryset.order_by()[:limit + 1].count()
+        if count > limit:
+            self.capped = True
+            return limit
+        return count
+
+    @property
+    def count_label(self):
+        if self.estimated:
+            return f'about {self.count:,}'
+        if self.capped:
+            return f'{self.count:,}+'
+        return f'{self.count:,}'
+
+
+class KeysetChangeList(ChangeList):
+    next_cursor = None
+
+    def keyset_ordering(self):
+        """(column, descending) if the list is sorted by a keyset-pageable column, else None."""
+        ordering = list(self.queryset.query.order_by)
+        if not ordering or len(ordering) > 2 or not all(isinstance(item, str) for item in ordering):
+            return None
+        names = ['id' if item.lstrip('-') == 'pk' else item.lstrip('-') for item in ordering]
+        if len(names) == 2 and names[1] != 'id':
+            return None
+        if names[0] not in KEYSET_COLUMNS:
+            return None
+        return names[0], ordering[0].startswith('-')
+
+    def get_results(self, request):
+        key = self.keyset_ordering()
+        cursor = getattr(request, CURSOR_ATTR, None)
+        if key is None or self.show_all or (self.page_num > 1 and not cursor):
+            # Sorted by an unindexed column: numbered pages, but still no full COUNT
+            return super().get_results(request)
+
+        field_name, descending = key
+        queryset = self.queryset
+        if cursor:
+            try:
+                queryset = seek(queryset, field_name, descending, cursor)
+            except Exception:
+                raise IncorrectLookupParameters
+        direction = '-' if descending else ''
+        ordering = [direction + 'id'] if field_name == 'id' else [direction + field_name, direction + 'id']
+        rows = list(queryset.order_by(*ordering)[:self.list_per_page + 1])
+        has_next = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        paginator.template_name = 'admin/catalog/keyset_pagination.html'
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = has_next or bool(cursor)
+        self.paginator = paginator
+        self.cursor = cursor
+        if has_next:
+            self.next_cursor = encode_cursor([getattr(rows[-1], field_name), rows[-1].pk])
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor}, [PAGE_VAR])
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string(remove=[PAGE_VAR])
+
+
+class HighScaleAdminMixin:
+    """ModelAdmin mixin: estimated counts, keyset "Next" pages and no second COUNT."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def changelist_view(self, request, extra_context=None):
+        # ChangeList would treat the cursor as a field lookup
+        if CURSOR_VAR in request.GET:
+            request.GET = request.GET.copy()
+            setattr(request, CURSOR_ATTR, request.GET.pop(CURSOR_VAR)[-1])
+        return super().changelist_view(request, extra_context)
+
+
+class CachedCategoryFilter(admin.RelatedFieldListFilter):
+    def field_choices(self, field, request, model_admin):
+        choices = cache.get(CATEGORY_CHOICES_KEY)
+        if choices is None:
+            choices = super().field_choices(field, request, model_admin)
+            cache.set(CATEGORY_CHOICES_KEY, choices, getattr(settings, 'CATALOG_ADMIN_FILTER_CACHE_TIMEOUT', 300))
+        return choices
+
+
+def invalidate_filter_choices(**kwargs):
+    cache.delete(CATEGORY_CHOICES_KEY)
+
+
+class CurrencyFilter(admin.SimpleListFilter):
+    """Choices come from the exchange-rate table, not a DISTINCT over every product."""
+    title = 'currency'
+    parameter_name = 'currency'
+
+    def lookups(self, request, model_admin):
+        return [(code, code) for code in sorted(currency.rates())]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(currency=self.value())
+        return queryset
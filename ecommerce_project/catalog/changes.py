@@ -0,0 +1,168 @@
+"""
+The product change feed.
+
+Every write path appends to ProductChange: save() and delete() through the model
+signals, category deletes (whose SET_NULL sends none) through pre_delete, and the
+bulk paths (bulk mutations, imports, stock changes, re-pricing, jobs) by calling
+record_created() / record_updated() / record_deleted() inside their own transaction,
+so a change is logged if and only if it commits. Once it commits, the ids are also
+published to live subscriptions (catalog.events).
+
+A consumer keeps the last version it has seen and asks for what came after it
+(`productChanges(since:)` or /catalog/changes/), so a sync costs O(changes) rather
+than a re-read of the catalog. Payloads are the product as it is now, not as it was
+at that version; a null product means it has since been deleted.
+
+Versions are ProductChange ids. On SQLite writers are serialised, so ids become
+visible in order. Elsewhere, a transaction can commit a lower id after a higher one;
+changes younger than CATALOG_CHANGE_FEED_LAG seconds are held back so a consumer's
+cursor does not move past an id that is still to appear.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from . import events
+from .models import Product, ProductChange
+
+PRODUCT_FIELDS = (
+    'id', 'name', 'description', 'price', 'currency', 'price_base', 'image_url', 'stock_quantity',
+    'category_id', 'created_at', 'updated_at',
+)
+
+
+def record(product_ids, op, using=None):
+    if product_ids:
+        now = timezone.now()
+        ProductChange.objects.using(using or DEFAULT_DB_ALIAS).bulk_create(
+            [ProductChange(product_id=pk, op=op, changed_at=now) for pk in product_ids], batch_size=1000,
+        )
+        events.publish_on_commit(product_ids, using)
+
+
+def record_save(sender, instance, created, raw=False, using=None, **kwargs):
+    if not raw:
+        record([instance.pk], ProductChange.CREATED if created else ProductChange.UPDATED, using)
+
+
+def record_delete(sender, instance, using=None, **kwargs):
+    record([instance.pk], ProductChange.DELETED, using)
+
+
+def record_created(products, using=None):
+    record([p.pk for p in products], ProductChange.CREATED, using)
+
+
+def record_updated(products, using=None):
+    record([p.pk for p in products], ProductChange.UPDATED, using)
+
+
+def record_deleted(product_ids, using=None):
+    record(list(product_ids), ProductChange.DELETED, using)
+
+
+def record_category_delete(sender, instance, using=None, **kwargs):
+    # The products are about to lose their category in one UPDATE that sends no signals
+    record(list(Product.objects.using(using).filter(category_id=instance.pk).values_list('pk', flat=True)),
+           ProductChange.UPDATED, using)
+
+
+def _visible(using=None):
+    changes = ProductChange.objects.using(using) if using else ProductChange.objects.all()
+    if connections[changes.db].vendor != 'sqlite':
+        lag = getattr(settings, 'CATALOG_CHANGE_FEED_LAG', 5)
+        changes = changes.filter(changed_at__lte=timezone.now() - timedelta(seconds=lag))
+    return changes
+
+
+def latest_version(using=None):
+    """The highest version it is safe to hand out; 0 for an empty log."""
+    return _visible(using).aggregate(latest=Max('id'))['latest'] or 0
+
+
+async def alatest_version(using=None):
+    return (await _visible(using).aaggregate(latest=Max('id')))['latest'] or 0
+
+
+def parse_version(value):
+    if value in (None, ''):
+        return 0
+    try:
+        version = int(value)
+    except (TypeError, ValueError):
+        raise Exception("Invalid cursor.")
+    if version < 0:
+        raise Exception("Invalid cursor.")
+    return version
+
+
+def _check_oldest(since, oldest):
+    if since and oldest is not None and since < oldest - 1:
+        raise Exception("The change log no longer reaches back to this cursor. Re-sync from the start of the feed.")
+    return since
+
+
+def check_since(since):
+    """Parse a `since` cursor, refusing one that points before the pruned part of the log."""
+    since = parse_version(since)
+    if since:
+        _check_oldest(since, ProductChange.objects.aggregate(oldest=Min('id'))['oldest'])
+    return since
+
+
+async def acheck_since(since):
+    since = parse_version(since)
+    if since:
+        _check_oldest(since, (await ProductChange.objects.aaggregate(oldest=Min('id')))['oldest'])
+    return since
+
+
+def _page(since, limit, upto):
+    changes = ProductChange.objects.filter(id__gt=since, id__lte=upto).order_by('id')
+    return changes[:limit] if limit is not None else changes
+
+
+def changes_since(since, limit=None, upto=None):
+    """
+    ProductChange rows after version `since` (None: the start of the log), oldest
+    first, up to version `upto` (default: latest_version()) and at most `limit` of them.
+    """
+    since = check_since(since)
+    return _page(since, limit, latest_version() if upto is None else upto)
+
+
+async def achanges_since(since, limit=None, upto=None):
+    """changes_since(), with the log's bounds read through the async ORM; iterate it with async for."""
+    since = await acheck_since(since)
+    return _page(since, limit, await alatest_version() if upto is None else upto)
+
+
+def encode(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def product_payloads(product_ids):
+    """{id: JSON-ready dict} for the products that still exist."""
+    return {
+        row['id']: {key: encode(value) for key, value in row.items()}
+        for row in Product.objects.filter(pk__in=product_ids).values(*PRODUCT_FIELDS)
+    }
+
+
+def prune(older_than_days):
+    """Drop changes older than `older_than_days`; returns how many were deleted."""
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    newest = ProductChange.objects.filter(changed_at__lt=cutoff).aggregate(newest=Max('id'))['newest']
+    if newest is None:
+        return 0
+    # By version rather than by time, so the log stays contiguous
+    deleted, _ = ProductChange.objects.filter(id__lte=newest).delete()
+    return deleted
@@ -0,0 +1,148 @@
+"""
+Exchange rates and Product.price_base.
+
+Product.price is in the product's own currency. Product.price_base is the same price
+in settings.CATALOG_BASE_CURRENCY: it is set on every write (Product.save() and the
+Product.objects bulk methods call set_base_prices) and recomputed a chunk at a time
+by iter_reprice() whenever a rate changes -- inline, or as a `reprice` job
+(catalog.jobs). Everything that compares prices across products -- the price filters,
+ordering, CategoryStats and the dashboard -- uses price_base, so it is correct across
+currencies and index-backed.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ExchangeRate, Product
+
+CACHE_KEY = 'catalog:exchange-rates'
+CENT = Decimal('0.01')
+
+
+class UnknownCurrency(ValueError):
+    def __init__(self, currency):
+        self.currency = currency
+        super().__init__(f"No exchange rate for currency '{currency}'.")
+
+
+def base_currency():
+    return getattr(settings, 'CATALOG_BASE_CURRENCY', 'USD')
+
+
+def rates():
+    """{currency: Decimal rate to the base currency}, cached until the next set_rates()."""
+    result = cache.get(CACHE_KEY)
+    if result is None:
+        result = dict(ExchangeRate.objects.values_list('currency', 'rate'))
+        cache.set(CACHE_KEY, result, None)
+    return {**result, base_currency(): Decimal(1)}
+
+
+def to_base(price, currency, rates_=None):
+    rate = (rates_ if rates_ is not None else rates()).get(currency)
+    if rate is None:
+        raise UnknownCurrency(currency)
+    return (Decimal(str(price)) * rate).quantize(CENT, ROUND_HALF_UP)
+
+
+def set_base_prices(products):
+    """Fill in price_base on unsaved or changed instances; raises UnknownCurrency."""
+    current = rates()
+    for product in products:
+        if product.price is not None:
+            product.price_base = to_base(product.price, product.currency, current)
+
+
+def forget_rates():
+    cache.delete(CACHE_KEY)
+    transaction.on_commit(lambda: cache.delete(CACHE_KEY))
+
+
+def check_rate(code, rate):
+    """Raise ValueError unless `rate` may be stored for `code` (upper case)."""
+    if rate <= 0:
+        raise ValueError(f"The rate for {code} must be positive.")
+    if code == base_currency() and rate != 1:
+        raise ValueError(f"{code} is the base currency; its rate is always 1.")
+
+
+def store_rates(new_rates):
+    """Validate and store {currency: rate}; returns the codes whose rate changed."""
+    new_rates = {code.upper(): Decimal(str(rate)) for code, rate in new_rates.items()}
+    for code, rate in new_rates.items():
+        check_rate(code, rate)
+
+    with transaction.atomic():
+        changed = []
+        for code, rate in new_rates.items():
+            current = ExchangeRate.objects.select_for_update().filter(currency=code).first()
+            if current is None:
+                ExchangeRate.objects.create(currency=code, rate=rate)
+            elif current.rate != rate:
+                current.rate = rate
+                current.save(update_fields=['rate', 'updated_at'])
+            else:
+                continue
+            changed.append(code)
+        forget_rates()
+    return changed
+
+
+def set_rates(new_rates):
+    """Store {currency: rate} and re-price the products in the currencies that changed."""
+    return reprice(store_rates(new_rates))
+
+
+def reprice(currencies):
+    """Re-price every product in `currencies` now; returns the number re-priced."""
+    steps = iter_reprice(currencies)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+def iter_reprice(currencies, chunk_size=1000):
+    """
+    Recompute price_base for the products in `currencies`, `chunk_size` products per
+    transaction, keeping CategoryStats in step with exact deltas. Yields (done, total)
+    after each chunk and returns the number of products re-priced.
+    """
+    from . import changes, stats
+    from .signals import products_bulk_written
+
+    forget_rates()
+    current = rates()
+    for code in currencies:
+        if code not in current:
+            raise UnknownCurrency(code)
+
+    queryset = Product.objects.filter(currency__in=currencies)
+    total = queryset.count()
+    done, last_pk = 0, 0
+    while True:
+        with transaction.atomic():
+            products = list(
+                queryset.select_for_update().filter(pk__gt=last_pk).order_by('pk')
+                .only('pk', 'price', 'currency', 'price_base', 'category_id', 'stock_quantity', 'updated_at')[:chunk_size]
+            )
+            if not products:
+                return done
+            state_changes = []
+            now = timezone.now()
+            for product in products:
+                old = stats.current_state(product)
+                product.price_base = to_base(product.price, product.currency, current)
+                product.updated_at = now
+                state_changes.append((old, stats.current_state(product)))
+            Product.objects.bulk_update(products, ['price_base', 'updated_at'])
+            stats.apply_changes(state_changes)
+            changes.record_updated(products)
+        products_bulk_written.send(sender=Product, created=[], updated=products, deleted_ids=[])
+        done += len(products)
+        last_pk = products[-1].pk
+        yield done, max(total, done)
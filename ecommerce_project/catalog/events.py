@@ -0,0 +1,239 @@
+"""
+Live product updates for GraphQL subscriptions (catalog.subscriptions).
+
+Writers publish the ids of the products they changed once their transaction commits;
+changes.record() does this for every write path. The broker carries the ids to the
+hub of each ASGI process. Every CATALOG_SUBSCRIPTION_TICK seconds the hub loads the
+products changed during the tick in one query, however many clients are listening,
+and offers them to each subscription. A subscription keeps only the latest state of
+each product until its client has taken the previous batch, so a slow client gets
+fewer, newer updates; one that falls more than CATALOG_SUBSCRIPTION_MAX_PENDING
+products behind is ended and should re-sync (e.g. from productChanges).
+
+CATALOG_SUBSCRIPTION_BROKER picks the broker:
+
+* LocalBroker (default) is in-process, so it only sees writes made by the ASGI
+  process itself.
+* ChangeLogBroker reads the product change log once per tick instead, so writes
+  from any process (WSGI workers, run_catalog_worker, management commands) are seen.
+
+A broker for another transport (e.g. Redis pub/sub) subclasses Broker: publish()
+sends, and whatever receives calls deliver().
+"""
+import asyncio
+import logging
+import threading
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+
+from . import changes, routers
+from .models import Product, ProductChange
+
+logger = logging.getLogger(__name__)
+
+
+def tick():
+    return getattr(settings, 'CATALOG_SUBSCRIPTION_TICK', 0.25)
+
+
+def max_pending():
+    return getattr(settings, 'CATALOG_SUBSCRIPTION_MAX_PENDING', 1000)
+
+
+class Broker:
+    """Carries changed product ids from writers to the hubs that subscribed."""
+
+    def __init__(self):
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def publish(self, product_ids):
+        raise NotImplementedError
+
+    def poll(self):
+        """Called by each hub once per tick, from a thread that may use the database."""
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def deliver(self, product_ids):
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback(product_ids)
+
+
+class LocalBroker(Broker):
+    def publish(self, product_ids):
+        self.deliver(product_ids)
+
+
+class ChangeLogBroker(Broker):
+    """Follows the product change log; publishing has nothing to do."""
+    batch_size = 10000
+
+    def __init__(self):
+        super().__init__()
+        self._after = None
+
+    def publish(self, product_ids):
+        pass
+
+    def subscribe(self, callback):
+        with self._lock:
+            if not self._callbacks:
+                # Start from now, not from wherever the last listener left off
+                self._after = None
+        super().subscribe(callback)
+
+    def poll(self):
+        if self._after is None:
+            self._after = changes.latest_version()
+            return
+        rows = list(
+            ProductChange.objects.filter(id__gt=self._after, id__lte=changes.latest_version())
+            .order_by('id').values_list('id', 'product_id')[:self.batch_size]
+        )
+        if rows:
+            self._after = rows[-1][0]
+            self.deliver({product_id for _, product_id in rows})
+
+
+_broker = None
+
+
+def broker():
+    global _broker
+    path = getattr(settings, 'CATALOG_SUBSCRIPTION_BROKER', 'catalog.events.LocalBroker')
+    if _broker is None or _broker[0] != path:
+        _broker = (path, import_string(path)())
+    return _broker[1]
+
+
+def publish(product_ids):
+    product_ids = list(product_ids)
+    if product_ids:
+        broker().publish(product_ids)
+
+
+def publish_on_commit(product_ids, using=None):
+    product_ids = list(product_ids)
+    if product_ids:
+        # robust: a broker failure is logged, never raised into a write that has committed
+        transaction.on_commit(lambda: publish(product_ids), using=using, robust=True)
+
+
+class Hub:
+    """Turns one event loop's stream of changed ids into per-tick product batches."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.subscriptions = set()
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._broker = None
+        self._task = None
+
+    def notify(self, product_ids):
+        # Called by the broker, from any thread
+        with self._lock:
+            self._changed.update(product_ids)
+
+    def add(self, subscription):
+        self.subscriptions.add(subscription)
+        if self._task is None:
+            self._broker = broker()
+            self._broker.subscribe(self.notify)
+            self._task = self.loop.create_task(self.run())
+
+    def discard(self, subscription):
+        self.subscriptions.discard(subscription)
+        if not self.subscriptions and self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._broker.unsubscribe(self.notify)
+            with self._lock:
+                self._changed.clear()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(tick())
+            try:
+                products = await sync_to_async(self.collect)()
+            except Exception:
+                logger.exception("Could not load product updates")
+                await sync_to_async(close_old_connections)()
+                continue
+            if products:
+                for subscription in list(self.subscriptions):
+                    subscription.offer(products)
+
+    def collect(self):
+        """{pk: Product, or None once deleted} for the products changed since the last tick."""
+        self._broker.poll()
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        if not changed:
+            return {}
+        # A replica may not have the write yet
+        with routers.use_primary():
+            found = Product.objects.select_related('category').in_bulk(changed)
+        return {pk: found.get(pk) for pk in changed}
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def hub():
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        _hubs[loop] = Hub(loop)
+    return _hubs[loop]
+
+
+class Subscription:
+    """
+    The products one subscription watches (`accepts(pk, product)`) that changed and
+    have not been sent yet. updates() yields them as {pk: Product or None}, at most
+    once per tick.
+    """
+
+    def __init__(self, accepts):
+        self.accepts = accepts
+        self.pending = {}
+        self.overflowed = False
+        self._ready = asyncio.Event()
+
+    def offer(self, products):
+        for pk, product in products.items():
+            if self.accepts(pk, product):
+                self.pending[pk] = product
+        if len(self.pending) > max_pending():
+            self.overflowed = True
+        if self.pending or self.overflowed:
+            self._ready.set()
+
+    async def updates(self):
+        current = hub()
+        current.add(self)
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                if self.overflowed:
+                    raise Exception(
+                        "Too many updates are waiting for this subscription. Re-sync and subscribe again."
+                    )
+                batch, self.pending = self.pending, {}
+                yield batch
+        finally:
+            current.discard(self)
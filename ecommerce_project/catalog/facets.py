@@ -0,0 +1,133 @@
+"""
+Facet counts for the storefront sidebar (`productFacets`).
+
+One GROUP BY over the filtered products, by category, currency, price bucket and
+in stock, returns every non-empty combination. Each facet is then a sum over those
+rows, so the sidebar costs one query however many facets it shows. Price buckets
+are ranges of price_base split at CATALOG_FACET_PRICE_BUCKETS (or the bounds the
+client asks for).
+
+Results are cached for CATALOG_FACET_CACHE_TIMEOUT seconds (0 turns this off) under
+the catalog version, which every product write bumps, so counts are never served
+from before a write.
+"""
+import hashlib
+import json
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import BooleanField, Case, Count, IntegerField, Value, When
+
+from . import routers
+from .graphql_cache import acatalog_version, catalog_version
+
+FACETS_PREFIX = 'catalog:facets:'
+MAX_PRICE_BUCKETS = 20
+
+
+def price_bucket_bounds():
+    return getattr(settings, 'CATALOG_FACET_PRICE_BUCKETS', [10, 25, 50, 100, 250, 500, 1000])
+
+
+def cache_timeout():
+    return getattr(settings, 'CATALOG_FACET_CACHE_TIMEOUT', 300)
+
+
+def parse_bounds(bounds):
+    if bounds is None:
+        bounds = price_bucket_bounds()
+    bounds = [Decimal(str(bound)) for bound in bounds]
+    if len(bounds) > MAX_PRICE_BUCKETS:
+        raise Exception(f"At most {MAX_PRICE_BUCKETS} price bucket bounds are allowed.")
+    if any(low >= high for low, high in zip(bounds, bounds[1:])):
+        raise Exception("Price bucket bounds must be in increasing order.")
+    return bounds
+
+
+def _grouped(queryset, bounds):
+    return (
+        queryset.order_by()
+        .values(
+            'category_id',
+            'currency',
+            bucket=Case(
+                *(When(price_base__lt=bound, then=Value(index)) for index, bound in enumerate(bounds)),
+                default=Value(len(bounds)),
+                output_field=IntegerField(),
+            ),
+            in_stock=Case(When(stock_quantity__gt=0, then=Value(True)), default=Value(False), output_field=BooleanField()),
+        )
+        .annotate(count=Count('pk'))
+    )
+
+
+def compute(queryset, bounds):
+    """Facet counts for `queryset`, with price buckets split at `bounds` (increasing Decimals)."""
+    return _summarise(list(_grouped(queryset, bounds)), bounds)
+
+
+async def acompute(queryset, bounds):
+    return _summarise([row async for row in _grouped(queryset, bounds)], bounds)
+
+
+def _summarise(rows, bounds):
+    categories, currencies, buckets, stock = Counter(), Counter(), Counter(), Counter()
+    for row in rows:
+        categories[row['category_id']] += row['count']
+        currencies[row['currency']] += row['count']
+        buckets[row['bucket']] += row['count']
+        stock[bool(row['in_stock'])] += row['count']
+
+    edges = [None, *bounds, None]
+    return {
+        'total': sum(stock.values()),
+        # Largest first; category_id None is the uncategorised products
+        'categories': sorted(categories.items(), key=lambda item: (-item[1], item[0] is None, item[0] or 0)),
+        'currencies': sorted(currencies.items(), key=lambda item: (-item[1], item[0])),
+        # Every bucket, empty ones included, from cheapest to dearest
+        'price_buckets': [(edges[index], edges[index + 1], buckets[index]) for index in range(len(bounds) + 1)],
+        'in_stock': stock[True],
+        'out_of_stock': stock[False],
+    }
+
+
+def _cache_key(version, filters, bounds):
+    raw = json.dumps([filters, [str(bound) for bound in bounds]], sort_keys=True, default=str)
+    return f'{FACETS_PREFIX}{version}:{hashlib.sha256(raw.encode()).hexdigest()}'
+
+
+def product_facets(queryset, filters, bounds=None):
+    """
+    compute() for `queryset`, the products matching `filters` (the arguments it was
+    built from, which key the cache).
+    """
+    bounds = parse_bounds(bounds)
+    timeout = cache_timeout()
+    if not timeout:
+        return compute(queryset, bounds)
+
+    key = _cache_key(catalog_version(), filters, bounds)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute(queryset, bounds)
+        if not routers.replica_may_be_stale():
+            cache.set(key, facets, timeout)
+    return facets
+
+
+async def aproduct_facets(queryset, filters, bounds=None):
+    """product_facets() for the event loop."""
+    bounds = parse_bounds(bounds)
+    timeout = cache_timeout()
+    if not timeout:
+        return await acompute(queryset, bounds)
+
+    key = _cache_key(await acatalog_version(), filters, bounds)
+    facets = await cache.aget(key)
+    if facets is None:
+        facets = await acompute(queryset, bounds)
+        if not routers.replica_may_be_stale():
+            await cache.aset(key, facets, timeout)
+    return facets
@@ -0,0 +1,378 @@
+"""
+Caching layers for the /graphql/ endpoint.
+
+* Persisted queries (Apollo APQ protocol): a client may send only
+  `extensions.persistedQuery.sha256Hash`; the query text is looked up in a registry
+  kept in the cache and registered the first time the client sends both.
+* Parsed and validated documents are kept in a per-process LRU keyed by that hash,
+  together with their cost (catalog.query_cost), so a known query is never parsed,
+  validated or costed twice.
+* Anonymous query responses are cached under (hash, operation, variables, catalog
+  version). Every catalog write bumps the version, so stale entries are never read
+  again and simply expire.
+* Cacheable responses carry an ETag and answer If-None-Match with a 304.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from inspect import isawaitable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from graphene_django.settings import graphene_settings
+from graphene_django.views import MUTATION_ERRORS_FLAG, GraphQLView, HttpError
+from graphql import ExecutionResult, OperationType, execute, get_operation_ast, parse, specified_rules, validate
+from graphql.error import GraphQLError
+from graphql.execution.middleware import MiddlewareManager
+
+from . import profiling, query_cost, routers
+
+VERSION_KEY = 'catalog:version'
+PERSISTED_PREFIX = 'catalog:graphql:pq:'
+RESPONSE_PREFIX = 'catalog:graphql:response:'
+
+
+def _cache():
+    return caches[getattr(settings, 'CATALOG_GRAPHQL_CACHE', 'default')]
+
+
+def skip_response_cache(info):
+    """Called by resolvers whose result can change without a catalog write."""
+    info.context._graphql_skip_cache = True
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+def catalog_version():
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock, not 0, so an evicted counter can't come back at a
+        # number that older cached responses were stored under
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def acatalog_version():
+    cache = _cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, int(time.time() * 1000), None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version(**kwargs):
+    """Invalidate every cached GraphQL response. Also runs on commit, so a read that
+    raced the write can't store the old data under the new version."""
+    def bump():
+        try:
+            _cache().incr(VERSION_KEY)
+        except ValueError:
+            catalog_version()
+
+    bump()
+    transaction.on_commit(bump)
+
+
+class DocumentCache:
+    """Thread-safe LRU of parsed, validated documents."""
+
+    def __init__(self, size):
+        self.size = size
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            document = self.documents.get(key)
+            if document is not None:
+                self.documents.move_to_end(key)
+            return document
+
+    def set(self, key, document):
+        with self.lock:
+            self.documents[key] = document
+            self.documents.move_to_end(key)
+            while len(self.documents) > self.size:
+                self.documents.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+
+
+documents = DocumentCache(getattr(settings, 'CATALOG_GRAPHQL_DOCUMENT_CACHE_SIZE', 256))
+
+
+def _persisted_hash(request, data):
+    extensions = request.GET.get('extensions') or data.get('extensions')
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise HttpError(HttpResponseBadRequest('Extensions must be valid JSON.'))
+    persisted = (extensions or {}).get('persistedQuery') if isinstance(extensions, dict) else None
+    return persisted.get('sha256Hash') if isinstance(persisted, dict) else None
+
+
+VALIDATION_RULES = (*specified_rules, query_cost.QueryCostRule)
+
+
+def get_document(schema, query, key, validation_rules=VALIDATION_RULES):
+    """(document, {operation name: Cost}, errors) for `query`, parsed and validated once."""
+    cached = documents.get(key)
+    if cached is not None:
+        return (*cached, None)
+    try:
+        document = parse(query)
+    except GraphQLError as error:
+        return None, None, [error]
+    errors = validate(schema.graphql_schema, document, validation_rules, graphene_settings.MAX_VALIDATION_ERRORS)
+    if errors:
+        return None, None, errors
+    costs = query_cost.measure(schema.graphql_schema, document)
+    documents.set(key, (document, costs))
+    return document, costs, None
+
+
+class CachingGraphQLView(GraphQLView):
+    validation_rules = VALIDATION_RULES
+
+    def dispatch(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().dispatch(request, *args, **kwargs))
+
+    def conditional_response(self, request, response):
+        etag = getattr(request, '_graphql_etag', None)
+        if etag is None or response.status_code != 200:
+            return response
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        response['ETag'] = etag
+        # Let clients and proxies keep the body but check back before reusing it
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def get_response(self, request, data, show_graphiql=False):
+        data, key, cached = self.lookup_response(request, data)
+        if cached is not None:
+            return cached
+        result, status_code = super().get_response(request, data, show_graphiql)
+        self.store_response(request, key, result, status_code)
+        return result, status_code
+
+    def lookup_response(self, request, data):
+        """
+        Resolve a persisted query and look the response up in the cache.
+        Returns (data, cache key or None, (body, status) if answered already or None).
+        """
+        query = request.GET.get('query') or data.get('query')
+        persisted = _persisted_hash(request, data)
+        if persisted:
+            if query:
+                if query_hash(query) != persisted:
+                    raise HttpError(HttpResponseBadRequest('Provided sha256Hash does not match query.'))
+                _cache().set(PERSISTED_PREFIX + persisted, query, None)
+            else:
+                query = _cache().get(PERSISTED_PREFIX + persisted)
+                if query is None:
+                    return data, None, (self.json_encode(request, {'errors': [{
+                        'message': 'PersistedQueryNotFound',
+                        'extensions': {'code': 'PERSISTED_QUERY_NOT_FOUND'},
+                    }]}), 200)
+                data = {**{key: data.get(key) for key in data}, 'query': query}
+        if not query:
+            return data, None, None
+
+        request._graphql_query_hash = persisted or query_hash(query)
+        key = self.response_cache_key(request, data)
+        if key:
+            cached = _cache().get(key)
+            if cached is not None:
+                result, request._graphql_etag = cached
+                return data, key, (result, 200)
+        return data, key, None
+
+    def store_response(self, request, key, result, status_code):
+        if (
+            key and status_code == 200 and getattr(request, '_graphql_cacheable', False)
+            and not getattr(request, '_graphql_skip_cache', False) and not routers.replica_may_be_stale()
+        ):
+            request._graphql_etag = quote_etag(hashlib.md5(result.encode()).hexdigest())
+            _cache().set(
+                key, (result, request._graphql_etag),
+                getattr(settings, 'CATALOG_GRAPHQL_RESPONSE_CACHE_TIMEOUT', 60),
+            )
+
+    def get_middleware(self, request):
+        profile = profiling.get_profile(request)
+        if profile is None:
+            return self.middleware
+        middleware = self.middleware.middlewares if isinstance(self.middleware, MiddlewareManager) else self.middleware
+        return [*(middleware or ()), profiling.ResolverTimingMiddleware(profile)]
+
+    def json_encode(self, request, d, pretty=False):
+        cost = getattr(request, '_graphql_cost', None)
+        if cost is not None and isinstance(d, dict) and 'data' in d:
+            d = {**d, 'extensions': {'cost': {
+                'depth': cost.depth, 'estimated': cost.cost,
+                'maxDepth': query_cost.max_depth(), 'maxCost': query_cost.max_cost(),
+            }}}
+        return super().json_encode(request, d, pretty)
+
+    def response_cache_key(self, request, data):
+        """None when the response may depend on who is asking."""
+        user = getattr(request, 'user', None)
+        if self.batch or (user is not None and user.is_authenticated):
+            return None
+        _, variables, operation_name, _ = self.get_graphql_params(request, data)
+        raw = json.dumps(
+            [request._graphql_query_hash, operation_name, variables, bool(self.pretty or request.GET.get('pretty'))],
+            sort_keys=True, default=str,
+        )
+        return f'{RESPONSE_PREFIX}{catalog_version()}:{hashlib.sha256(raw.encode()).hexdigest()}'
+
+    def get_document(self, query, key):
+        return get_document(self.schema, query, key, self.validation_rules)
+
+    def prepare_execution(self, request, query, variables, operation_name, show_graphiql=False):
+        """
+        Everything before execute(): returns an ExecutionResult (or None for GraphiQL)
+        when the request ends here, else (document, operation type, execute() kwargs).
+        """
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest('Must provide query string.'))
+
+        key = getattr(request, '_graphql_query_hash', None) or query_hash(query)
+        document, costs, errors = self.get_document(query, key)
+        if errors:
+            return ExecutionResult(data=None, errors=errors)
+
+        operation_ast = get_operation_ast(document, operation_name)
+        operation = operation_ast.operation if operation_ast is not None else None
+        if operation_ast is not None:
+            request._graphql_cost = costs.get(operation_ast.name.value if operation_ast.name else None)
+        if request.method.lower() == 'get' and operation not in (None, OperationType.QUERY):
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ['POST'], f'Can only perform a {operation.value} operation from a POST request.'
+            ))
+        if operation == OperationType.SUBSCRIPTION:
+            return ExecutionResult(data=None, errors=[
+                GraphQLError('Subscriptions are only served over WebSocket, at /graphql/ws/.')
+            ])
+
+        execute_options = {
+            'root_value': self.get_root_value(request),
+            'context_value': self.get_context(request),
+            'variable_values': variables,
+            'operation_name': operation_name,
+            'middleware': self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            execute_options['execution_context_class'] = self.execution_context_class
+        return document, operation, execute_options
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        prepared = self.prepare_execution(request, query, variables, operation_name, show_graphiql)
+        if not isinstance(prepared, tuple):
+            return prepared
+        document, operation, execute_options = prepared
+
+        try:
+            if operation == OperationType.MUTATION:
+                # Mutations read what they are about to change: never from a replica
+                with routers.use_primary():
+                    if (
+                        graphene_settings.ATOMIC_MUTATIONS is True
+                        or connection.settings_dict.get('ATOMIC_MUTATIONS', False) is True
+                    ):
+                        with transaction.atomic():
+                            result = execute(self.schema.graphql_schema, document, **execute_options)
+                            if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                                transaction.set_rollback(True)
+                        return result
+                    result = execute(self.schema.graphql_schema, document, **execute_options)
+            else:
+                result = execute(self.schema.graphql_schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+        request._graphql_cacheable = operation == OperationType.QUERY and not result.errors
+        return result
+
+
+class AsyncGraphQLView(CachingGraphQLView):
+    """
+    CachingGraphQLView for ASGI: the request is executed on the event loop against a
+    schema with async resolvers (catalog.schema.async_schema), so a worker can hold
+    many requests that are waiting on the database. Batching is not supported, and
+    CATALOG_GRAPHQL_CACHE must not be a DatabaseCache (it is called from the loop).
+    """
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ('get', 'post'):
+                raise HttpError(HttpResponseNotAllowed(['GET', 'POST'], 'GraphQL only supports GET and POST requests.'))
+            data = self.parse_body(request)
+            if self.graphiql and self.can_display_graphiql(request, data):
+                # The GraphiQL page does no I/O worth awaiting; let the sync view render it
+                return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+
+            if hasattr(request, 'auser'):
+                # Load the session user now: the lazy request.user would query from the loop
+                request.user = await request.auser()
+            data, key, cached = self.lookup_response(request, data)
+            if cached is None:
+                result, status_code = self.encode_result(request, await self.aexecute_graphql_request(request, data))
+                self.store_response(request, key, result, status_code)
+            else:
+                result, status_code = cached
+            response = HttpResponse(status=status_code, content=result, content_type='application/json')
+        except HttpError as e:
+            response = e.response
+            response['Content-Type'] = 'application/json'
+            response.content = self.json_encode(request, {'errors': [self.format_error(e)]})
+            return response
+        return self.conditional_response(request, response)
+
+    async def aexecute_graphql_request(self, request, data):
+        query, variables, operation_name, _ = self.get_graphql_params(request, data)
+        prepared = self.prepare_execution(request, query, variables, operation_name)
+        if not isinstance(prepared, tuple):
+            return prepared
+        document, operation, execute_options = prepared
+        try:
+            with routers.use_primary() if operation == OperationType.MUTATION else nullcontext():
+                result = execute(self.schema.graphql_schema, document, **execute_options)
+                if isawaitable(result):
+                    result = await result
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        request._graphql_cacheable = operation == OperationType.QUERY and not result.errors
+        return result
+
+    def encode_result(self, request, execution_result):
+        # As GraphQLView.get_response: errors without a path (e.g. validation) are a 400
+        response, status_code = {}, 200
+        if execution_result.errors:
+            response['errors'] = [self.format_error(e) for e in execution_result.errors]
+        if execution_result.errors and any(not getattr(e, 'path', None) for e in execution_result.errors):
+            status_code = 400
+        else:
+            response['data'] = execution_result.data
+        return self.json_encode(request, response), status_code
@@ -0,0 +1,96 @@
+"""
+Contention-safe stock changes.
+
+Every change is a single conditional UPDATE (`stock_quantity = stock_quantity - n
+WHERE stock_quantity >= n`), so concurrent checkouts can never oversell or lose an
+update, and no row is read-then-written. Multi-item calls run in one transaction
+and touch rows in ascending primary-key order, which gives every transaction the
+same lock order and rules out deadlocks between them.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import changes, stats
+from .models import Product
+from .signals import products_bulk_written
+
+
+class StockError(Exception):
+    pass
+
+
+class InsufficientStock(StockError):
+    def __init__(self, product_id):
+        self.product_id = product_id
+        super().__init__(f"Insufficient stock for product {product_id}.")
+
+
+class ProductNotFound(StockError):
+    def __init__(self, product_id):
+        self.product_id = product_id
+        super().__init__(f"Product {product_id} not found.")
+
+
+def _normalize(items):
+    """Merge duplicate product ids and return [(product_id, quantity)] sorted by id."""
+    totals = defaultdict(int)
+    for product_id, quantity in items:
+        if quantity <= 0:
+            raise StockError("Quantities must be positive.")
+        totals[int(product_id)] += quantity
+    return sorted(totals.items())
+
+
+def _apply(deltas):
+    """
+    Apply {product_id: signed delta} atomically. Negative deltas are guarded so the
+    stock never goes below zero; a failed guard rolls back the whole call.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        for product_id, delta in deltas:
+            rows = Product.objects.filter(pk=product_id)
+            if delta < 0:
+                rows = rows.filter(stock_quantity__gte=-delta)
+            if not rows.update(stock_quantity=F('stock_quantity') + delta, updated_at=now):
+                if not Product.objects.filter(pk=product_id).exists():
+                    raise ProductNotFound(product_id)
+                raise InsufficientStock(product_id)
+
+        # Rows are locked by our UPDATEs until commit, so this read can't race;
+        # the pre-update quantity is simply the new one minus the delta
+        products = Product.objects.in_bulk([product_id for product_id, _ in deltas])
+        state_changes = []
+        for product_id, delta in deltas:
+            product = products[product_id]
+            new = stats.current_state(product)
+            state_changes.append(((new[0], new[1], new[2] - delta), new))
+        stats.apply_changes(state_changes)
+        products = [products[product_id] for product_id, _ in deltas]
+        changes.record_updated(products)
+
+    products_bulk_written.send(sender=Product, created=[], updated=products, deleted_ids=[])
+    return products
+
+
+def reserve_stock(items):
+    """
+    Take `quantity` units of each product in `items` ((product_id, quantity) pairs),
+    all or nothing. Raises InsufficientStock naming the first product that fell short.
+    """
+    return _apply([(product_id, -quantity) for product_id, quantity in _normalize(items)])
+
+
+def release_stock(items):
+    """Return previously reserved units to stock."""
+    return _apply(_normalize(items))
+
+
+def adjust_stock(product_id, delta):
+    """Add (delta > 0) or remove (delta < 0) units, e.g. for a stock count correction."""
+    if delta == 0:
+        raise StockError("Delta must not be zero.")
+    return _apply([(int(product_id), delta)])[0]
@@ -0,0 +1,173 @@
+"""
+A database-backed queue for catalog operations too big for one request or one
+transaction: deleting a large category, clearing the catalog, re-pricing after a
+rate change.
+
+enqueue() stores a Job row; `manage.py run_catalog_worker` claims queued jobs and
+runs them. A handler is a generator that does its work a chunk at a time, each
+chunk in its own short transaction, and yields (done, total) after every chunk, so
+locks are held for one chunk rather than the whole operation and progress is
+visible through GraphQL (`job(id)`). Handlers must be safe to run again from the
+start: a job whose worker dies is re-queued once its heartbeat is
+CATALOG_JOB_STALE_SECONDS old, up to CATALOG_JOB_MAX_ATTEMPTS times.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import changes, currency, stats
+from .models import Category, Job, Product, ProductChange, delete_product_rows
+from .signals import products_bulk_written
+
+logger = logging.getLogger('catalog.jobs')
+
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def chunk_size():
+    return getattr(settings, 'CATALOG_JOB_CHUNK_SIZE', 1000)
+
+
+def enqueue(kind, **params):
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'.")
+    return Job.objects.create(kind=kind, params=params)
+
+
+def requeue_stale():
+    """Give the jobs of workers that stopped responding to another worker, or fail them."""
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=getattr(settings, 'CATALOG_JOB_STALE_SECONDS', 300)),
+    )
+    stale.filter(attempts__gte=getattr(settings, 'CATALOG_JOB_MAX_ATTEMPTS', 3)).update(
+        status=Job.FAILED, error="The worker stopped responding.", finished_at=now,
+    )
+    stale.update(status=Job.QUEUED, worker='')
+
+
+def claim(worker):
+    """Mark the oldest queued job as running on `worker` and return it, or None."""
+    requeue_stale()
+    while True:
+        pk = Job.objects.filter(status=Job.QUEUED).order_by('id').values_list('pk', flat=True).first()
+        if pk is None:
+            return None
+        now = timezone.now()
+        # A conditional UPDATE: of several workers racing for the row, exactly one wins
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+
+
+def run(job):
+    """Run a claimed job to the end, recording progress after every chunk."""
+    try:
+        func = HANDLERS.get(job.kind)
+        if func is None:
+            raise ValueError(f"Unknown job kind '{job.kind}'.")
+        steps = func(**job.params)
+        while True:
+            try:
+                job.progress, job.total = next(steps)
+            except StopIteration as stop:
+                job.result = stop.value
+                break
+            job.heartbeat_at = timezone.now()
+            Job.objects.filter(pk=job.pk).update(progress=job.progress, total=job.total, heartbeat_at=job.heartbeat_at)
+        job.status = Job.SUCCEEDED
+        job.error = ''
+    except Exception as exc:
+        logger.exception("Job %s failed", job)
+        job.status = Job.FAILED
+        job.error = str(exc) or exc.__class__.__name__
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'progress', 'total', 'result', 'error', 'finished_at'])
+    return job
+
+
+def run_pending(worker='inline'):
+    """Run queued jobs in this thread until there are none; returns them."""
+    finished = []
+    while (job := claim(worker)) is not None:
+        finished.append(run(job))
+    return finished
+
+
+# --- Handlers ---
+
+@handler('delete_category')
+def delete_category(category_id):
+    """Uncategorise the category's products a chunk at a time (as SET_NULL would), then delete it."""
+    total = Product.objects.filter(category_id=category_id).count()
+    done = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Product.objects.select_for_update().filter(category_id=category_id).order_by('pk')
+                .values_list('pk', 'price_base', 'stock_quantity')[:chunk_size()]
+            )
+            if not rows:
+                # Only signals and an empty stats row are left to handle
+                Category.objects.filter(pk=category_id).delete()
+                return {'uncategorised': done}
+            pks = [pk for pk, _, _ in rows]
+            Product.objects.filter(pk__in=pks).update(category=None, updated_at=timezone.now())
+            deltas = stats.Deltas()
+            for _, price_base, stock_quantity in rows:
+                deltas.add(category_id, price_base, stock_quantity, sign=-1)
+                deltas.add(None, price_base, stock_quantity)
+            deltas.apply()
+            changes.record(pks, ProductChange.UPDATED)
+        products_bulk_written.send(sender=Product, created=[], updated=[Product(pk=pk) for pk in pks], deleted_ids=[])
+        done += len(rows)
+        yield done, max(total, done)
+
+
+@handler('clear_catalog')
+def clear_catalog():
+    """Delete every product a chunk at a time, then every category."""
+    total = Product.objects.count()
+    done = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Product.objects.select_for_update().order_by('pk')
+                .values_list('pk', 'category_id', 'price_base', 'stock_quantity')[:chunk_size()]
+            )
+            if not rows:
+                Category.objects.all().delete()
+                stats.rebuild()
+                return {'deleted': done}
+            pks = [row[0] for row in rows]
+            # As DeleteProducts does: no per-row post_delete, its work is done in bulk below
+            delete_product_rows(pks)
+            deltas = stats.Deltas()
+            for _, category_id, price_base, stock_quantity in rows:
+                deltas.add(category_id, price_base, stock_quantity, sign=-1)
+            deltas.apply()
+            changes.record_deleted(pks)
+        products_bulk_written.send(sender=Product, created=[], updated=[], deleted_ids=pks)
+        done += len(rows)
+        yield done, max(total, done)
+
+
+@handler('reprice')
+def reprice(currencies):
+    """Recompute price_base for the products in `currencies` (after a rate change)."""
+    repriced = yield from currency.iter_reprice(currencies, chunk_size())
+    return {'repriced': repriced}
@@ -0,0 +1,198 @@
+import asyncio
+from collections import defaultdict
+
+from . import product_cache
+from .models import Category, Product
+from .pagination import first_per_parent
+
+
+class BatchLoader:
+    """
+    Per-request loader keyed by primary key.
+
+    The sync GraphQL executor resolves list items one at a time, so there is no
+    event loop tick to collect keys on. Instead, list resolvers queue the keys
+    they know will be needed and the first load() fetches all of them in one query.
+    Results are cached for the lifetime of the loader (i.e. the request).
+    """
+
+    def __init__(self, batch_load_fn, default=None):
+        self.batch_load_fn = batch_load_fn
+        self.default = default
+        self._cache = {}
+        self._queue = set()
+
+    def queue(self, keys):
+        self._queue.update(key for key in keys if key is not None and key not in self._cache)
+
+    def prime(self, key, value):
+        self._cache.setdefault(key, value)
+
+    def clear(self, key=None):
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def load(self, key):
+        if key is None:
+            return self.default() if callable(self.default) else self.default
+        if key not in self._cache:
+            self._queue.add(key)
+            self._dispatch()
+        return self._cache[key]
+
+    def load_many(self, keys):
+        self.queue(keys)
+        return [self.load(key) for key in keys]
+
+    def _dispatch(self):
+        keys = list(self._queue)
+        self._queue.clear()
+        results = self.batch_load_fn(keys)
+        for key in keys:
+            if key in results:
+                self._cache[key] = results[key]
+            else:
+                self._cache[key] = self.default() if callable(self.default) else self.default
+
+
+class CatalogLoaders:
+    """All DataLoaders for the catalog schema, one instance per request."""
+
+    def __init__(self):
+        self.category_by_id = BatchLoader(self._load_categories)
+        self.product_by_id = BatchLoader(self._load_products)
+        self.products_by_category = BatchLoader(self._load_products_by_category, default=list)
+
+    def _load_categories(self, ids):
+        return Category.objects.in_bulk(ids)
+
+    def _load_products(self, ids):
+        products = product_cache.get_products(ids)
+        self.category_by_id.queue(p.category_id for p in products.values())
+        return products
+
+    def _load_products_by_category(self, category_ids):
+        grouped = defaultdict(list)
+        for product in first_per_parent(Product.objects.filter(category_id__in=category_ids), 'category_id'):
+            grouped[product.category_id].append(product)
+            self.product_by_id.prime(product.pk, product)
+        # The parent category of every product here is already known to the caller
+        self.category_by_id.queue(category_ids)
+        return grouped
+
+
+class AsyncBatchLoader:
+    """
+    Loader for the async executor. load() returns a future; every key requested
+    while the executor fans out over a list (i.e. within one event loop tick) is
+    fetched by a single call to the async `batch_load_fn`.
+    """
+
+    def __init__(self, batch_load_fn, default=None):
+        self.batch_load_fn = batch_load_fn
+        self.default = default
+        self._futures = {}
+        self._pending = []
+        self._tasks = set()
+
+    def _default(self):
+        return self.default() if callable(self.default) else self.default
+
+    def prime(self, key, value):
+        if key not in self._futures:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            self._futures[key] = future
+
+    def clear(self, key=None):
+        if key is None:
+            self._futures.clear()
+        else:
+            self._futures.pop(key, None)
+
+    def load(self, key):
+        loop = asyncio.get_running_loop()
+        if key is None:
+            future = loop.create_future()
+            future.set_result(self._default())
+            return future
+        future = self._futures.get(key)
+        if future is None:
+            future = self._futures[key] = loop.create_future()
+            self._pending.append(key)
+            if len(self._pending) == 1:
+                loop.call_soon(self._schedule)
+        return future
+
+    async def load_many(self, keys):
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def _schedule(self):
+        task = asyncio.ensure_future(self._dispatch())
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self):
+        keys, self._pending = self._pending, []
+        try:
+            results = await self.batch_load_fn(keys)
+        except Exception as exc:
+            for key in keys:
+                self._futures.pop(key).set_exception(exc)
+            return
+        for key in keys:
+            self._futures[key].set_result(results[key] if key in results else self._default())
+
+
+class AsyncCatalogLoaders:
+    """Async counterpart of CatalogLoaders, used when resolving under ASGI."""
+
+    def __init__(self):
+        self.category_by_id = AsyncBatchLoader(self._load_categories)
+        self.product_by_id = AsyncBatchLoader(self._load_products)
+        self.products_by_category = AsyncBatchLoader(self._load_products_by_category, default=list)
+
+    async def _load_categories(self, ids):
+        return await Category.objects.ain_bulk(ids)
+
+    async def _load_products(self, ids):
+        return await product_cache.aget_products(ids)
+
+    async def _load_products_by_category(self, category_ids):
+        grouped = defaultdict(list)
+        async for product in first_per_parent(Product.objects.filter(category_id__in=category_ids), 'category_id'):
+            grouped[product.category_id].append(product)
+            self.product_by_id.prime(product.pk, product)
+        return grouped
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def get_loaders(info):
+    """
+    Return the loaders attached to the current request, creating them on first use.
+    Resolvers running on the event loop (async view) get AsyncCatalogLoaders; sync
+    code, including mutations run through sync_to_async, gets CatalogLoaders.
+    """
+    context = info.context
+    loaders_class, name = (
+        (AsyncCatalogLoaders, 'catalog_async_loaders') if _in_event_loop() else (CatalogLoaders, 'catalog_loaders')
+    )
+    if context is None:
+        return loaders_class()
+    if isinstance(context, dict):
+        return context.setdefault(name, loaders_class())
+    loaders = getattr(context, f'_{name}', None)
+    if loaders is None:
+        loaders = loaders_class()
+        setattr(context, f'_{name}', loaders)
+    return loaders
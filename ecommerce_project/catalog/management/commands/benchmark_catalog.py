@@ -0,0 +1,307 @@
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Min
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, setup_databases, setup_test_environment, \
+    teardown_databases, teardown_test_environment
+from datetime import datetime, timezone
+from io import StringIO
+import json
+import math
+import platform
+import random
+import time
+import django
+from catalog import inventory
+from catalog.models import Category, Product
+from catalog.views import AnalyticsDashboardView
+
+
+PERCENTILES = (50, 90, 95, 99)
+
+PRODUCT_FIELDS = 'id name price currency stockQuantity'
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(timings, queries):
+    timings = sorted(timings)
+    result = {f'p{p}_ms': round(percentile(timings, p) * 1000, 3) for p in PERCENTILES}
+    result.update({
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'queries_max': max(queries),
+        'samples': len(timings),
+    })
+    return result
+
+
+def compare(baseline, current, threshold=0.2, metric='p95_ms'):
+    """
+    Return one line per regression: an operation whose `metric` grew by more than
+    `threshold` (a fraction) or that now issues more queries per request.
+    """
+    regressions = []
+    for size, dataset in current['datasets'].items():
+        before = baseline['datasets'].get(size, {}).get('operations', {})
+        for name, now in dataset['operations'].items():
+            old = before.get(name)
+            if old is None:
+                continue
+            if old[metric] and now[metric] > old[metric] * (1 + threshold):
+                regressions.append(
+                    f'{size} {name}: {metric} {old[metric]} -> {now[metric]} '
+                    f'(+{(now[metric] / old[metric] - 1) * 100:.0f}%)'
+                )
+            if now['queries_max'] > old['queries_max']:
+                regressions.append(f"{size} {name}: queries {old['queries_max']} -> {now['queries_max']}")
+    return regressions
+
+
+class Benchmark:
+    """
+    Times representative GraphQL operations and the dashboard against whatever
+    products are in the current database. Each operation's per-iteration setup
+    (e.g. creating the product a delete will remove) is not timed.
+    """
+
+    def __init__(self, iterations=50, warmup=5, seed=0, warm_cache=False):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.rng = random.Random(seed)
+        self.warm_cache = warm_cache
+        self.client = Client(HTTP_ACCEPT='application/json')
+
+    def run(self):
+        bounds = Product.objects.aggregate(low=Min('id'), high=Max('id'))
+        self.low, self.high = bounds['low'] or 0, bounds['high'] or 0
+        self.category_ids = list(Category.objects.values_list('pk', flat=True))
+        return {name: self.measure(prepare) for name, prepare in self.operations()}
+
+    def measure(self, prepare):
+        timings, queries = [], []
+        for i in range(self.warmup + self.iterations):
+            run = prepare()
+            if not self.warm_cache:
+                cache.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+            if i >= self.warmup:
+                timings.append(elapsed)
+                queries.append(len(ctx.captured_queries))
+        return summarize(timings, queries)
+
+    def product_id(self):
+        return self.rng.randint(self.low, self.high)
+
+    def category_id(self):
+        return self.rng.choice(self.category_ids)
+
+    def graphql(self, query, **variables):
+        def run():
+            response = self.client.post(
+                '/graphql/', json.dumps({'query': query, 'variables': variables}), content_type='application/json'
+            )
+            body = response.json()
+            if response.status_code != 200 or body.get('errors'):
+                raise CommandError(f'GraphQL operation failed: {body.get("errors")}')
+        return run
+
+    def new_products(self, count):
+        category = Category.objects.get(pk=self.category_id())
+        products = [
+            Product(name=f'Benchmark {i}', description='', price=1, currency='USD', category=category)
+            for i in range(count)
+        ]
+        Product.objects.bulk_create(products)
+        return [p.pk for p in products]
+
+    def product_input(self):
+        return {
+            'name': 'Benchmark product', 'description': '', 'price': round(self.rng.uniform(1, 500), 2),
+            'currency': 'USD', 'stockQuantity': self.rng.randint(0, 100), 'categoryId': self.category_id(),
+        }
+
+    def operations(self):
+        yield 'products.filtered', lambda: self.graphql(
+            'query($c: ID) { products(categoryId: $c, minPrice: 10, maxPrice: 60) { %s } }' % PRODUCT_FIELDS,
+            c=self.category_id(),
+        )
+        yield 'productsConnection.page', lambda: self.graphql(
+            'query($c: ID) { productsConnection(first: 20, categoryId: $c, orderBy: "-price") '
+            '{ edges { node { %s } } pageInfo { endCursor } } }' % PRODUCT_FIELDS,
+            c=self.category_id(),
+        )
+        yield 'products.search', lambda: self.graphql(
+            'query($q: String) { products(search: $q) { id name } }',
+            q=self.rng.choice(['laptop', 'pro', 'organic honey', 'smart', 'yoga mat']),
+        )
+        yield 'product.detail', lambda: self.graphql(
+            'query($id: ID!) { product(id: $id) { %s category { name } } }' % PRODUCT_FIELDS,
+            id=self.product_id(),
+        )
+        yield 'categories.products', lambda: self.graphql('{ categories { name products { id name price } } }')
+
+        yield 'createProduct', lambda: self.graphql(
+            'mutation($c: ID!) { createProduct(name: "Benchmark", description: "", price: 9.99, '
+            'currency: "USD", categoryId: $c) { product { id } } }',
+            c=self.category_id(),
+        )
+        yield 'updateProduct', lambda: self.graphql(
+            'mutation($id: ID!) { updateProduct(id: $id, name: "Benchmark update") { product { id } } }',
+            id=self.product_id(),
+        )
+        yield 'deleteProduct', lambda: self.graphql(
+            'mutation($id: ID!) { deleteProduct(id: $id) { ok } }', id=self.new_products(1)[0],
+        )
+        yield 'createProducts', lambda: self.graphql(
+            'mutation($p: [ProductInput!]!) { createProducts(products: $p) { products { id } } }',
+            p=[self.product_input() for _ in range(20)],
+        )
+        yield 'updateProducts', lambda: self.graphql(
+            'mutation($p: [ProductUpdateInput!]!) { updateProducts(products: $p) { products { id } } }',
+            p=[{'id': self.product_id(), 'stockQuantity': self.rng.randint(0, 100)} for _ in range(20)],
+        )
+        yield 'deleteProducts', lambda: self.graphql(
+            'mutation($ids: [ID!]!) { deleteProducts(ids: $ids) { deletedCount } }', ids=self.new_products(20),
+        )
+        yield 'reserveStock', self.prepare_reserve
+        yield 'releaseStock', lambda: self.graphql(
+            'mutation($i: [StockItemInput!]!) { releaseStock(items: $i) { ok } }',
+            i=[{'productId': self.product_id(), 'quantity': 1}],
+        )
+        yield 'adjustStock', lambda: self.graphql(
+            'mutation($id: ID!) { adjustStock(productId: $id, delta: 1) { product { stockQuantity } } }',
+            id=self.product_id(),
+        )
+        yield 'dashboard', self.prepare_dashboard
+
+    def prepare_reserve(self):
+        product_id = self.product_id()
+        # Make sure there is a unit to take
+        inventory.release_stock([(product_id, 1)])
+        return self.graphql(
+            'mutation($i: [StockItemInput!]!) { reserveStock(items: $i) { ok } }',
+            i=[{'productId': product_id, 'quantity': 1}],
+        )
+
+    def prepare_dashboard(self):
+        # The template needs the admin's own context; what we time is the data work
+        request = RequestFactory().get('/admin/analytics/')
+        request.user = User(is_active=True, is_staff=True, is_superuser=True)
+        view = AnalyticsDashboardView(model_admin=admin.site._registry[Product])
+        view.setup(request)
+        return view.get_context_data
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark catalog GraphQL operations and the analytics dashboard on seeded data sets, '
+        'or compare two result files'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=int,
+            nargs='+',
+            default=[10000],
+            help='Data set sizes to seed and benchmark, e.g. 10000 100000 1000000 (default: 10000)'
+        )
+        parser.add_argument('--iterations', type=int, default=50, help='Timed runs per operation (default: 50)')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed runs per operation first (default: 5)')
+        parser.add_argument('--seed', type=int, default=42, help='Seed for the data sets and the workload')
+        parser.add_argument(
+            '--warm-cache',
+            action='store_true',
+            help='Keep Django caches between runs (default: clear them, timing the database work)'
+        )
+        parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Keep the benchmark database between runs (needs DATABASES TEST NAME on SQLite)'
+        )
+        parser.add_argument(
+            '--compare',
+            nargs=2,
+            metavar=('BASELINE', 'CURRENT'),
+            help='Compare two result files instead of running; exits non-zero on regressions'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.2,
+            help='Allowed p95 slowdown as a fraction when comparing (default: 0.2)'
+        )
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            return self.compare(*options['compare'], options['threshold'])
+
+        # Always a throwaway test database: seeding clears the product table
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def run(self, options):
+        results = {
+            'meta': {
+                'started_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'seed': options['seed'],
+                'warm_cache': options['warm_cache'],
+            },
+            'datasets': {},
+        }
+        for size in options['products']:
+            self.stderr.write(f'Seeding {size} products...')
+            call_command(
+                'create_products', products=size, clear=True, seed=options['seed'],
+                batch_size=5000, stdout=StringIO(),
+            )
+            self.stderr.write(f'Benchmarking {size} products...')
+            benchmark = Benchmark(options['iterations'], options['warmup'], options['seed'], options['warm_cache'])
+            results['datasets'][str(size)] = {'operations': benchmark.run()}
+        return results
+
+    def compare(self, baseline_path, current_path, threshold):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        with open(current_path) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, threshold)
+        for line in regressions:
+            self.stdout.write(self.style.ERROR(line))
+        if regressions:
+            raise CommandError(f'{len(regressions)} regression(s) against {baseline_path}')
+        self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,166 @@
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from io import StringIO
+from types import SimpleNamespace
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from catalog.management.commands.benchmark_catalog import percentile
+from catalog.models import Category, Product
+from catalog.schema import schema
+from catalog.sqlite import PROFILES
+
+
+READ_QUERIES = [
+    'query($c: ID) { productsConnection(first: 20, categoryId: $c, orderBy: "-price") '
+    '{ edges { node { id name price category { name } } } } }',
+    'query($c: ID) { products(categoryId: $c, minPrice: 10, maxPrice: 60) { id name price } }',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent GraphQL readers and writers against a throwaway SQLite file, once per '
+        'connection profile, and report throughput, latency and lock errors'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000, help='Products to seed (default: 20000)')
+        parser.add_argument('--readers', type=int, default=8, help='Reader threads (default: 8)')
+        parser.add_argument('--writers', type=int, default=4, help='Writer threads (default: 4)')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per profile (default: 10)')
+        parser.add_argument(
+            '--profiles',
+            nargs='+',
+            default=['default', *PROFILES],
+            choices=['default', *PROFILES],
+            help="Profiles to compare; 'default' is SQLite as Django configures it"
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Seed for the data set and the workload')
+        parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_sqlite needs a SQLite default database')
+        if options['readers'] < 0 or options['writers'] < 0 or options['readers'] + options['writers'] == 0:
+            raise CommandError('Need at least one reader or writer thread')
+
+        # An in-memory test database has no journal to tune: use a file
+        test_settings = connection.settings_dict['TEST']
+        old_name = test_settings.get('NAME')
+        with tempfile.TemporaryDirectory() as directory:
+            test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+            try:
+                self.stderr.write(f"Seeding {options['products']} products...")
+                call_command(
+                    'create_products', products=options['products'], clear=True, seed=options['seed'],
+                    batch_size=5000, stdout=StringIO(),
+                )
+                results = {
+                    'products': options['products'],
+                    'readers': options['readers'],
+                    'writers': options['writers'],
+                    'duration_s': options['duration'],
+                    'profiles': {},
+                }
+                for name in options['profiles']:
+                    self.stderr.write(f'Running the {name} profile...')
+                    results['profiles'][name] = self.run(name, options)
+            finally:
+                connections.close_all()
+                teardown_databases(old_config, verbosity=0)
+                test_settings['NAME'] = old_name
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def run(self, name, options):
+        profile = '' if name == 'default' else name
+        with override_settings(CATALOG_SQLITE_PROFILE=profile, CATALOG_SQLITE_PRAGMAS={}):
+            connection.close()
+            if not profile:
+                # WAL is a property of the file and outlives the connection that set it
+                with connection.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode = DELETE')
+                connection.close()
+            product_ids = list(Product.objects.values_list('pk', flat=True))
+            category_ids = list(Category.objects.values_list('pk', flat=True))
+            connection.close()
+
+            deadline = time.perf_counter() + options['duration']
+            lock = threading.Lock()
+            timings = {'read': [], 'write': []}
+            errors = []
+
+            def worker(kind, seed):
+                rng = random.Random(seed)
+                try:
+                    while time.perf_counter() < deadline:
+                        if kind == 'read':
+                            query, variables = rng.choice(READ_QUERIES), {'c': rng.choice(category_ids)}
+                        else:
+                            query, variables = self.write_operation(rng, product_ids, category_ids)
+                        start = time.perf_counter()
+                        result = schema.execute(query, variables=variables, context_value=SimpleNamespace())
+                        elapsed = time.perf_counter() - start
+                        with lock:
+                            if result.errors:
+                                errors.append(str(result.errors[0]))
+                            else:
+                                timings[kind].append(elapsed)
+                finally:
+                    connections.close_all()
+
+            threads = [
+                threading.Thread(target=worker, args=(kind, options['seed'] + i))
+                for i, kind in enumerate(['read'] * options['readers'] + ['write'] * options['writers'])
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            cache.clear()
+
+        result = {'errors': len(errors), 'locked_errors': sum('locked' in e for e in errors)}
+        for kind, values in timings.items():
+            values.sort()
+            result[kind] = {
+                'ops': len(values),
+                'ops_per_s': round(len(values) / elapsed, 1),
+                **{f'p{p}_ms': round((percentile(values, p) or 0) * 1000, 3) for p in (50, 95, 99)},
+            }
+        if errors:
+            result['first_error'] = errors[0]
+        return result
+
+    @staticmethod
+    def write_operation(rng, product_ids, category_ids):
+        roll = rng.random()
+        if roll < 0.4:
+            return (
+                'mutation($i: [StockItemInput!]!) { releaseStock(items: $i) { ok } }',
+                {'i': [{'productId': pk, 'quantity': 1} for pk in rng.sample(product_ids, 3)]},
+            )
+        if roll < 0.8:
+            return (
+                'mutation($p: [ProductUpdateInput!]!) { updateProducts(products: $p) { products { id } } }',
+                {'p': [{'id': pk, 'price': round(rng.uniform(1, 500), 2)} for pk in rng.sample(product_ids, 10)]},
+            )
+        return (
+            'mutation($id: ID!) { updateProduct(id: $id, stockQuantity: 5) { product { id } } }',
+            {'id': rng.choice(product_ids)},
+        )
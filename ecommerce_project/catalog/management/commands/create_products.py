@@ -1,8 +1,139 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 from decimal import Decimal
 import random
-from catalog.models import Category, Product  
+from catalog import changes, jobs, stats
+from catalog.graphql_cache import bump_catalog_version
+from catalog.models import Category, Product
+from catalog.views import invalidate_dashboard_cache
+
+
+CATEGORIES_DATA = [
+    {
+        'name': 'Electronics',
+        'description': 'Electronic devices and gadgets'
+    },
+    {
+        'name': 'Clothing',
+        'description': 'Apparel and fashion items'
+    },
+    {
+        'name': 'Books',
+        'description': 'Books and educational materials'
+    },
+    {
+        'name': 'Home & Garden',
+        'description': 'Home improvement and garden supplies'
+    },
+    {
+        'name': 'Sports & Fitness',
+        'description': 'Sports equipment and fitness gear'
+    },
+    {
+        'name': 'Beauty & Health',
+        'description': 'Beauty products and health supplements'
+    },
+    {
+        'name': 'Toys & Games',
+        'description': 'Toys and entertainment products'
+    },
+    {
+        'name': 'Food & Beverages',
+        'description': 'Food items and beverages'
+    }
+]
+
+# Sample product data for each category
+PRODUCT_TEMPLATES = {
+    'Electronics': [
+        'Smartphone', 'Laptop', 'Headphones', 'Smart Watch', 'Tablet',
+        'Camera', 'Gaming Console', 'Smart TV', 'Bluetooth Speaker', 'Power Bank'
+    ],
+    'Clothing': [
+        'T-Shirt', 'Jeans', 'Dress', 'Jacket', 'Sneakers',
+        'Hoodie', 'Shorts', 'Blouse', 'Suit', 'Hat'
+    ],
+    'Books': [
+        'Programming Guide', 'Novel', 'Cookbook', 'Biography', 'Science Textbook',
+        'History Book', 'Self-Help Book', 'Children\'s Book', 'Dictionary', 'Art Book'
+    ],
+    'Home & Garden': [
+        'Garden Tools', 'Lamp', 'Cushion', 'Plant Pot', 'Kitchen Utensils',
+        'Vacuum Cleaner', 'Curtains', 'Carpet', 'Storage Box', 'Wall Clock'
+    ],
+    'Sports & Fitness': [
+        'Running Shoes', 'Yoga Mat', 'Dumbbells', 'Tennis Racket', 'Basketball',
+        'Fitness Tracker', 'Protein Powder', 'Water Bottle', 'Gym Bag', 'Resistance Bands'
+    ],
+    'Beauty & Health': [
+        'Face Cream', 'Shampoo', 'Lipstick', 'Vitamins', 'Perfume',
+        'Sunscreen', 'Hair Mask', 'Body Lotion', 'Essential Oil', 'Makeup Brush'
+    ],
+    'Toys & Games': [
+        'Board Game', 'Action Figure', 'Puzzle', 'Building Blocks', 'Doll',
+        'Remote Control Car', 'Video Game', 'Stuffed Animal', 'Art Supplies', 'Musical Toy'
+    ],
+    'Food & Beverages': [
+        'Organic Honey', 'Coffee Beans', 'Green Tea', 'Chocolate', 'Olive Oil',
+        'Pasta', 'Spices Set', 'Energy Drink', 'Protein Bar', 'Fruit Juice'
+    ]
+}
+
+# Price range per category
+PRICE_RANGES = {
+    'Electronics': (50, 2000),
+    'Clothing': (10, 300),
+    'Books': (5, 50),
+    'Home & Garden': (15, 500),
+    'Sports & Fitness': (20, 400),
+    'Beauty & Health': (8, 150),
+    'Toys & Games': (5, 100),
+    'Food & Beverages': (3, 80)
+}
+
+VARIATIONS = ['Pro', 'Premium', 'Deluxe', 'Standard', 'Mini', 'Max', 'Plus']
+
+DESCRIPTIONS = [
+    "High-quality {} perfect for daily use.",
+    "Premium {} with excellent features and durability.",
+    "Professional-grade {} for enthusiasts.",
+    "Affordable {} with great value for money.",
+    "Latest model {} with advanced technology."
+]
+
+# Currency options
+CURRENCIES = ['USD', 'NGN', 'EUR', 'GBP']
+
+
+def generate_rows(start, count, categories, seed=None):
+    """
+    Yield `count` product rows as plain tuples, numbered from `start`.
+
+    Each batch gets its own RNG derived from (seed, start), so a seeded run produces
+    the same rows whether batches are generated inline or across worker processes.
+    `categories` is a list of (id, name) pairs.
+    """
+    rng = random.Random(None if seed is None else f'{seed}:{start}')
+    for number in range(start, start + count):
+        category_id, category_name = rng.choice(categories)
+        base_name = rng.choice(PRODUCT_TEMPLATES.get(category_name, ['Generic Product']))
+        min_price, max_price = PRICE_RANGES.get(category_name, (10, 100))
+        yield (
+            f"{base_name} {rng.choice(VARIATIONS)} {rng.randint(1, 999)}",
+            rng.choice(DESCRIPTIONS).format(base_name.lower()),
+            Decimal(str(round(rng.uniform(min_price, max_price), 2))),
+            rng.choice(CURRENCIES),
+            f"https://example.com/images/{base_name.lower().replace(' ', '-')}-{number + 1}.jpg",
+            rng.randint(0, 1000),
+            category_id,
+        )
+
+
+def generate_batch(start, count, categories, seed=None):
+    # Top-level so it can be pickled into a worker process
+    return list(generate_rows(start, count, categories, seed))
 
 
 class Command(BaseCommand):
@@ -18,176 +149,83 @@ class Command(BaseCommand):
         parser.add_argument(
             '--batch-size',
             type=int,
-            default=50,
-            help='Batch size for bulk creation (default: 50)'
+            default=1000,
+            help='Rows per bulk insert; each batch is committed on its own (default: 1000)'
         )
         parser.add_argument(
             '--clear',
             action='store_true',
             help='Clear existing products and categories before creating new ones'
         )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help='Random seed for reproducible data sets'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Generate batches in this many processes while one writer inserts them (default: 0, inline)'
+        )
 
     def handle(self, *args, **options):
         products_count = options['products']
         batch_size = options['batch_size']
         clear_existing = options['clear']
+        seed = options['seed']
+        workers = options['workers']
+
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
 
         if clear_existing:
             self.stdout.write('Clearing existing products and categories...')
-            Product.objects.all().delete()
-            Category.objects.all().delete()
+            # In chunks, each its own transaction, so readers and writers are not
+            # locked out for the whole delete
+            for done, total in jobs.clear_catalog():
+                self.stdout.write(f'Deleted {done}/{total} products...')
 
         # Create categories first
         self.stdout.write('Creating categories...')
-        categories_data = [
-            {
-                'name': 'Electronics',
-                'description': 'Electronic devices and gadgets'
-            },
-            {
-                'name': 'Clothing',
-                'description': 'Apparel and fashion items'
-            },
-            {
-                'name': 'Books',
-                'description': 'Books and educational materials'
-            },
-            {
-                'name': 'Home & Garden',
-                'description': 'Home improvement and garden supplies'
-            },
-            {
-                'name': 'Sports & Fitness',
-                'description': 'Sports equipment and fitness gear'
-            },
-            {
-                'name': 'Beauty & Health',
-                'description': 'Beauty products and health supplements'
-            },
-            {
-                'name': 'Toys & Games',
-                'description': 'Toys and entertainment products'
-            },
-            {
-                'name': 'Food & Beverages',
-                'description': 'Food items and beverages'
-            }
-        ]
-
-        # Create categories using bulk_create
-        categories_to_create = []
-        for cat_data in categories_data:
-            category, created = Category.objects.get_or_create(
+        for cat_data in CATEGORIES_DATA:
+            Category.objects.get_or_create(
                 name=cat_data['name'],
                 defaults={'description': cat_data['description']}
             )
-            if created:
-                categories_to_create.append(category)
 
-        categories = list(Category.objects.all())
+        categories = list(Category.objects.order_by('pk').values_list('pk', 'name'))
         self.stdout.write(f'Created/Found {len(categories)} categories')
 
-        # Sample product data for each category
-        product_templates = {
-            'Electronics': [
-                'Smartphone', 'Laptop', 'Headphones', 'Smart Watch', 'Tablet',
-                'Camera', 'Gaming Console', 'Smart TV', 'Bluetooth Speaker', 'Power Bank'
-            ],
-            'Clothing': [
-                'T-Shirt', 'Jeans', 'Dress', 'Jacket', 'Sneakers',
-                'Hoodie', 'Shorts', 'Blouse', 'Suit', 'Hat'
-            ],
-            'Books': [
-                'Programming Guide', 'Novel', 'Cookbook', 'Biography', 'Science Textbook',
-                'History Book', 'Self-Help Book', 'Children\'s Book', 'Dictionary', 'Art Book'
-            ],
-            'Home & Garden': [
-                'Garden Tools', 'Lamp', 'Cushion', 'Plant Pot', 'Kitchen Utensils',
-                'Vacuum Cleaner', 'Curtains', 'Carpet', 'Storage Box', 'Wall Clock'
-            ],
-            'Sports & Fitness': [
-                'Running Shoes', 'Yoga Mat', 'Dumbbells', 'Tennis Racket', 'Basketball',
-                'Fitness Tracker', 'Protein Powder', 'Water Bottle', 'Gym Bag', 'Resistance Bands'
-            ],
-            'Beauty & Health': [
-                'Face Cream', 'Shampoo', 'Lipstick', 'Vitamins', 'Perfume',
-                'Sunscreen', 'Hair Mask', 'Body Lotion', 'Essential Oil', 'Makeup Brush'
-            ],
-            'Toys & Games': [
-                'Board Game', 'Action Figure', 'Puzzle', 'Building Blocks', 'Doll',
-                'Remote Control Car', 'Video Game', 'Stuffed Animal', 'Art Supplies', 'Musical Toy'
-            ],
-            'Food & Beverages': [
-                'Organic Honey', 'Coffee Beans', 'Green Tea', 'Chocolate', 'Olive Oil',
-                'Pasta', 'Spices Set', 'Energy Drink', 'Protein Bar', 'Fruit Juice'
-            ]
-        }
-
-        # Currency options
-        currencies = ['USD', 'NGN', 'EUR', 'GBP']
-
         self.stdout.write(f'Creating {products_count} products in batches of {batch_size}...')
 
         products_created = 0
-        
-        with transaction.atomic():
-            while products_created < products_count:
-                current_batch_size = min(batch_size, products_count - products_created)
-                products_batch = []
-
-                for i in range(current_batch_size):
-                    # Select random category
-                    category = random.choice(categories)
-                    
-                    # Get product templates for this category
-                    templates = product_templates.get(category.name, ['Generic Product'])
-                    base_name = random.choice(templates)
-                    
-                    # Add variation to product name
-                    variations = ['Pro', 'Premium', 'Deluxe', 'Standard', 'Mini', 'Max', 'Plus']
-                    product_name = f"{base_name} {random.choice(variations)} {random.randint(1, 999)}"
-                    
-                    # Generate random price based on category
-                    price_ranges = {
-                        'Electronics': (50, 2000),
-                        'Clothing': (10, 300),
-                        'Books': (5, 50),
-                        'Home & Garden': (15, 500),
-                        'Sports & Fitness': (20, 400),
-                        'Beauty & Health': (8, 150),
-                        'Toys & Games': (5, 100),
-                        'Food & Beverages': (3, 80)
-                    }
-                    
-                    min_price, max_price = price_ranges.get(category.name, (10, 100))
-                    price = Decimal(str(round(random.uniform(min_price, max_price), 2)))
-                    
-                    # Generate product description
-                    descriptions = [
-                        f"High-quality {base_name.lower()} perfect for daily use.",
-                        f"Premium {base_name.lower()} with excellent features and durability.",
-                        f"Professional-grade {base_name.lower()} for enthusiasts.",
-                        f"Affordable {base_name.lower()} with great value for money.",
-                        f"Latest model {base_name.lower()} with advanced technology."
-                    ]
-                    
-                    product = Product(
-                        name=product_name,
-                        description=random.choice(descriptions),
-                        price=price,
-                        currency=random.choice(currencies),
-                        image_url=f"https://example.com/images/{base_name.lower().replace(' ', '-')}-{i+1}.jpg",
-                        stock_quantity=random.randint(0, 1000),
-                        category=category
-                    )
-                    
-                    products_batch.append(product)
-
-                # Bulk create the batch
+        for rows in self.iter_batches(products_count, batch_size, categories, seed, workers):
+            products_batch = [
+                Product(
+                    name=name,
+                    description=description,
+                    price=price,
+                    currency=currency,
+                    image_url=image_url,
+                    stock_quantity=stock_quantity,
+                    category_id=category_id,
+                )
+                for name, description, price, currency, image_url, stock_quantity, category_id in rows
+            ]
+            # Commit per batch so memory, WAL/undo and lock time stay bounded
+            with transaction.atomic():
                 Product.objects.bulk_create(products_batch)
-                products_created += len(products_batch)
-                
-                self.stdout.write(f'Created {products_created}/{products_count} products...')
+                stats.record_created(products_batch)
+                changes.record_created(products_batch)
+            products_created += len(products_batch)
+
+            self.stdout.write(f'Created {products_created}/{products_count} products...')
+
+        # bulk_create doesn't send post_save, so drop the cached dashboard and
+        # GraphQL responses explicitly
+        invalidate_dashboard_cache()
+        bump_catalog_version()
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -197,6 +235,26 @@ class Command(BaseCommand):
 
         # Display summary
         self.stdout.write('\nSummary by category:')
-        for category in categories:
-            count = category.products.count()
-            self.stdout.write(f'  {category.name}: {count} products')
\ No newline at end of file
+        counts = dict(
+            Category.objects.filter(stats__isnull=False).values_list('name', 'stats__product_count')
+        )
+        for _, name in categories:
+            self.stdout.write(f'  {name}: {counts.get(name, 0)} products')
+
+    def iter_batches(self, total, batch_size, categories, seed, workers):
+        starts = range(0, total, batch_size)
+        if workers <= 0:
+            for start in starts:
+                yield generate_batch(start, min(batch_size, total - start), categories, seed)
+            return
+
+        # Keep a bounded number of batches in flight so memory stays flat however
+        # far the generators get ahead of the writer
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for start in starts:
+                pending.append(pool.submit(generate_batch, start, min(batch_size, total - start), categories, seed))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
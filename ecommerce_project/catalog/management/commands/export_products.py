@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from decimal import Decimal
+import csv
+import json
+import sys
+from catalog.models import Product
+from catalog.management.commands.import_products import COLUMNS, detect_format
+
+
+def encode(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+class Command(BaseCommand):
+    help = 'Stream every product to a CSV or JSON Lines file that import_products can read back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, or '-' for stdout")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows fetched from the database cursor at a time (default: 2000)'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path, options['format']) if path != '-' else (options['format'] or 'jsonl')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        columns = list(COLUMNS) + ['created_at', 'updated_at']
+        lookups = [('category__name' if column == 'category' else column) for column in columns]
+        # values_list + iterator(): no model instances and no full result cache,
+        # so memory stays flat however large the catalog is
+        rows = Product.objects.order_by('pk').values_list(*lookups).iterator(chunk_size=options['chunk_size'])
+
+        stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        exported = 0
+        try:
+            if fmt == 'csv':
+                writer = csv.writer(stream)
+                writer.writerow(columns)
+                for row in rows:
+                    writer.writerow([encode(value) for value in row])
+                    exported += 1
+            else:
+                for row in rows:
+                    stream.write(json.dumps(dict(zip(columns, map(encode, row))), ensure_ascii=False))
+                    stream.write('\n')
+                    exported += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        if path != '-':
+            self.stdout.write(self.style.SUCCESS(f'Exported {exported} products to {path}'))
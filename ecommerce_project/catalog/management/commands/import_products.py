@@ -0,0 +1,272 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.utils import timezone
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import csv
+import io
+import json
+import sys
+from catalog import changes, stats
+from catalog.currency import rates, to_base
+from catalog.models import Category, Product, ProductChange
+from catalog.signals import products_bulk_written
+from catalog.validation import product_field_error
+
+
+# Columns an import file may carry; `category` is the category *name*
+COLUMNS = ('id', 'name', 'description', 'price', 'currency', 'image_url', 'stock_quantity', 'category')
+REQUIRED = ('name', 'price')
+UPDATE_FIELDS = [
+    'name', 'description', 'price', 'currency', 'price_base', 'image_url', 'stock_quantity', 'category', 'updated_at',
+]
+
+
+def detect_format(path, fmt):
+    if fmt:
+        return fmt
+    if path.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if path.endswith('.csv'):
+        return 'csv'
+    raise CommandError('Cannot tell the file format from its name; pass --format csv|jsonl')
+
+
+def read_records(stream, fmt):
+    """Yield (line_number, dict) pairs without loading the whole file."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        missing = [column for column in REQUIRED if column not in (reader.fieldnames or [])]
+        if missing:
+            raise CommandError(f"CSV header is missing required column(s): {', '.join(missing)}")
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as exc:
+                    yield line_number, exc
+
+
+class RowError(ValueError):
+    pass
+
+
+def clean_record(record, category_ids, exchange_rates):
+    """Validate one input record into Product field values; raises RowError."""
+    if isinstance(record, Exception):
+        raise RowError(f'invalid JSON ({record})')
+    if not isinstance(record, dict):
+        raise RowError('expected an object')
+    values = {}
+    for column in REQUIRED:
+        if record.get(column) in (None, ''):
+            raise RowError(f"'{column}' is required")
+
+    raw_id = record.get('id')
+    try:
+        values['id'] = int(raw_id) if raw_id not in (None, '') else None
+        price = Decimal(str(record['price']))
+        values['stock_quantity'] = int(record.get('stock_quantity') or 0)
+    except (ValueError, InvalidOperation):
+        raise RowError('id, price and stock_quantity must be numbers')
+
+    values['name'] = str(record['name'])
+    values['description'] = record.get('description') or ''
+    values['currency'] = str(record.get('currency') or 'USD').upper()
+    # The checks the bulk mutations make, so a bad row is skipped rather than failing its batch
+    error = product_field_error({**values, 'price': price}, exchange_rates)
+    if error:
+        raise RowError(error)
+    values['price'] = price.quantize(Decimal('0.01'))
+    values['price_base'] = to_base(values['price'], values['currency'], exchange_rates)
+    values['image_url'] = record.get('image_url') or None
+
+    category_name = record.get('category') or None
+    values['category_id'] = category_ids[category_name] if category_name else None
+    return values
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Upsert products from a CSV or JSON Lines file, streaming it in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Rows per upsert statement and transaction (default: 2000)'
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='On PostgreSQL, use INSERT ... ON CONFLICT instead of COPY'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path, options['format']) if path != '-' else (options['format'] or 'jsonl')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        self.using = router.db_for_write(Product)
+        self.use_copy = connections[self.using].vendor == 'postgresql' and not options['no_copy']
+        # name -> id for every category; new names are created on first sight
+        self.category_ids = dict(Category.objects.using(self.using).values_list('name', 'pk'))
+        self.exchange_rates = rates()
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        imported = skipped = 0
+        try:
+            for batch in chunked(read_records(stream, fmt), batch_size):
+                self.create_missing_categories(batch)
+                rows = []
+                for line_number, record in batch:
+                    try:
+                        rows.append(clean_record(record, self.category_ids, self.exchange_rates))
+                    except RowError as exc:
+                        skipped += 1
+                        self.stderr.write(f'Line {line_number}: skipped, {exc}')
+                if rows:
+                    # The same id twice in one upsert is an error on PostgreSQL; last one wins
+                    rows = list({row['id'] if row['id'] is not None else -i: row
+                                 for i, row in enumerate(rows, start=1)}.values())
+                    self.write_batch(rows)
+                    imported += len(rows)
+                    self.stdout.write(f'Imported {imported} products...')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if imported:
+            self.reset_sequence()
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} products, skipped {skipped}'))
+
+    def create_missing_categories(self, batch):
+        names = {
+            record.get('category') for _, record in batch
+            if isinstance(record, dict) and record.get('category')
+        }
+        missing = names - self.category_ids.keys()
+        if missing:
+            Category.objects.using(self.using).bulk_create(
+                [Category(name=name) for name in missing], ignore_conflicts=True
+            )
+            self.category_ids.update(
+                Category.objects.using(self.using).filter(name__in=missing).values_list('name', 'pk')
+            )
+
+    def write_batch(self, rows):
+        with transaction.atomic(using=self.using):
+            # Read what the touched rows held so CategoryStats gets exact deltas
+            ids = [row['id'] for row in rows if row['id'] is not None]
+            before = {
+                pk: (category_id, price_base, stock_quantity)
+                for pk, category_id, price_base, stock_quantity in Product.objects.using(self.using)
+                .filter(pk__in=ids).values_list('pk', 'category_id', 'price_base', 'stock_quantity')
+            }
+            if self.use_copy:
+                created_ids = self.copy_upsert(rows)
+            else:
+                products = [Product(**row) for row in rows]
+                Product.objects.using(self.using).bulk_create(
+                    products,
+                    update_conflicts=True,
+                    unique_fields=['id'],
+                    update_fields=UPDATE_FIELDS,
+                )
+                # Rows without an id were inserted and had their new pk set
+                created_ids = [p.pk for p, row in zip(products, rows) if row['id'] is None]
+
+            deltas = stats.Deltas()
+            for row in rows:
+                old = before.get(row['id'])
+                if old is not None:
+                    deltas.add(*old, sign=-1)
+                deltas.add(row['category_id'], row['price_base'], row['stock_quantity'])
+            deltas.apply()
+            # Upserts of an id that didn't exist yet are logged as updates too
+            changes.record(created_ids, ProductChange.CREATED, self.using)
+            changes.record([row['id'] for row in rows if row['id'] is not None], ProductChange.UPDATED, self.using)
+        products_bulk_written.send(
+            sender=Product, created=[], updated=[Product(**row) for row in rows if row['id'] is not None], deleted_ids=[]
+        )
+
+    def copy_upsert(self, rows):
+        """
+        PostgreSQL fast path: COPY the batch into a temp table, then merge it with a
+        single INSERT ... SELECT ... ON CONFLICT. Returns the ids of the rows that
+        had none and were inserted.
+        """
+        connection = connections[self.using]
+        now = timezone.now()
+        columns = [
+            'id', 'name', 'description', 'price', 'currency', 'price_base', 'image_url', 'stock_quantity', 'category_id',
+        ]
+        data_columns = columns[1:]
+        assignments = ', '.join(f'{c} = EXCLUDED.{c}' for c in data_columns + ['updated_at'])
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS catalog_product_import '
+                '(LIKE catalog_product INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'
+            )
+            cursor.execute('ALTER TABLE catalog_product_import ALTER COLUMN id DROP NOT NULL')
+            self._copy(cursor, 'catalog_product_import', columns, [[row[c] for c in columns] for row in rows])
+            # Rows without an id are plain inserts and take the next sequence value
+            cursor.execute(
+                f"INSERT INTO catalog_product ({', '.join(data_columns)}, created_at, updated_at) "
+                f"SELECT {', '.join(data_columns)}, %s, %s FROM catalog_product_import WHERE id IS NULL "
+                f"RETURNING id",
+                [now, now],
+            )
+            created_ids = [pk for (pk,) in cursor.fetchall()]
+            cursor.execute(
+                f"INSERT INTO catalog_product ({', '.join(columns)}, created_at, updated_at) "
+                f"SELECT {', '.join(columns)}, %s, %s FROM catalog_product_import WHERE id IS NOT NULL "
+                f"ON CONFLICT (id) DO UPDATE SET {assignments}",
+                [now, now],
+            )
+        return created_ids
+
+    @staticmethod
+    def _copy(cursor, table, columns, values):
+        raw = cursor.cursor
+        sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+        if hasattr(raw, 'copy'):
+            # psycopg 3
+            with raw.copy(sql) as copy:
+                for row in values:
+                    copy.write_row(row)
+        else:
+            # psycopg2
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in values:
+                writer.writerow(['\\N' if v is None else v for v in row])
+            buffer.seek(0)
+            raw.copy_expert(f"{sql} WITH (FORMAT csv, NULL '\\N')", buffer)
+
+    def reset_sequence(self):
+        # Explicit ids don't advance the PostgreSQL sequence
+        connection = connections[self.using]
+        statements = connection.ops.sequence_reset_sql(no_style(), [Product])
+        if statements:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
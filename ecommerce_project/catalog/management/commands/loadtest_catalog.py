@@ -0,0 +1,125 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import http.client
+import itertools
+import json
+import random
+import threading
+import time
+from catalog.management.commands.benchmark_catalog import percentile
+from catalog.models import Category, Product
+
+
+PRODUCT_QUERY = 'query($id: ID!) { product(id: $id) { id name price stockQuantity category { name } } }'
+PAGE_QUERY = (
+    'query($c: ID) { productsConnection(first: 20, categoryId: $c, orderBy: "-price") '
+    '{ edges { node { id name price } } } }'
+)
+CATEGORIES_QUERY = '{ categories { id name } }'
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive a running server with concurrent catalog reads and report throughput and latency. '
+        'Run it once against the WSGI deployment (/graphql/) and once against the ASGI one '
+        '(/graphql/async/) to compare them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='GraphQL endpoint, e.g. http://127.0.0.1:8000/graphql/async/')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight (default: 50)')
+        parser.add_argument('--requests', type=int, default=2000, help='Total requests to send (default: 2000)')
+        parser.add_argument('--seed', type=int, default=42, help='Seed for the request mix')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+        parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise CommandError('url must be an absolute http(s) URL')
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be at least 1')
+
+        # Variables are drawn from this database, which should be the one the server uses
+        bounds = Product.objects.aggregate(low=Min('id'), high=Max('id'))
+        category_ids = list(Category.objects.values_list('pk', flat=True))
+        if bounds['high'] is None:
+            raise CommandError('No products to query; seed some with create_products first')
+        rng = random.Random(options['seed'])
+        bodies = [self.request_body(rng, bounds, category_ids) for _ in range(options['requests'])]
+
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        next_index = itertools.count()
+        lock = threading.Lock()
+        latencies, errors = [], []
+
+        def worker():
+            connection = connection_class(url.hostname, url.port, timeout=options['timeout'])
+            try:
+                while True:
+                    with lock:
+                        index = next(next_index)
+                    if index >= len(bodies):
+                        return
+                    start = time.perf_counter()
+                    try:
+                        connection.request('POST', url.path or '/', bodies[index], {
+                            'Content-Type': 'application/json', 'Accept': 'application/json',
+                        })
+                        response = connection.getresponse()
+                        response.read()
+                        ok = response.status == 200
+                    except (OSError, http.client.HTTPException) as exc:
+                        ok = False
+                        connection.close()
+                        connection = connection_class(url.hostname, url.port, timeout=options['timeout'])
+                        response = exc
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        latencies.append(elapsed)
+                        if not ok:
+                            errors.append(str(getattr(response, 'status', response)))
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for future in [pool.submit(worker) for _ in range(options['concurrency'])]:
+                future.result()
+        duration = time.perf_counter() - started
+
+        latencies.sort()
+        results = {
+            'url': options['url'],
+            'concurrency': options['concurrency'],
+            'requests': len(latencies),
+            'errors': len(errors),
+            'duration_s': round(duration, 3),
+            'throughput_rps': round(len(latencies) / duration, 1),
+            **{f'p{p}_ms': round(percentile(latencies, p) * 1000, 3) for p in (50, 90, 95, 99)},
+            'max_ms': round(latencies[-1] * 1000, 3),
+        }
+        if errors:
+            self.stderr.write(f'{len(errors)} failed request(s), e.g. {errors[0]}')
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    @staticmethod
+    def request_body(rng, bounds, category_ids):
+        # Mostly product pages, then listing pages, then the category menu
+        roll = rng.random()
+        if roll < 0.6:
+            body = {'query': PRODUCT_QUERY, 'variables': {'id': rng.randint(bounds['low'], bounds['high'])}}
+        elif roll < 0.9:
+            body = {'query': PAGE_QUERY, 'variables': {'c': rng.choice(category_ids) if category_ids else None}}
+        else:
+            body = {'query': CATEGORIES_QUERY}
+        return json.dumps(body)
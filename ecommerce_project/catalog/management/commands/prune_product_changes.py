@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import changes
+
+
+class Command(BaseCommand):
+    help = 'Delete product change-feed entries older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Keep this many days of changes (default: CATALOG_CHANGE_LOG_RETENTION_DAYS)'
+        )
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = getattr(settings, 'CATALOG_CHANGE_LOG_RETENTION_DAYS', 30)
+        if days < 0:
+            raise CommandError('--days cannot be negative')
+        deleted = changes.prune(days)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} product changes older than {days} days'))
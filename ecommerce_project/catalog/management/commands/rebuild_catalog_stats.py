@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from catalog import stats
+from catalog.models import CategoryStats
+from catalog.views import invalidate_dashboard_cache
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-category statistics used by the analytics dashboard'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding category stats from the product table...')
+        stats.rebuild()
+        invalidate_dashboard_cache()
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt stats for {CategoryStats.objects.count()} categories')
+        )
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from concurrent.futures import ThreadPoolExecutor
+import os
+import signal
+import socket
+import threading
+from catalog import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued catalog jobs (category deletes, catalog clears, re-pricing) on a pool of threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=1,
+            help='Jobs to run at the same time (default: 1). On SQLite, more than one needs '
+                 'CATALOG_SQLITE_PROFILE=production so concurrent writers wait for the lock'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds an idle thread waits before looking for new jobs (default: 1)'
+        )
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1:
+            raise CommandError('--threads must be at least 1')
+
+        stop = threading.Event()
+        previous = {}
+        if threading.current_thread() is threading.main_thread():
+            # Finish the jobs in hand, then exit; a killed worker's jobs are re-queued
+            # once their heartbeat goes stale
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous[signum] = signal.signal(signum, lambda *args: stop.set())
+
+        name = f'{socket.gethostname()}:{os.getpid()}'
+        self.stdout.write(f"Worker {name} running {options['threads']} thread(s)")
+        try:
+            if options['threads'] == 1:
+                self.work(f'{name}:0', stop, options['poll_interval'], options['once'])
+            else:
+                with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                    futures = [
+                        pool.submit(self.work, f'{name}:{i}', stop, options['poll_interval'], options['once'])
+                        for i in range(options['threads'])
+                    ]
+                    for future in futures:
+                        future.result()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f'Worker {name} stopped'))
+
+    def work(self, worker, stop, poll_interval, once):
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                job = jobs.claim(worker)
+                if job is None:
+                    if once:
+                        return
+                    stop.wait(poll_interval)
+                    continue
+                self.stdout.write(f'{worker}: running {job.kind} #{job.pk}')
+                job = jobs.run(job)
+                if job.status == job.SUCCEEDED:
+                    self.stdout.write(f'{worker}: {job.kind} #{job.pk} done: {job.result}')
+                else:
+                    self.stderr.write(f'{worker}: {job.kind} #{job.pk} failed: {job.error}')
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from decimal import Decimal, InvalidOperation
+from catalog import jobs
+from catalog.currency import base_currency, rates, reprice, store_rates
+
+
+class Command(BaseCommand):
+    help = 'Show or change exchange rates to the base currency, re-pricing the affected products'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'rates',
+            nargs='*',
+            metavar='CODE=RATE',
+            help='Value of one unit of CODE in the base currency, e.g. EUR=1.08 NGN=0.00065'
+        )
+        parser.add_argument(
+            '--background',
+            action='store_true',
+            help='Queue the re-pricing for run_catalog_worker instead of doing it now'
+        )
+
+    def handle(self, *args, **options):
+        new_rates = {}
+        for item in options['rates']:
+            code, _, rate = item.partition('=')
+            try:
+                new_rates[code.strip().upper()] = Decimal(rate)
+            except InvalidOperation:
+                raise CommandError(f"Expected CODE=RATE, got '{item}'")
+            if len(code.strip()) != 3:
+                raise CommandError(f"'{code}' is not a 3-letter currency code")
+
+        if new_rates:
+            try:
+                changed = store_rates(new_rates)
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            if options['background']:
+                job = jobs.enqueue('reprice', currencies=changed)
+                self.stdout.write(self.style.SUCCESS(f'Updated {len(new_rates)} rate(s), re-pricing as job {job.pk}'))
+            else:
+                repriced = reprice(changed)
+                self.stdout.write(self.style.SUCCESS(f'Updated {len(new_rates)} rate(s), re-priced {repriced} products'))
+
+        base = base_currency()
+        for code, rate in sorted(rates().items()):
+            self.stdout.write(f'1 {code} = {rate.normalize():f} {base}')
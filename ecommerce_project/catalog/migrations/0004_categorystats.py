@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+
+
+def populate_stats(apps, schema_editor):
+    Product = apps.get_model('catalog', 'Product')
+    CategoryStats = apps.get_model('catalog', 'CategoryStats')
+    rows = Product.objects.order_by().values('category_id').annotate(
+        product_count=Count('id'),
+        in_stock_count=Count('id', filter=Q(stock_quantity__gt=0)),
+        low_stock_count=Count('id', filter=Q(stock_quantity__gt=0, stock_quantity__lte=10)),
+        stock_quantity_sum=Sum('stock_quantity'),
+        price_sum=Sum('price'),
+        stock_value=Sum(F('price') * F('stock_quantity')),
+    )
+    CategoryStats.objects.bulk_create([
+        CategoryStats(**{key: value or 0 for key, value in row.items() if key != 'category_id'},
+                      category_id=row['category_id'])
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0003_product_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_count', models.IntegerField(default=0)),
+                ('in_stock_count', models.IntegerField(default=0)),
+                ('low_stock_count', models.IntegerField(default=0)),
+                ('stock_quantity_sum', models.BigIntegerField(default=0)),
+                ('price_sum', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('stock_value', models.DecimalField(decimal_places=2, default=0, max_digits=24)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='catalog.category')),
+            ],
+            options={
+                'verbose_name_plural': 'Category stats',
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import DecimalField, F, Sum, Value
+from django.db.models.functions import Round
+
+
+def seed_rates_and_price_products(apps, schema_editor):
+    ExchangeRate = apps.get_model('catalog', 'ExchangeRate')
+    Product = apps.get_model('catalog', 'Product')
+    CategoryStats = apps.get_model('catalog', 'CategoryStats')
+
+    base = getattr(settings, 'CATALOG_BASE_CURRENCY', 'USD')
+    rates = {code.upper(): Decimal(str(rate)) for code, rate in getattr(settings, 'CATALOG_EXCHANGE_RATES', {}).items()}
+    rates.pop(base, None)
+    ExchangeRate.objects.bulk_create([ExchangeRate(currency=code, rate=rate) for code, rate in rates.items()])
+    rates[base] = Decimal(1)
+
+    missing = set(Product.objects.order_by().values_list('currency', flat=True).distinct()) - rates.keys()
+    if missing:
+        raise RuntimeError(
+            f"Products use currencies with no exchange rate: {', '.join(sorted(missing))}. "
+            "Add them to settings.CATALOG_EXCHANGE_RATES and migrate again."
+        )
+    for code, rate in rates.items():
+        Product.objects.filter(currency=code).update(price_base=Round(
+            F('price') * Value(rate, output_field=DecimalField()), 2,
+            output_field=DecimalField(max_digits=16, decimal_places=2),
+        ))
+
+    # The price totals become base-currency totals
+    totals = Product.objects.order_by().values('category_id').annotate(
+        price_sum=Sum('price_base'), stock_value=Sum(F('price_base') * F('stock_quantity')),
+    )
+    for row in totals:
+        CategoryStats.objects.filter(category_id=row['category_id']).update(
+            price_sum=row['price_sum'] or 0, stock_value=row['stock_value'] or 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_categorystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3, unique=True)),
+                ('rate', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='price_base',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=16, null=True),
+        ),
+        migrations.RunPython(seed_rates_and_price_products, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='price_base',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=16),
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_category_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_price_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price_base'], name='product_category_base_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price_base', 'id'], name='product_base_id_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def log_existing_products(apps, schema_editor):
+    # The log starts with every product as "created", so a new consumer can sync
+    # the whole catalog from the feed
+    ProductChange = apps.get_model('catalog', 'ProductChange')
+    table = ProductChange._meta.db_table
+    schema_editor.execute(
+        f"INSERT INTO {table} (product_id, op, changed_at) "
+        f"SELECT id, 'created', updated_at FROM catalog_product ORDER BY id"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField()),
+                ('op', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=7)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(log_existing_products, migrations.RunPython.noop),
+    ]
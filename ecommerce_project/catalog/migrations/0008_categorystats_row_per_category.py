@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:04
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+FIELDS = ('product_count', 'in_stock_count', 'low_stock_count', 'stock_quantity_sum', 'price_sum', 'stock_value')
+
+
+def one_row_per_category(apps, schema_editor):
+    # Merge any duplicate uncategorised rows left by racing writers, then give every
+    # category (and the uncategorised products) a row up front
+    Category = apps.get_model('catalog', 'Category')
+    CategoryStats = apps.get_model('catalog', 'CategoryStats')
+    uncategorised = list(CategoryStats.objects.filter(category__isnull=True).order_by('pk'))
+    if uncategorised:
+        keep, *duplicates = uncategorised
+        for row in duplicates:
+            for field in FIELDS:
+                setattr(keep, field, getattr(keep, field) + getattr(row, field))
+        keep.save()
+        CategoryStats.objects.filter(pk__in=[row.pk for row in duplicates]).delete()
+    else:
+        CategoryStats.objects.create(category=None)
+    have = set(CategoryStats.objects.filter(category__isnull=False).values_list('category_id', flat=True))
+    CategoryStats.objects.bulk_create([
+        CategoryStats(category_id=pk) for pk in Category.objects.values_list('pk', flat=True) if pk not in have
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_productchange'),
+    ]
+
+    operations = [
+        migrations.RunPython(one_row_per_category, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='categorystats',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('category', 0), name='categorystats_one_row_per_category'),
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 class Category(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -10,11 +13,60 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class ExchangeRate(models.Model):
+    """What one unit of `currency` is worth in settings.CATALOG_BASE_CURRENCY.
+    Change rates through catalog.currency.set_rates, which re-prices the catalog."""
+    currency = models.CharField(max_length=3, unique=True)
+    rate = models.DecimalField(max_digits=20, decimal_places=10)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def clean(self):
+        from . import currency
+
+        # What store_rates() would refuse, as form errors
+        self.currency = self.currency.upper()
+        if self.rate is not None:
+            try:
+                currency.check_rate(self.currency, self.rate)
+            except ValueError as error:
+                raise ValidationError({'rate': str(error)})
+
+    def __str__(self):
+        return f"{self.currency} = {self.rate}"
+
+class ProductQuerySet(models.QuerySet):
+    # bulk_create()/bulk_update() skip save(), so price_base is kept in step here
+
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False, update_conflicts=False,
+                    update_fields=None, unique_fields=None):
+        from . import currency
+
+        objs = list(objs)
+        currency.set_base_prices(objs)
+        if update_fields and {'price', 'currency'} & set(update_fields) and 'price_base' not in update_fields:
+            update_fields = [*update_fields, 'price_base']
+        return super().bulk_create(
+            objs, batch_size=batch_size, ignore_conflicts=ignore_conflicts, update_conflicts=update_conflicts,
+            update_fields=update_fields, unique_fields=unique_fields,
+        )
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        from . import currency
+
+        if {'price', 'currency'} & set(fields):
+            objs = list(objs)
+            currency.set_base_prices(objs)
+            if 'price_base' not in fields:
+                fields = [*fields, 'price_base']
+        return super().bulk_update(objs, fields, batch_size=batch_size)
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, default='USD') # e.g., 'USD', 'NGN'
+    # `price` in settings.CATALOG_BASE_CURRENCY; what filters, ordering and totals use
+    price_base = models.DecimalField(max_digits=16, decimal_places=2, editable=False)
     image_url = models.URLField(blank=True, null=True)
     stock_quantity = models.PositiveIntegerField(default=0)
     category = models.ForeignKey(
@@ -26,5 +78,141 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Each index matches a hot access pattern; see QueryPlanTests
+        indexes = [
+            models.Index(fields=['category', 'price_base'], name='product_category_base_idx'),  # products(categoryId, min/maxPrice)
+            models.Index(fields=['price_base', 'id'], name='product_base_id_idx'),  # order_by price + keyset cursor
+            models.Index(fields=['stock_quantity', 'id'], name='product_stock_id_idx'),  # dashboard stock filters
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),  # admin / keyset by created_at
+            models.Index(fields=['updated_at', 'id'], name='product_updated_id_idx'),  # keyset by updated_at
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),  # keyset by name
+        ]
+
+    def clean(self):
+        from . import currency
+
+        # save() could not price it; say so on the form rather than raise UnknownCurrency
+        if self.currency not in currency.rates():
+            raise ValidationError({'currency': f"No exchange rate for currency '{self.currency}'. Add one first."})
+
+    def save(self, *args, **kwargs):
+        from . import currency
+
+        currency.set_base_prices([self])
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'price', 'currency'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'price_base'}
+        # The stats signals lock and read the row in pre_save and apply the delta in post_save
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Product, instance=self)):
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+def delete_product_rows(pks):
+    """
+    Delete the products with these pks in plain DELETE statements, without loading
+    them or sending pre_delete/post_delete, for the bulk delete paths. Nothing has a
+    foreign key to Product, so there is nothing to cascade, and the search index
+    triggers still fire. The caller does what the Product delete receivers would:
+
+    * CategoryStats: stats.Deltas with sign=-1
+    * the change feed and subscriptions: changes.record_deleted()
+    * products_bulk_written, which covers the product cache, the dashboard cache,
+      the GraphQL response cache and replica stickiness
+    """
+    pks = list(pks)
+    connection = connections[router.db_for_write(Product)]
+    table = connection.ops.quote_name(Product._meta.db_table)
+    column = connection.ops.quote_name(Product._meta.pk.column)
+    batch_size = connection.ops.bulk_batch_size([Product._meta.pk], pks) or len(pks)
+    with connection.cursor() as cursor:
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            cursor.execute(
+                f"DELETE FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(batch))})", batch
+            )
+
+class CategoryStats(models.Model):
+    """
+    Running totals per category, kept up to date by catalog.stats so the dashboard
+    reads one row per category instead of aggregating the product table.
+    The row with category=None holds uncategorised products.
+    """
+    category = models.OneToOneField(
+        Category,
+        on_delete=models.CASCADE,
+        related_name='stats',
+        null=True,
+    )
+    product_count = models.IntegerField(default=0)
+    in_stock_count = models.IntegerField(default=0)
+    low_stock_count = models.IntegerField(default=0) # 1-10 units left
+    stock_quantity_sum = models.BigIntegerField(default=0)
+    price_sum = models.DecimalField(max_digits=20, decimal_places=2, default=0) # in the base currency, as is stock_value
+    stock_value = models.DecimalField(max_digits=24, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Category stats"
+        constraints = [
+            # Also allows only one category=None row, which the column's own unique does not
+            models.UniqueConstraint(Coalesce('category', 0), name='categorystats_one_row_per_category'),
+        ]
+
+    def __str__(self):
+        return f"Stats for {self.category or 'uncategorised products'}"
+
+class Job(models.Model):
+    """
+    A heavy catalog operation run in chunks by `manage.py run_catalog_worker`.
+    Enqueue and run jobs through catalog.jobs.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.IntegerField(default=0) # items done so far
+    total = models.IntegerField(null=True) # items to do, once known
+    result = models.JSONField(null=True)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    # Touched after every chunk: a running job that stops updating has lost its worker
+    heartbeat_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_status_id_idx'),  # workers claim the oldest queued job
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+class ProductChange(models.Model):
+    """
+    The product change log: one row per product written or deleted, by every write
+    path (see catalog.changes). `id` only grows, so it is the version consumers sync from.
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    OP_CHOICES = [(CREATED, 'Created'), (UPDATED, 'Updated'), (DELETED, 'Deleted')]
+
+    product_id = models.BigIntegerField() # not a foreign key: deletes are logged too
+    op = models.CharField(max_length=7, choices=OP_CHOICES)
+    changed_at = models.DateTimeField(default=timezone.now)
+
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return f"{self.op} product {self.product_id} (version {self.pk})"
@@ -0,0 +1,110 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+from .pagination import first_per_parent
+
+
+def collect_fields(info, field_nodes):
+    """
+    Merge the sub-selections of `field_nodes` into {snake_case_name: [FieldNode, ...]},
+    expanding named and inline fragments along the way.
+    """
+    fields = {}
+
+    def visit(selection_set):
+        if selection_set is None:
+            return
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                fields.setdefault(to_snake_case(selection.name.value), []).append(selection)
+            elif isinstance(selection, InlineFragmentNode):
+                visit(selection.selection_set)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = info.fragments.get(selection.name.value)
+                if fragment is not None:
+                    visit(fragment.selection_set)
+
+    for node in field_nodes:
+        visit(node.selection_set)
+    return fields
+
+
+def _plan(model, info, field_nodes, prefix, required=(), skip=()):
+    """
+    Work out the only()/select_related()/prefetch_related() arguments for `model`
+    reached via the lookup `prefix`. Returns (only, select_related, prefetches);
+    `only` is None when a selected field is not a plain model field, in which case
+    every column is loaded so custom resolvers keep working.
+    """
+    only = [prefix + model._meta.pk.name]
+    only.extend(prefix + name for name in required)
+    select_related = []
+    prefetches = []
+    defer_safe = True
+
+    for name, nodes in collect_fields(info, field_nodes).items():
+        if name.startswith('__') or name in skip:
+            continue
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            defer_safe = False
+            continue
+
+        if field.is_relation and (field.many_to_one or field.one_to_one) and field.concrete:
+            # Forward FK: join it in and restrict the joined columns as well
+            lookup = prefix + field.name
+            only.append(lookup)
+            select_related.append(lookup)
+            sub_only, sub_related, sub_prefetches = _plan(
+                field.related_model, info, nodes, lookup + '__'
+            )
+            if sub_only is None:
+                # Can't combine a partial only() with a fully loaded joined model
+                sub_only = [lookup + '__' + f.attname for f in field.related_model._meta.concrete_fields]
+            only.extend(sub_only)
+            select_related.extend(sub_related)
+            prefetches.extend(sub_prefetches)
+        elif field.is_relation and (field.one_to_many or field.many_to_many):
+            # Reverse FK / M2M: fetch in one extra query shaped by the nested selection
+            related_model = field.related_model
+            remote = [field.field.name] if field.one_to_many else []
+            if set(remote) & set(collect_fields(info, nodes)):
+                # Children point back at this instance through the prefetch cache,
+                # so it must not come back with deferred columns
+                defer_safe = False
+            queryset = optimize_queryset(
+                related_model._default_manager.all(), info, nodes, required=remote, skip=remote
+            )
+            if field.one_to_many:
+                queryset = first_per_parent(queryset, field.field.attname)
+            prefetches.append(Prefetch(prefix + field.name, queryset=queryset))
+        else:
+            only.append(prefix + field.attname)
+
+    return (only if defer_safe else None), select_related, prefetches
+
+
+def optimize_queryset(queryset, info, field_nodes=None, required=(), skip=()):
+    """
+    Narrow `queryset` to what the GraphQL selection set actually asks for:
+    unrequested columns are deferred, forward relations are joined with
+    select_related() and reverse relations are prefetched.
+
+    `field_nodes` defaults to the fields being resolved (`info.field_nodes`);
+    pass nested nodes when the model sits deeper in the result, e.g. a connection.
+    """
+    if field_nodes is None:
+        field_nodes = info.field_nodes
+    only, select_related, prefetches = _plan(
+        queryset.model, info, field_nodes, '', required, skip
+    )
+    if only is not None:
+        queryset = queryset.only(*dict.fromkeys(only))
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    return queryset
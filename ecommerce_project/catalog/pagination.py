@@ -0,0 +1,139 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+# Columns a connection may be ordered by; each is paired with `id` as a tiebreaker
+# so the (column, id) tuple is unique and can be used as a keyset cursor.
+ORDERABLE_FIELDS = ('id', 'name', 'price', 'stock_quantity', 'created_at', 'updated_at')
+
+# Order names backed by another column: prices sort by their base-currency value
+ORDER_COLUMNS = {'price': 'price_base'}
+
+DEFAULT_PAGE_SIZE = 20
+
+
+def max_page_size():
+    return getattr(settings, 'CATALOG_MAX_PAGE_SIZE', 100)
+
+
+def first_per_parent(queryset, parent_field):
+    """
+    The first max_page_size() rows of `queryset` (by id) for each value of `parent_field`,
+    e.g. a category's products, still in one query. Unpaginated nested lists go through
+    this so they return no more than catalog.query_cost assumes.
+    """
+    position = Window(RowNumber(), partition_by=F(parent_field), order_by=F('pk').asc())
+    return queryset.annotate(list_position=position).filter(list_position__lte=max_page_size()).order_by('pk')
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise Exception("Invalid cursor.")
+    if not isinstance(values, list) or len(values) != 2:
+        raise Exception("Invalid cursor.")
+    return values
+
+
+def order_column(order_by):
+    """'-price' -> '-price_base'; other order_by strings are returned as they are."""
+    descending = order_by.startswith('-')
+    field_name = order_by.lstrip('-')
+    return ('-' if descending else '') + ORDER_COLUMNS.get(field_name, field_name)
+
+
+def parse_order_by(order_by):
+    """Turn 'price' / '-price' into (column name, descending)."""
+    order_by = order_by or 'id'
+    descending = order_by.startswith('-')
+    field_name = order_by.lstrip('-')
+    if field_name == 'pk':
+        field_name = 'id'
+    if field_name not in ORDERABLE_FIELDS:
+        raise Exception(f"Cannot order by '{field_name}'. Choose from: {', '.join(ORDERABLE_FIELDS)}.")
+    return ORDER_COLUMNS.get(field_name, field_name), descending
+
+
+def seek(queryset, field_name, descending, cursor):
+    """Filter to rows strictly after `cursor` in the (field_name, id) ordering."""
+    value, pk = decode_cursor(cursor)
+    field = queryset.model._meta.get_field(field_name)
+    try:
+        value = field.to_python(value)
+        pk = int(pk)
+    except Exception:
+        raise Exception("Invalid cursor.")
+    op = 'lt' if descending else 'gt'
+    if field_name == 'id':
+        return queryset.filter(**{f'id__{op}': pk})
+    # The redundant leading range lets the database seek into the (field, id) index
+    # instead of scanning it from the start and filtering with the OR
+    return queryset.filter(**{f'{field_name}__{op}e': value}).filter(
+        Q(**{f'{field_name}__{op}': value}) | Q(**{field_name: value, f'id__{op}': pk})
+    )
+
+
+def _page_query(queryset, order_by, first, after, last, before):
+    """The page's rows plus one (to tell if there are more), and what _page() needs back."""
+    field_name, descending = parse_order_by(order_by)
+    limit = max_page_size()
+    for name, value in (('first', first), ('last', last)):
+        if value is not None and value < 0:
+            raise Exception(f"'{name}' must be a non-negative integer.")
+
+    backwards = last is not None and first is None
+    size = min(last if backwards else (first if first is not None else DEFAULT_PAGE_SIZE), limit)
+
+    # Both cursors bound the window whichever end the page is taken from
+    if after:
+        queryset = seek(queryset, field_name, descending, after)
+    if before:
+        queryset = seek(queryset, field_name, not descending, before)
+    # Backwards pages walk the ordering in reverse, then flip the page back around
+    direction = ('' if descending else '-') if backwards else ('-' if descending else '')
+
+    ordering = [direction + field_name] if field_name == 'id' else [direction + field_name, direction + 'id']
+    return queryset.order_by(*ordering)[:size + 1], (field_name, size, backwards, bool(after))
+
+
+def _page(rows, field_name, size, backwards, has_after):
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+
+    cursors = [encode_cursor([getattr(row, field_name), row.pk]) for row in rows]
+    page_info = {
+        'has_next_page': False if backwards else has_more,
+        'has_previous_page': has_more if backwards else has_after,
+        'start_cursor': cursors[0] if cursors else None,
+        'end_cursor': cursors[-1] if cursors else None,
+    }
+    return rows, cursors, page_info
+
+
+def paginate(queryset, order_by=None, first=None, after=None, last=None, before=None):
+    """
+    Keyset-paginate `queryset` on (order_by column, id).
+
+    Unlike OFFSET, each page is a range scan starting at the cursor, so page 10,000
+    costs the same as page 1. Returns (rows, cursors, page_info) where page_info has
+    the keys of a Relay PageInfo.
+    """
+    page_query, plan = _page_query(queryset, order_by, first, after, last, before)
+    return _page(list(page_query), *plan)
+
+
+async def apaginate(queryset, order_by=None, first=None, after=None, last=None, before=None):
+    """paginate(), reading the page with the async ORM."""
+    page_query, plan = _page_query(queryset, order_by, first, after, last, before)
+    return _page([row async for row in page_query], *plan)
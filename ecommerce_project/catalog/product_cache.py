@@ -0,0 +1,244 @@
+"""
+Read-through cache for single Product rows.
+
+Rows are stored as a plain tuple of column values (no pickled model instances) in
+the cache named by settings.CATALOG_PRODUCT_CACHE, so any Django cache backend
+works: locmem by default, Redis or memcached in production.
+
+Each product also has a generation token in the cache. A reader tags the row it
+stores with the generation it saw before going to the database, and an entry only
+counts as a hit while its tag is still current. The write paths (through
+catalog.signals) replace the generation immediately and again on commit, so a read
+that fetched the old row before the commit and stores it afterwards leaves an entry
+that is never served.
+
+aget_product() and aget_products() are the same reads for async code, through the
+async ORM and cache API.
+"""
+import asyncio
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from . import routers
+from .models import Product
+
+KEY_PREFIX = 'catalog:product:v3:'  # bump when Product's columns change
+GENERATION_PREFIX = 'catalog:product-gen:'
+LOCK_PREFIX = 'catalog:product-lock:'
+LOCK_TIMEOUT = 5  # seconds a loader may hold the single-flight lock
+WAIT_TIMEOUT = 0.5  # how long other readers wait for it before going to the database
+WAIT_INTERVAL = 0.02
+
+FIELDS = [field.attname for field in Product._meta.concrete_fields]
+
+_counters = {'hits': 0, 'misses': 0, 'waits': 0}
+_counters_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'CATALOG_PRODUCT_CACHE', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_PRODUCT_CACHE_TIMEOUT', 600)
+
+
+def _key(pk):
+    return f'{KEY_PREFIX}{pk}'
+
+
+def _generation_key(pk):
+    return f'{GENERATION_PREFIX}{pk}'
+
+
+def _new_generation():
+    return uuid.uuid4().hex
+
+
+def _count(name, amount=1):
+    if amount:
+        with _counters_lock:
+            _counters[name] += amount
+
+
+def counters():
+    """Hit/miss counters for this process since start (or the last reset)."""
+    with _counters_lock:
+        result = dict(_counters)
+    lookups = result['hits'] + result['misses']
+    result['hit_rate'] = result['hits'] / lookups if lookups else 0.0
+    return result
+
+
+def reset_counters():
+    with _counters_lock:
+        for name in _counters:
+            _counters[name] = 0
+
+
+def serialize(product):
+    return tuple(getattr(product, attname) for attname in FIELDS)
+
+
+def deserialize(values):
+    # Not Product.objects.db: that asks the router, and a cache hit reads no database
+    return Product.from_db(DEFAULT_DB_ALIAS, FIELDS, values)
+
+
+def _unset_generations(pks, found):
+    return [_generation_key(pk) for pk in pks if found.get(_generation_key(pk)) is None]
+
+
+def _current_rows(pks, found, started):
+    """({pk: column values} for the entries tagged with the current generation, {pk: generation})."""
+    generations = {pk: found.get(_generation_key(pk)) or started.get(_generation_key(pk)) for pk in pks}
+    rows = {}
+    for pk in pks:
+        entry = found.get(_key(pk))
+        if entry is not None and generations[pk] is not None and entry[0] == generations[pk]:
+            rows[pk] = entry[1]
+    return rows, generations
+
+
+def _read(cache, pks):
+    """_current_rows() for `pks`, in one round trip unless a generation has to be started."""
+    found = cache.get_many([_key(pk) for pk in pks] + [_generation_key(pk) for pk in pks])
+    started = {}
+    unset = _unset_generations(pks, found)
+    if unset:
+        # Never set, or evicted: start a new one, which no stored entry can carry
+        for key in unset:
+            cache.add(key, _new_generation(), None)
+        started = cache.get_many(unset)
+    return _current_rows(pks, found, started)
+
+
+async def _aread(cache, pks):
+    found = await cache.aget_many([_key(pk) for pk in pks] + [_generation_key(pk) for pk in pks])
+    started = {}
+    unset = _unset_generations(pks, found)
+    if unset:
+        for key in unset:
+            await cache.aadd(key, _new_generation(), None)
+        started = await cache.aget_many(unset)
+    return _current_rows(pks, found, started)
+
+
+def _entries(products, generations):
+    return {_key(pk): (generations[pk], serialize(p)) for pk, p in products.items() if generations.get(pk)}
+
+
+def _load(pks, generations):
+    products = Product.objects.in_bulk(pks)
+    if products and not routers.replica_may_be_stale():
+        _cache().set_many(_entries(products, generations), _timeout())
+    return products
+
+
+async def _aload(pks, generations):
+    products = await Product.objects.ain_bulk(pks)
+    if products and not routers.replica_may_be_stale():
+        await _cache().aset_many(_entries(products, generations), _timeout())
+    return products
+
+
+def get_product(pk):
+    """Return the product with this pk, or None. Concurrent misses on the same key
+    are collapsed into one database read (single flight)."""
+    pk = int(pk)
+    cache = _cache()
+    rows, generations = _read(cache, [pk])
+    if pk in rows:
+        _count('hits')
+        return deserialize(rows[pk])
+
+    _count('misses')
+    lock = LOCK_PREFIX + str(pk)
+    if cache.add(lock, 1, LOCK_TIMEOUT):
+        try:
+            return _load([pk], generations).get(pk)
+        finally:
+            cache.delete(lock)
+
+    # Someone else is loading it: wait briefly for their result
+    _count('waits')
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        rows, generations = _read(cache, [pk])
+        if pk in rows:
+            return deserialize(rows[pk])
+    return _load([pk], generations).get(pk)
+
+
+def get_products(pks):
+    """Multi-get: {pk: Product} for the pks that exist, with one cache round trip
+    and at most one query for the misses."""
+    pks = {int(pk) for pk in pks}
+    rows, generations = _read(_cache(), pks)
+    products = {pk: deserialize(values) for pk, values in rows.items()}
+    _count('hits', len(products))
+    missing = [pk for pk in pks if pk not in products]
+    _count('misses', len(missing))
+    if missing:
+        products.update(_load(missing, generations))
+    return products
+
+
+async def aget_product(pk):
+    """get_product() for the event loop, through the async cache and ORM APIs."""
+    pk = int(pk)
+    cache = _cache()
+    rows, generations = await _aread(cache, [pk])
+    if pk in rows:
+        _count('hits')
+        return deserialize(rows[pk])
+
+    _count('misses')
+    lock = LOCK_PREFIX + str(pk)
+    if await cache.aadd(lock, 1, LOCK_TIMEOUT):
+        try:
+            return (await _aload([pk], generations)).get(pk)
+        finally:
+            await cache.adelete(lock)
+
+    _count('waits')
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(WAIT_INTERVAL)
+        rows, generations = await _aread(cache, [pk])
+        if pk in rows:
+            return deserialize(rows[pk])
+    return (await _aload([pk], generations)).get(pk)
+
+
+async def aget_products(pks):
+    """get_products() for the event loop."""
+    pks = {int(pk) for pk in pks}
+    rows, generations = await _aread(_cache(), pks)
+    products = {pk: deserialize(values) for pk, values in rows.items()}
+    _count('hits', len(products))
+    missing = [pk for pk in pks if pk not in products]
+    _count('misses', len(missing))
+    if missing:
+        products.update(await _aload(missing, generations))
+    return products
+
+
+def invalidate(pks):
+    pks = [pk for pk in pks if pk is not None]
+    if not pks:
+        return
+    cache = _cache()
+
+    def bump():
+        cache.set_many({_generation_key(pk): _new_generation() for pk in pks}, None)
+
+    cache.delete_many([_key(pk) for pk in pks])
+    bump()
+    transaction.on_commit(bump)
@@ -0,0 +1,222 @@
+"""
+Sampled per-request profiling for /graphql/ and the analytics dashboard.
+
+ProfilingMiddleware picks CATALOG_PROFILING_SAMPLE_RATE of the requests routed to a
+profiled view and records, for each:
+
+* every SQL statement's time (through connection.execute_wrapper), and the
+  statements run more than once -- usually the signature of an N+1;
+* per-resolver wall time (GraphQL only, through ResolverTimingMiddleware);
+* the peak of Python allocations, when CATALOG_PROFILING_TRACEMALLOC is on.
+
+The result is logged as one JSON line on the `catalog.profiling` logger, summarised
+in a Server-Timing header and, for GraphQL responses, added as extensions.profile.
+Unsampled requests pay for one random() call. The middleware works under WSGI and
+ASGI without pushing async requests onto a thread.
+"""
+import json
+import logging
+import random
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from inspect import isawaitable
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger('catalog.profiling')
+
+PROFILE_ATTR = '_catalog_profile'
+MAX_REPORTED = 10  # slowest resolvers / duplicate statements kept in a report
+
+
+def sample_rate():
+    return getattr(settings, 'CATALOG_PROFILING_SAMPLE_RATE', 0.0)
+
+
+def get_profile(request):
+    return getattr(request, PROFILE_ATTR, None)
+
+
+class Profile:
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.resolvers = defaultdict(lambda: [0, 0.0])  # 'Type.field' -> [calls, seconds]
+        self.memory_peak = None
+        self.duration = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.sql_count += 1
+            self.statements[sql] += 1
+
+    def record_resolver(self, key, seconds):
+        entry = self.resolvers[key]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def report(self):
+        slowest = sorted(self.resolvers.items(), key=lambda item: item[1][1], reverse=True)[:MAX_REPORTED]
+        duplicates = [
+            {'sql': sql[:300], 'count': count}
+            for sql, count in self.statements.most_common(MAX_REPORTED) if count > 1
+        ]
+        return {
+            'view': self.label,
+            'durationMs': _ms(self.duration),
+            'sql': {'count': self.sql_count, 'durationMs': _ms(self.sql_time), 'duplicates': duplicates},
+            'resolvers': [
+                {'field': key, 'calls': calls, 'durationMs': _ms(seconds)} for key, (calls, seconds) in slowest
+            ],
+            'memoryPeakBytes': self.memory_peak,
+        }
+
+    def server_timing(self):
+        parts = [
+            f'sql;dur={_ms(self.sql_time)};desc="{self.sql_count} queries"',
+            f'total;dur={_ms(self.duration)}',
+        ]
+        if self.resolvers:
+            parts.insert(1, f'resolvers;dur={_ms(sum(s for _, s in self.resolvers.values()))}')
+        return ', '.join(parts)
+
+
+def _ms(seconds):
+    return round((seconds or 0) * 1000, 3)
+
+
+def _profiled_view(request):
+    from graphene_django.views import GraphQLView
+
+    from .views import AnalyticsDashboardView
+
+    try:
+        view_class = getattr(resolve(request.path_info).func, 'view_class', None)
+    except Resolver404:
+        return None
+    if view_class is None:
+        return None
+    if issubclass(view_class, GraphQLView):
+        return 'graphql'
+    if issubclass(view_class, AnalyticsDashboardView):
+        return 'dashboard'
+    return None
+
+
+class ResolverTimingMiddleware:
+    """Graphene middleware timing each resolver. Only installed on sampled requests,
+    see CachingGraphQLView.get_middleware."""
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def resolve(self, next, root, info, **kwargs):
+        key = f'{info.parent_type.name}.{info.field_name}'
+        start = time.perf_counter()
+        result = next(root, info, **kwargs)
+        if isawaitable(result):
+            return self._timed(result, key, start)
+        self.profile.record_resolver(key, time.perf_counter() - start)
+        return result
+
+    async def _timed(self, result, key, start):
+        try:
+            return await result
+        finally:
+            self.profile.record_resolver(key, time.perf_counter() - start)
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = self.start(request)
+        if profile is None:
+            return self.get_response(request)
+        with self.instrument(profile):
+            response = self.get_response(request)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = self.start(request)
+        if profile is None:
+            return await self.get_response(request)
+        # The async ORM runs queries on the request's sync thread, whose connections
+        # are not the event loop's: install the wrappers from there
+        stack = await sync_to_async(self.instrument)(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, profile)
+
+    def start(self, request):
+        rate = sample_rate()
+        if not rate or random.random() >= rate:
+            return None
+        label = _profiled_view(request)
+        if label is None:
+            return None
+        profile = Profile(label)
+        setattr(request, PROFILE_ATTR, profile)
+        return profile
+
+    def instrument(self, profile):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+        if getattr(settings, 'CATALOG_PROFILING_TRACEMALLOC', False):
+            stack.callback(self._stop_tracemalloc, profile, tracemalloc.is_tracing())
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        return stack
+
+    def finish(self, request, response, profile):
+        profile.finish()
+        report = profile.report()
+        response['Server-Timing'] = profile.server_timing()
+        if profile.label == 'graphql' and response.get('Content-Type', '').startswith('application/json'):
+            # Added here rather than by the view so cached response bodies never carry a profile
+            try:
+                body = json.loads(response.content)
+            except ValueError:
+                body = None
+            if isinstance(body, dict):
+                body.setdefault('extensions', {})['profile'] = report
+                response.content = json.dumps(body, separators=(',', ':'))
+        logger.info(json.dumps({'path': request.path, 'status': response.status_code, **report}))
+        return response
+
+    @staticmethod
+    def _stop_tracemalloc(profile, was_tracing):
+        # tracemalloc is process-wide: under threaded servers the peak includes
+        # allocations made by concurrent requests
+        profile.memory_peak = tracemalloc.get_traced_memory()[1]
+        if not was_tracing:
+            tracemalloc.stop()
@@ -0,0 +1,137 @@
+"""
+Static cost analysis for GraphQL operations.
+
+Every object a query can resolve costs 1, multiplied by how many times its parent
+is resolved. A list field multiplies its children by its page size (`first`/`last`
+on the field or on the connection above it, capped at CATALOG_MAX_PAGE_SIZE) or, for
+unpaginated lists, by CATALOG_MAX_PAGE_SIZE itself: that is all `products` and
+`Category.products` ever return. Arguments passed as variables are costed at the
+page-size cap, so an operation's cost doesn't depend on its variables and can be
+cached with the validated document.
+
+QueryCostRule rejects operations over CATALOG_QUERY_MAX_DEPTH or
+CATALOG_QUERY_MAX_COST during validation, before any resolver runs.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from graphql import (
+    FieldNode, FragmentSpreadNode, GraphQLError, InlineFragmentNode, IntValueNode, OperationDefinitionNode,
+    ValidationRule, get_named_type, get_nullable_type, is_composite_type, is_list_type,
+)
+
+from .pagination import max_page_size
+
+PAGE_ARGUMENTS = ('first', 'last')
+
+Cost = namedtuple('Cost', 'depth cost')
+
+
+def max_depth():
+    return getattr(settings, 'CATALOG_QUERY_MAX_DEPTH', 10)
+
+
+def max_cost():
+    return getattr(settings, 'CATALOG_QUERY_MAX_COST', 50000)
+
+
+def _page_size(node):
+    for argument in node.arguments or ():
+        if argument.name.value in PAGE_ARGUMENTS:
+            if isinstance(argument.value, IntValueNode):
+                return max(0, min(int(argument.value.value), max_page_size()))
+            return max_page_size()
+    return None
+
+
+class _Walker:
+    def __init__(self, schema, fragments):
+        self.schema = schema
+        self.fragments = fragments
+
+    def operation(self, node):
+        root = self.schema.get_root_type(node.operation)
+        if root is None:
+            return Cost(0, 0)
+        return Cost(*self.selections(root, node.selection_set, 1, 0, None, frozenset()))
+
+    def selections(self, parent_type, selection_set, multiplier, depth, page_size, fragments):
+        """Return (depth, cost) of `selection_set` resolved `multiplier` times."""
+        deepest, total = depth, 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                result = self.field(parent_type, selection, multiplier, depth, page_size, fragments)
+            elif isinstance(selection, InlineFragmentNode):
+                type_condition = selection.type_condition
+                fragment_type = self.schema.get_type(type_condition.name.value) if type_condition else parent_type
+                result = self.selections(
+                    fragment_type or parent_type, selection.selection_set, multiplier, depth, page_size, fragments
+                )
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments(name)
+                # Unknown or cyclic fragments are reported by the standard rules
+                if fragment is None or name in fragments:
+                    continue
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value) or parent_type
+                result = self.selections(
+                    fragment_type, fragment.selection_set, multiplier, depth, page_size, fragments | {name}
+                )
+            else:
+                continue
+            deepest, total = max(deepest, result[0]), total + result[1]
+        return deepest, total
+
+    def field(self, parent_type, node, multiplier, depth, page_size, fragments):
+        name = node.name.value
+        fields = getattr(parent_type, 'fields', {})
+        # Introspection is free and left to GraphiQL
+        if name.startswith('__') or name not in fields:
+            return depth, 0
+        field_type = fields[name].type
+        if not is_composite_type(get_named_type(field_type)) or node.selection_set is None:
+            return depth + 1, 0
+
+        # first: 0 is a page of nothing, not a missing argument
+        requested = _page_size(node)
+        page_size = requested if requested is not None else page_size
+        size = 1
+        if is_list_type(get_nullable_type(field_type)):
+            size = page_size if page_size is not None else max_page_size()
+            page_size = None
+        cost = multiplier * size
+        child_depth, child_cost = self.selections(
+            get_named_type(field_type), node.selection_set, cost, depth + 1, page_size, fragments
+        )
+        return child_depth, cost + child_cost
+
+
+def measure(schema, document):
+    """{operation name (None if anonymous): Cost} for every operation in `document`."""
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions if not isinstance(definition, OperationDefinitionNode)
+    }
+    walker = _Walker(schema, fragments.get)
+    return {
+        definition.name.value if definition.name else None: walker.operation(definition)
+        for definition in document.definitions if isinstance(definition, OperationDefinitionNode)
+    }
+
+
+class QueryCostRule(ValidationRule):
+    """Reject operations that are too deep or would resolve too many objects."""
+
+    def enter_operation_definition(self, node, *_args):
+        walker = _Walker(self.context.schema, self.context.get_fragment)
+        depth, cost = walker.operation(node)
+        extensions = {'code': 'QUERY_TOO_COMPLEX', 'depth': depth, 'cost': cost}
+        if depth > max_depth():
+            self.report_error(GraphQLError(
+                f"Query depth {depth} exceeds the maximum of {max_depth()}.", node, extensions=extensions
+            ))
+        elif cost > max_cost():
+            self.report_error(GraphQLError(
+                f"Query cost {cost} exceeds the maximum of {max_cost()}. "
+                "Request fewer nested lists or smaller pages.", node, extensions=extensions
+            ))
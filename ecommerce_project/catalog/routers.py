@@ -0,0 +1,202 @@
+"""
+Read-replica routing with read-your-writes stickiness.
+
+Inside a request (see ReplicaRoutingMiddleware) reads go to a healthy alias from
+settings.CATALOG_READ_REPLICAS and writes go to `default`. A request is pinned to
+`default` for all of its reads
+
+* once it has written anything,
+* while `default` is inside a transaction (select_for_update, admin saves, ...),
+* inside `use_primary()` -- GraphQL mutations run entirely in one, and
+* for CATALOG_REPLICA_STICKY_SECONDS after the same client last wrote, tracked in a
+  cookie, so a client never reads its own write from a lagging replica.
+
+Replica lag is assumed to stay under CATALOG_REPLICA_STICKY_SECONDS. Results read
+from a replica within that window of any catalog write are not put in the shared
+caches (see replica_may_be_stale), which would otherwise keep them long after.
+
+Outside requests (management commands, the shell, tests calling the schema
+directly) everything uses `default`.
+"""
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'catalog_primary_until'
+LAST_WRITE_KEY = 'catalog:last-write'
+
+_state = ContextVar('catalog_db_routing', default=None)
+# A ContextVar rather than a flag on the state: concurrent resolvers of one async
+# request share the state but each run in their own context
+_primary = ContextVar('catalog_db_primary', default=False)
+_health = {}  # alias -> (checked at, healthy)
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.read_replica = False
+
+
+def replicas():
+    return getattr(settings, 'CATALOG_READ_REPLICAS', [])
+
+
+def sticky_seconds():
+    return getattr(settings, 'CATALOG_REPLICA_STICKY_SECONDS', 5)
+
+
+def begin(pinned=False):
+    return _state.set(RoutingState(pinned))
+
+
+def end(token):
+    state = _state.get()
+    _state.reset(token)
+    return state
+
+
+@contextmanager
+def use_primary():
+    """Send this block's reads to the primary."""
+    token = _primary.set(True)
+    try:
+        yield
+    finally:
+        _primary.reset(token)
+
+
+def record_write(**kwargs):
+    """Signal receiver: remember when the catalog last changed, for replica_may_be_stale."""
+    if not replicas():
+        return
+
+    def record():
+        cache.set(LAST_WRITE_KEY, time.time(), None)
+
+    record()
+    transaction.on_commit(record)
+
+
+def replica_may_be_stale():
+    """True if this request read from a replica so soon after a catalog write that the
+    replica might not have it yet. Such results must not be cached."""
+    state = _state.get()
+    if state is None or not state.read_replica:
+        return False
+    written = cache.get(LAST_WRITE_KEY)
+    return written is not None and time.time() - written < sticky_seconds()
+
+
+def is_healthy(alias):
+    """Cached liveness check; a failed replica is retried after CATALOG_REPLICA_HEALTH_INTERVAL."""
+    checked, healthy = _health.get(alias, (None, True))
+    interval = getattr(settings, 'CATALOG_REPLICA_HEALTH_INTERVAL', 30)
+    if checked is not None and time.monotonic() - checked < interval:
+        return healthy
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        # Can't block the event loop on a check; the next sync query will do it
+        return healthy
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+        healthy = True
+    except Exception:
+        logger.warning('Read replica %s failed its health check; reading from %s', alias, DEFAULT_DB_ALIAS,
+                       exc_info=True)
+        healthy = False
+    _health[alias] = (time.monotonic(), healthy)
+    return healthy
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (
+            state is None or state.pinned or state.wrote or _primary.get()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        healthy = [alias for alias in replicas() if is_healthy(alias)]
+        if not healthy:
+            return DEFAULT_DB_ALIAS
+        state.read_replica = True
+        return random.choice(healthy)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Scopes RoutingState to a request and keeps a client on the primary after it writes."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = begin(pinned=self.recently_wrote(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            state = end(token)
+        return self.remember_write(response, state)
+
+    async def __acall__(self, request):
+        token = begin(pinned=self.recently_wrote(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            state = end(token)
+        return self.remember_write(response, state)
+
+    @staticmethod
+    def recently_wrote(request):
+        try:
+            return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    @staticmethod
+    def remember_write(response, state):
+        if state.wrote and replicas():
+            seconds = sticky_seconds()
+            response.set_cookie(PIN_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True, samesite='Lax')
+        return response
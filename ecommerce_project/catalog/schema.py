@@ -1,19 +1,154 @@
 import graphene
+from asgiref.sync import sync_to_async
+from decimal import Decimal
+from django.db import transaction
+from django.utils import timezone
 from graphene_django import DjangoObjectType
-from django.db.models import Q # For advanced filtering
 
-from .models import Category, Product
+from .loaders import get_loaders
+from .models import Category, Job, Product, ProductChange, delete_product_rows
+from .optimizer import collect_fields, optimize_queryset
+from .currency import set_base_prices
+from .pagination import DEFAULT_PAGE_SIZE, apaginate, max_page_size, order_column, paginate, parse_order_by
+from .search import order_by_rank, search_products
+from .signals import products_bulk_written
+from .validation import product_field_error
+from . import changes, events, facets, graphql_cache, inventory, jobs, product_cache
+from . import stats
 
 class CategoryType(DjangoObjectType):
     class Meta:
         model = Category
         fields = "__all__" # Expose all fields from the Django model
 
+    def resolve_products(self, info):
+        if 'products' in getattr(self, '_prefetched_objects_cache', {}):
+            return list(self.products.all())
+        # Batched through the request's DataLoader instead of one query per category
+        return get_loaders(info).products_by_category.load(self.pk)
+
 class ProductType(DjangoObjectType):
     class Meta:
         model = Product
         fields = "__all__" # Expose all fields from the Django model
 
+    def resolve_category(self, info):
+        if Product.category.is_cached(self):
+            return self.category
+        # Fallback for instances that did not come through optimize_queryset()
+        return get_loaders(info).category_by_id.load(self.category_id)
+
+class JobType(DjangoObjectType):
+    class Meta:
+        model = Job
+        fields = "__all__"
+        convert_choices_to_enum = False # status reads as it is filtered: "queued", "running", ...
+
+class ProductChangeType(DjangoObjectType):
+    class Meta:
+        model = ProductChange
+        fields = ("op", "changed_at")
+
+    version = graphene.String(required=True)
+    product_id = graphene.ID(required=True)
+    # The product as it is now; null once it has been deleted
+    product = graphene.Field(ProductType)
+
+    def resolve_version(self, info):
+        return str(self.pk)
+
+    def resolve_product(self, info):
+        if self.op == ProductChange.DELETED:
+            return None
+        return get_loaders(info).product_by_id.load(self.product_id)
+
+class ProductChangePage(graphene.ObjectType):
+    changes = graphene.List(graphene.NonNull(ProductChangeType), required=True)
+    # Pass as `since` to get what comes next
+    cursor = graphene.String(required=True)
+    has_more = graphene.Boolean(required=True)
+
+class CategoryFacet(graphene.ObjectType):
+    # Null for uncategorised products
+    category_id = graphene.ID()
+    category = graphene.Field(CategoryType)
+    count = graphene.Int(required=True)
+
+    def resolve_category(self, info):
+        if self.category_id is None:
+            return None
+        return get_loaders(info).category_by_id.load(int(self.category_id))
+
+class CurrencyFacet(graphene.ObjectType):
+    currency = graphene.String(required=True)
+    count = graphene.Int(required=True)
+
+class PriceBucketFacet(graphene.ObjectType):
+    # Base-currency range [min, max); null at the open ends
+    min = graphene.Float()
+    max = graphene.Float()
+    count = graphene.Int(required=True)
+
+class ProductFacets(graphene.ObjectType):
+    total = graphene.Int(required=True)
+    categories = graphene.List(graphene.NonNull(CategoryFacet), required=True)
+    currencies = graphene.List(graphene.NonNull(CurrencyFacet), required=True)
+    price_buckets = graphene.List(graphene.NonNull(PriceBucketFacet), required=True)
+    in_stock = graphene.Int(required=True)
+    out_of_stock = graphene.Int(required=True)
+
+    @classmethod
+    def from_counts(cls, counts):
+        return cls(
+            total=counts['total'],
+            categories=[CategoryFacet(category_id=pk, count=count) for pk, count in counts['categories']],
+            currencies=[CurrencyFacet(currency=code, count=count) for code, count in counts['currencies']],
+            price_buckets=[PriceBucketFacet(min=low, max=high, count=count) for low, high, count in counts['price_buckets']],
+            in_stock=counts['in_stock'],
+            out_of_stock=counts['out_of_stock'],
+        )
+
+class ProductConnection(graphene.relay.Connection):
+    class Meta:
+        node = ProductType
+
+def filter_products(queryset, category_id=None, min_price=None, max_price=None, search=None):
+    if category_id:
+        queryset = queryset.filter(category__id=category_id)
+    # Price bounds are in the base currency, so products in every currency compare
+    if min_price is not None:
+        queryset = queryset.filter(price_base__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(price_base__lte=max_price)
+    if search:
+        # Full-text index (FTS5 / tsvector) rather than a LIKE '%...%' scan
+        queryset = search_products(queryset, search)
+    return queryset
+
+def _connection_queryset(info, queryset, order_by):
+    # The node selection lives under edges { node { ... } }
+    edges = collect_fields(info, info.field_nodes).get('edges', [])
+    node_fields = collect_fields(info, edges).get('node', [])
+    order_field, _ = parse_order_by(order_by)
+    return optimize_queryset(queryset, info, node_fields, required=[order_field])
+
+def _connection(rows, cursors, page_info):
+    return ProductConnection(
+        edges=[ProductConnection.Edge(node=row, cursor=cursor) for row, cursor in zip(rows, cursors)],
+        page_info=graphene.relay.PageInfo(**page_info),
+    )
+
+def _changes_page_size(first):
+    if first is not None and first < 0:
+        raise Exception("'first' must be a non-negative integer.")
+    return min(first if first is not None else DEFAULT_PAGE_SIZE, max_page_size())
+
+def _change_page(rows, size, since):
+    """`rows` is up to size + 1 changes after `since`; the extra one only says there are more."""
+    page = rows[:size]
+    cursor = str(page[-1].pk) if page else str(changes.parse_version(since))
+    return ProductChangePage(changes=page, cursor=cursor, has_more=len(rows) > size)
+
 class Query(graphene.ObjectType):
     # Query for a single product by ID
     product = graphene.Field(ProductType, id=graphene.ID(required=True))
@@ -26,45 +161,100 @@ class Query(graphene.ObjectType):
         search=graphene.String(), 
         order_by=graphene.String(),
     )
+    # Cursor-paginated products; page size is capped by settings.CATALOG_MAX_PAGE_SIZE
+    products_connection = graphene.Field(
+        ProductConnection,
+        first=graphene.Int(),
+        after=graphene.String(),
+        last=graphene.Int(),
+        before=graphene.String(),
+        category_id=graphene.ID(),
+        min_price=graphene.Float(),
+        max_price=graphene.Float(),
+        search=graphene.String(),
+        order_by=graphene.String(),
+    )
+
+    # Sidebar counts for the products matching the same filters as `products`, in
+    # one grouped query (catalog.facets); priceBuckets overrides the bucket bounds
+    product_facets = graphene.Field(
+        ProductFacets,
+        category_id=graphene.ID(),
+        min_price=graphene.Float(),
+        max_price=graphene.Float(),
+        search=graphene.String(),
+        price_buckets=graphene.List(graphene.NonNull(graphene.Float)),
+    )
 
     # Query for a single category by ID
     category = graphene.Field(CategoryType, id=graphene.ID(required=True))
     # Query for all categories
     categories = graphene.List(CategoryType)
 
+    # Product changes after version `since` (catalog.changes), oldest first
+    product_changes = graphene.Field(ProductChangePage, since=graphene.String(), first=graphene.Int())
+
+    # Background jobs (catalog.jobs), newest first
+    job = graphene.Field(JobType, id=graphene.ID(required=True))
+    jobs = graphene.List(JobType, status=graphene.String(), first=graphene.Int())
+
     def resolve_product(self, info, id):
-        try:
-            return Product.objects.get(pk=id)
-        except Product.DoesNotExist:
+        pk = _parse_id(id)
+        if pk is None:
             return None
+        # Hot product pages are served from the read-through cache, not the database
+        return product_cache.get_product(pk)
 
     def resolve_products(self, info, category_id=None, min_price=None, max_price=None, search=None, order_by=None):
-        queryset = Product.objects.all()
-
-        if category_id:
-            queryset = queryset.filter(category__id=category_id)
-        if min_price is not None:
-            queryset = queryset.filter(price__gte=min_price)
-        if max_price is not None:
-            queryset = queryset.filter(price__lte=max_price)
-        if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) | Q(description__icontains=search)
-            )
+        queryset = filter_products(Product.objects.all(), category_id, min_price, max_price, search)
+
         if order_by:
             # Basic ordering, can be extended for ascending/descending
-            queryset = queryset.order_by(order_by)
+            column = order_column(order_by)
+            # id breaks ties the same way round, so the (column, id) index is walked
+            queryset = queryset.order_by(column, '-pk' if column.startswith('-') else 'pk')
+        elif search:
+            # Best matches first
+            queryset = order_by_rank(queryset)
+
+        # One page at most, not the whole table; productsConnection pages through the rest
+        return optimize_queryset(queryset, info)[:max_page_size()]
+
+    def resolve_products_connection(self, info, first=None, after=None, last=None, before=None,
+                                    order_by=None, **filters):
+        queryset = _connection_queryset(info, filter_products(Product.objects.all(), **filters), order_by)
+        return _connection(*paginate(queryset, order_by, first, after, last, before))
 
-        return queryset
+    def resolve_product_facets(self, info, price_buckets=None, **filters):
+        queryset = filter_products(Product.objects.all(), **filters)
+        return ProductFacets.from_counts(facets.product_facets(queryset, filters, price_buckets))
 
     def resolve_category(self, info, id):
-        try:
-            return Category.objects.get(pk=id)
-        except Category.DoesNotExist:
-            return None
+        return optimize_queryset(Category.objects.filter(pk=id), info).first()
 
     def resolve_categories(self, info):
-        return Category.objects.all()
+        return optimize_queryset(Category.objects.all(), info)
+
+    def resolve_product_changes(self, info, since=None, first=None):
+        # Versions become safe to hand out as time passes, not only on writes
+        graphql_cache.skip_response_cache(info)
+        size = _changes_page_size(first)
+        page = _change_page(list(changes.changes_since(since, limit=size + 1)), size, since)
+        get_loaders(info).product_by_id.queue(c.product_id for c in page.changes if c.op != ProductChange.DELETED)
+        return page
+
+    def resolve_job(self, info, id):
+        # Progress changes without a catalog write, so never serve it from the response cache
+        graphql_cache.skip_response_cache(info)
+        pk = _parse_id(id)
+        return Job.objects.filter(pk=pk).first() if pk is not None else None
+
+    def resolve_jobs(self, info, status=None, first=None):
+        graphql_cache.skip_response_cache(info)
+        queryset = Job.objects.order_by('-id')
+        if status:
+            queryset = queryset.filter(status=status)
+        return queryset[:min(first if first is not None else DEFAULT_PAGE_SIZE, max_page_size())]
 
 # --- Mutation Types (for Create, Update, Delete) ---
 
@@ -101,18 +291,26 @@ class UpdateCategory(graphene.Mutation):
             return None
 
 class DeleteCategory(graphene.Mutation):
+    """
+    Products of the category become uncategorised. A category with more products
+    than CATALOG_JOB_CHUNK_SIZE is deleted by a background job, returned as `job`.
+    """
     class Arguments:
         id = graphene.ID(required=True)
 
     ok = graphene.Boolean()
+    job = graphene.Field(JobType)
 
     def mutate(self, info, id):
         try:
             category = Category.objects.get(pk=id)
-            category.delete()
-            return DeleteCategory(ok=True)
         except Category.DoesNotExist:
             return DeleteCategory(ok=False)
+        limit = jobs.chunk_size()
+        if Product.objects.filter(category=category)[:limit + 1].count() > limit:
+            return DeleteCategory(ok=True, job=jobs.enqueue('delete_category', category_id=category.pk))
+        category.delete()
+        return DeleteCategory(ok=True)
 
 class CreateProduct(graphene.Mutation):
     class Arguments:
@@ -188,6 +386,237 @@ class DeleteProduct(graphene.Mutation):
             return DeleteProduct(ok=False)
 
 
+# --- Bulk product mutations ---
+
+class ProductInput(graphene.InputObjectType):
+    name = graphene.String(required=True)
+    description = graphene.String(required=True)
+    price = graphene.Float(required=True)
+    currency = graphene.String(required=True)
+    image_url = graphene.String()
+    stock_quantity = graphene.Int()
+    category_id = graphene.ID(required=True)
+
+class ProductUpdateInput(graphene.InputObjectType):
+    id = graphene.ID(required=True)
+    name = graphene.String()
+    description = graphene.String()
+    price = graphene.Float()
+    currency = graphene.String()
+    image_url = graphene.String()
+    stock_quantity = graphene.Int()
+    category_id = graphene.ID()
+
+class BulkItemError(graphene.ObjectType):
+    index = graphene.Int() # position of the item in the input list
+    id = graphene.ID()
+    message = graphene.String()
+
+def _parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _money(value):
+    # GraphQL Floats become exact 2dp Decimals before they reach the model
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+def _load_categories(info, items):
+    """Resolve every category_id in `items` with one in_bulk() query."""
+    ids = {_parse_id(item.get('category_id')) for item in items if item.get('category_id') is not None}
+    categories = Category.objects.in_bulk([pk for pk in ids if pk is not None])
+    loaders = get_loaders(info)
+    for category in categories.values():
+        loaders.category_by_id.prime(category.pk, category)
+    return categories
+
+class CreateProducts(graphene.Mutation):
+    class Arguments:
+        products = graphene.List(graphene.NonNull(ProductInput), required=True)
+
+    products = graphene.List(ProductType)
+    errors = graphene.List(graphene.NonNull(BulkItemError))
+
+    def mutate(self, info, products):
+        categories = _load_categories(info, products)
+        to_create, errors = [], []
+        for index, data in enumerate(products):
+            message = product_field_error(data)
+            category = categories.get(_parse_id(data['category_id']))
+            if message is None and category is None:
+                message = "Category not found."
+            if message:
+                errors.append(BulkItemError(index=index, message=message))
+                continue
+            to_create.append(Product(
+                name=data['name'],
+                description=data['description'],
+                price=_money(data['price']),
+                currency=data['currency'],
+                image_url=data.get('image_url'),
+                stock_quantity=data.get('stock_quantity') or 0,
+                category=category,
+            ))
+
+        if to_create:
+            with transaction.atomic():
+                Product.objects.bulk_create(to_create)
+                stats.record_created(to_create)
+                changes.record_created(to_create)
+            products_bulk_written.send(sender=Product, created=to_create, updated=[], deleted_ids=[])
+        return CreateProducts(products=to_create, errors=errors)
+
+class UpdateProducts(graphene.Mutation):
+    class Arguments:
+        products = graphene.List(graphene.NonNull(ProductUpdateInput), required=True)
+
+    products = graphene.List(ProductType)
+    errors = graphene.List(graphene.NonNull(BulkItemError))
+
+    def mutate(self, info, products):
+        existing = Product.objects.in_bulk([pk for pk in (_parse_id(p['id']) for p in products) if pk is not None])
+        categories = _load_categories(info, products)
+        updated, state_changes, errors = {}, [], []
+        fields = set()
+
+        for index, data in enumerate(products):
+            raw_id = data['id']
+            product = existing.get(_parse_id(raw_id))
+            data = {field: value for field, value in data.items() if field != 'id'}
+            message = product_field_error(data)
+            if message is None and product is None:
+                message = "Product not found."
+            if message is None and 'category_id' in data:
+                category = categories.get(_parse_id(data['category_id']))
+                if category is None:
+                    message = "Category not found."
+                else:
+                    data['category'] = category
+                    del data['category_id']
+            if message:
+                errors.append(BulkItemError(index=index, id=raw_id, message=message))
+                continue
+
+            if data.get('price') is not None:
+                data['price'] = _money(data['price'])
+            old = stats.current_state(product)
+            for field, value in data.items():
+                setattr(product, field, value)
+            set_base_prices([product])
+            fields.update(data)
+            state_changes.append((old, stats.current_state(product)))
+            updated[product.pk] = product
+
+        if updated:
+            # bulk_update() skips auto_now, so stamp updated_at by hand
+            now = timezone.now()
+            for product in updated.values():
+                product.updated_at = now
+            with transaction.atomic():
+                Product.objects.bulk_update(list(updated.values()), fields=sorted(fields | {'updated_at'}))
+                stats.apply_changes(state_changes)
+                changes.record_updated(updated.values())
+            products_bulk_written.send(sender=Product, created=[], updated=list(updated.values()), deleted_ids=[])
+        return UpdateProducts(products=list(updated.values()), errors=errors)
+
+class DeleteProducts(graphene.Mutation):
+    class Arguments:
+        ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    deleted_count = graphene.Int()
+    errors = graphene.List(graphene.NonNull(BulkItemError))
+
+    def mutate(self, info, ids):
+        pks = [_parse_id(pk) for pk in ids]
+        with transaction.atomic():
+            rows = list(
+                Product.objects.select_for_update()
+                .filter(pk__in=[pk for pk in pks if pk is not None])
+                .values_list('pk', 'category_id', 'price_base', 'stock_quantity')
+            )
+            found = {row[0] for row in rows}
+            if found:
+                # No per-row post_delete; its work is done in bulk below
+                delete_product_rows(found)
+                deltas = stats.Deltas()
+                for _, category_id, price_base, stock_quantity in rows:
+                    deltas.add(category_id, price_base, stock_quantity, sign=-1)
+                deltas.apply()
+                changes.record_deleted(sorted(found))
+        if found:
+            products_bulk_written.send(sender=Product, created=[], updated=[], deleted_ids=sorted(found))
+
+        errors = [
+            BulkItemError(index=index, id=raw, message="Product not found.")
+            for index, (raw, pk) in enumerate(zip(ids, pks)) if pk not in found
+        ]
+        return DeleteProducts(deleted_count=len(found), errors=errors)
+
+
+# --- Stock reservation mutations ---
+
+class StockItemInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(required=True)
+
+def _stock_items(items):
+    parsed = []
+    for item in items:
+        product_id = _parse_id(item['product_id'])
+        if product_id is None:
+            raise Exception(f"Product {item['product_id']} not found.")
+        parsed.append((product_id, item['quantity']))
+    return parsed
+
+class ReserveStock(graphene.Mutation):
+    """Take stock for every item or none of them (e.g. at checkout)."""
+    class Arguments:
+        items = graphene.List(graphene.NonNull(StockItemInput), required=True)
+
+    ok = graphene.Boolean()
+    products = graphene.List(ProductType)
+
+    def mutate(self, info, items):
+        try:
+            products = inventory.reserve_stock(_stock_items(items))
+        except inventory.StockError as exc:
+            raise Exception(str(exc))
+        return ReserveStock(ok=True, products=products)
+
+class ReleaseStock(graphene.Mutation):
+    """Give back stock from a cancelled or expired reservation."""
+    class Arguments:
+        items = graphene.List(graphene.NonNull(StockItemInput), required=True)
+
+    ok = graphene.Boolean()
+    products = graphene.List(ProductType)
+
+    def mutate(self, info, items):
+        try:
+            products = inventory.release_stock(_stock_items(items))
+        except inventory.StockError as exc:
+            raise Exception(str(exc))
+        return ReleaseStock(ok=True, products=products)
+
+class AdjustStock(graphene.Mutation):
+    class Arguments:
+        product_id = graphene.ID(required=True)
+        delta = graphene.Int(required=True)
+
+    product = graphene.Field(ProductType)
+
+    def mutate(self, info, product_id, delta):
+        pk = _parse_id(product_id)
+        if pk is None:
+            raise Exception(f"Product {product_id} not found.")
+        try:
+            product = inventory.adjust_stock(pk, delta)
+        except inventory.StockError as exc:
+            raise Exception(str(exc))
+        return AdjustStock(product=product)
+
+
 class Mutation(graphene.ObjectType):
     create_category = CreateCategory.Field()
     update_category = UpdateCategory.Field()
@@ -197,5 +626,144 @@ class Mutation(graphene.ObjectType):
     update_product = UpdateProduct.Field()
     delete_product = DeleteProduct.Field()
 
+    create_products = CreateProducts.Field()
+    update_products = UpdateProducts.Field()
+    delete_products = DeleteProducts.Field()
+
+    reserve_stock = ReserveStock.Field()
+    release_stock = ReleaseStock.Field()
+    adjust_stock = AdjustStock.Field()
+
+
+# --- Subscriptions, served over WebSocket by catalog.subscriptions ---
+
+class ProductUpdate(graphene.ObjectType):
+    product_id = graphene.ID(required=True)
+    # The product as it is now; null once it has been deleted
+    product = graphene.Field(ProductType)
+
+class StockUpdate(graphene.ObjectType):
+    product_id = graphene.ID(required=True)
+    # Both null once the product has been deleted; a different category_id means it
+    # has left the category
+    stock_quantity = graphene.Int()
+    category_id = graphene.ID()
+    product = graphene.Field(ProductType)
+
+class Subscription(graphene.ObjectType):
+    # Writes to the given products (catalog.events), batched per tick
+    product_updated = graphene.List(
+        graphene.NonNull(ProductUpdate), required=True, ids=graphene.List(graphene.NonNull(graphene.ID), required=True)
+    )
+    # Stock levels of the category's products as they change, batched per tick
+    stock_changed = graphene.List(graphene.NonNull(StockUpdate), required=True, category_id=graphene.ID(required=True))
+
+    async def subscribe_product_updated(root, info, ids):
+        pks = {pk for pk in map(_parse_id, ids) if pk is not None}
+        if len(pks) > max_page_size():
+            raise Exception(f"Subscribe to at most {max_page_size()} products.")
+        async for batch in events.Subscription(lambda pk, product: pk in pks).updates():
+            yield [ProductUpdate(product_id=pk, product=product) for pk, product in sorted(batch.items())]
+
+    async def subscribe_stock_changed(root, info, category_id):
+        category = _parse_id(category_id)
+        # Stock last sent for each product, so other writes to it are not reported
+        sent = {}
+
+        def accepts(pk, product):
+            return pk in sent or (product is not None and product.category_id == category)
+
+        async for batch in events.Subscription(accepts).updates():
+            updates = []
+            for pk, product in sorted(batch.items()):
+                if product is None or product.category_id != category:
+                    sent.pop(pk, None)
+                elif sent.get(pk) != product.stock_quantity:
+                    sent[pk] = product.stock_quantity
+                else:
+                    continue
+                updates.append(StockUpdate(
+                    product_id=pk,
+                    stock_quantity=product.stock_quantity if product else None,
+                    category_id=product.category_id if product else None,
+                    product=product,
+                ))
+            if updates:
+                yield updates
+
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
+
+
+# --- Async schema, served by AsyncGraphQLView under ASGI ---
+
+# Same fields as Query; resolvers await the async ORM instead of blocking a thread.
+# (A docstring would become the GraphQL type description and make the schemas differ.)
+class AsyncQuery(Query):
+    class Meta:
+        name = "Query"
+
+    async def resolve_product(self, info, id):
+        pk = _parse_id(id)
+        if pk is None:
+            return None
+        return await product_cache.aget_product(pk)
+
+    async def resolve_products(self, info, search=None, **kwargs):
+        if search:
+            # The first search may inspect the database for the full-text index
+            queryset = await sync_to_async(Query.resolve_products)(self, info, search=search, **kwargs)
+        else:
+            queryset = Query.resolve_products(self, info, **kwargs)
+        return [product async for product in queryset]
+
+    async def resolve_products_connection(self, info, first=None, after=None, last=None, before=None,
+                                          order_by=None, **filters):
+        queryset = _connection_queryset(info, await _afilter_products(**filters), order_by)
+        return _connection(*await apaginate(queryset, order_by, first, after, last, before))
+
+    async def resolve_product_facets(self, info, price_buckets=None, **filters):
+        queryset = await _afilter_products(**filters)
+        return ProductFacets.from_counts(await facets.aproduct_facets(queryset, filters, price_buckets))
+
+    async def resolve_category(self, info, id):
+        return await optimize_queryset(Category.objects.filter(pk=id), info).afirst()
+
+    async def resolve_categories(self, info):
+        return [category async for category in optimize_queryset(Category.objects.all(), info)]
+
+    async def resolve_product_changes(self, info, since=None, first=None):
+        graphql_cache.skip_response_cache(info)
+        size = _changes_page_size(first)
+        # The async loader batches the pages' products by itself
+        return _change_page([c async for c in await changes.achanges_since(since, limit=size + 1)], size, since)
+
+    async def resolve_job(self, info, id):
+        graphql_cache.skip_response_cache(info)
+        pk = _parse_id(id)
+        return await Job.objects.filter(pk=pk).afirst() if pk is not None else None
+
+    async def resolve_jobs(self, info, **kwargs):
+        return [job async for job in Query.resolve_jobs(self, info, **kwargs)]
+
+
+async def _afilter_products(**filters):
+    if filters.get('search'):
+        # As in resolve_products
+        return await sync_to_async(filter_products)(Product.objects.all(), **filters)
+    return filter_products(Product.objects.all(), **filters)
+
+
+def _in_thread(field):
+    # Mutations are transactional sync code: run each in the request's sync thread
+    return graphene.Field(
+        field.type, args=field.args, resolver=sync_to_async(field.resolver), description=field.description
+    )
+
+
+AsyncMutation = type("AsyncMutation", (graphene.ObjectType,), {
+    "Meta": type("Meta", (), {"name": "Mutation"}),
+    **{name: _in_thread(field) for name, field in Mutation._meta.fields.items()},
+})
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
+async_schema = graphene.Schema(query=AsyncQuery, mutation=AsyncMutation, subscription=Subscription)
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+Full-text search over Product.name / Product.description.
+
+SQLite uses an external-content FTS5 table kept in sync by triggers, so rows written
+through save(), delete(), bulk_create() or queryset.update() are all indexed without
+any Python hooks. PostgreSQL uses a GIN expression index over a weighted tsvector,
+which the database maintains by itself. Any other backend falls back to icontains.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+FTS_TABLE = 'catalog_product_fts'
+PRODUCT_TABLE = 'catalog_product'
+PG_INDEX_NAME = 'catalog_product_search_idx'
+PG_CONFIG = 'english'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Database aliases known to have the FTS5 table, so searches don't re-check it
+_fts_aliases = set()
+
+SQLITE_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description,
+        content='{PRODUCT_TABLE}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+
+def _pg_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('name', weight='A', config=PG_CONFIG)
+        + SearchVector('description', weight='B', config=PG_CONFIG)
+    )
+
+
+def _pg_index():
+    from django.contrib.postgres.indexes import GinIndex
+
+    return GinIndex(_pg_vector(), name=PG_INDEX_NAME)
+
+
+def _tokens(term):
+    return TOKEN_RE.findall(term or '')
+
+
+def sqlite_fts_available(connection):
+    if connection.alias in _fts_aliases:
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+        )
+        found = cursor.fetchone() is not None
+    if found:
+        _fts_aliases.add(connection.alias)
+    return found
+
+
+def _sqlite_triggers_installed(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f'{FTS_TABLE}_%'],
+        )
+        return cursor.fetchone()[0] == 3
+
+
+def install(connection, schema_editor=None):
+    """
+    Create the search index on `connection` if it is missing (idempotent).
+
+    On SQLite, Django drops the product table's triggers whenever it remakes the
+    table during a migration, so this also runs after every migrate and rebuilds
+    the FTS contents if the triggers had to be recreated.
+    """
+    if connection.vendor == 'sqlite':
+        _fts_aliases.discard(connection.alias)
+        if _sqlite_triggers_installed(connection) and sqlite_fts_available(connection):
+            return
+        with connection.cursor() as cursor:
+            for statement in SQLITE_SCHEMA:
+                cursor.execute(statement)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    elif connection.vendor == 'postgresql':
+        from .models import Product
+
+        with connection.cursor() as cursor:
+            existing = connection.introspection.get_constraints(cursor, PRODUCT_TABLE)
+        if PG_INDEX_NAME in existing:
+            return
+        if schema_editor is not None:
+            schema_editor.add_index(Product, _pg_index())
+        else:
+            with connection.schema_editor() as editor:
+                editor.add_index(Product, _pg_index())
+
+
+def uninstall(connection):
+    _fts_aliases.discard(connection.alias)
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {PG_INDEX_NAME}")
+
+
+def search_products(queryset, term):
+    """
+    Restrict `queryset` to products matching every word of `term`, where the last
+    word also matches as a prefix (search-as-you-type). Matching rows are annotated
+    with `search_rank` (higher is better).
+    """
+    tokens = _tokens(term)
+    if not tokens:
+        return queryset.none()
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'sqlite' and sqlite_fts_available(connection):
+        # FTS5 query syntax: quoted tokens are ANDed, a trailing * makes a prefix match
+        match = ' '.join(f'"{token}"' for token in tokens[:-1])
+        match = f'{match} "{tokens[-1]}"*'.strip()
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {PRODUCT_TABLE}.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            # bm25 is "lower is better"; flip it so both backends sort the same way
+            select={'search_rank': f'-{FTS_TABLE}.rank'},
+        )
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        raw = ' & '.join(tokens[:-1] + [f'{tokens[-1]}:*'])
+        query = SearchQuery(raw, search_type='raw', config=PG_CONFIG)
+        vector = _pg_vector()
+        return queryset.annotate(search_vector=vector).filter(search_vector=query).annotate(
+            search_rank=SearchRank(vector, query)
+        )
+
+    condition = Q()
+    for token in tokens:
+        condition &= Q(name__icontains=token) | Q(description__icontains=token)
+    return queryset.filter(condition)
+
+
+def order_by_rank(queryset):
+    if 'search_rank' in queryset.query.annotations or 'search_rank' in queryset.query.extra:
+        return queryset.order_by('-search_rank', 'id')
+    return queryset
@@ -0,0 +1,97 @@
+from django.dispatch import Signal
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+from . import changelist, changes, product_cache, routers, stats
+from .graphql_cache import bump_catalog_version
+from .models import Category, Product
+from .views import invalidate_dashboard_cache
+
+
+# Sent by bulk write paths (bulk mutations, imports) that bypass post_save/post_delete.
+# Arguments: created, updated (lists of Product) and deleted_ids (list of pks).
+# CategoryStats and the change log are not maintained through this signal: the sender
+# applies exact deltas and records its changes inside its own transaction.
+products_bulk_written = Signal()
+
+
+def remember_product_state(sender, instance, raw=False, **kwargs):
+    # Product.save() runs in a transaction, so the row stays as read until post_save
+    instance._stats_old_state = None if raw else stats.locked_state(instance)
+
+
+def update_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_stats_old_state', None)
+    if created or old is None:
+        stats.record_created([instance])
+    else:
+        stats.apply_changes([(old, stats.current_state(instance))])
+
+
+def update_stats_on_delete(sender, instance, **kwargs):
+    # Subtract what the row held (read by remember_product_state in pre_delete), which
+    # may differ from the instance's unsaved or stale values
+    old = getattr(instance, '_stats_old_state', None)
+    if old is not None:
+        deltas = stats.Deltas()
+        deltas.add(*old, sign=-1)
+        deltas.apply()
+
+
+def create_stats_row(sender, instance, created, raw=False, **kwargs):
+    # Before the category's first product, so that write is a plain UPDATE
+    if created and not raw:
+        stats.create_row(instance.pk)
+
+
+def move_stats_on_category_delete(sender, instance, **kwargs):
+    stats.move_category_to_uncategorised(instance.pk)
+
+
+def invalidate_cached_product(sender, instance, **kwargs):
+    product_cache.invalidate([instance.pk])
+
+
+def invalidate_cached_products(sender, created=(), updated=(), deleted_ids=(), **kwargs):
+    product_cache.invalidate([p.pk for p in created] + [p.pk for p in updated] + list(deleted_ids))
+
+
+def connect():
+    for model in (Product, Category):
+        post_save.connect(invalidate_dashboard_cache, sender=model, dispatch_uid=f'dashboard-save-{model.__name__}')
+        post_delete.connect(invalidate_dashboard_cache, sender=model, dispatch_uid=f'dashboard-delete-{model.__name__}')
+
+    products_bulk_written.connect(invalidate_dashboard_cache, dispatch_uid='dashboard-bulk')
+
+    # Any catalog write retires every cached GraphQL response
+    for model in (Product, Category):
+        post_save.connect(bump_catalog_version, sender=model, dispatch_uid=f'graphql-save-{model.__name__}')
+        post_delete.connect(bump_catalog_version, sender=model, dispatch_uid=f'graphql-delete-{model.__name__}')
+    products_bulk_written.connect(bump_catalog_version, dispatch_uid='graphql-bulk')
+
+    # ...and, with read replicas, stops replica reads from being cached for a while
+    for model in (Product, Category):
+        post_save.connect(routers.record_write, sender=model, dispatch_uid=f'replica-save-{model.__name__}')
+        post_delete.connect(routers.record_write, sender=model, dispatch_uid=f'replica-delete-{model.__name__}')
+    products_bulk_written.connect(routers.record_write, dispatch_uid='replica-bulk')
+
+    # The admin's cached category filter choices
+    post_save.connect(changelist.invalidate_filter_choices, sender=Category, dispatch_uid='admin-filter-save')
+    post_delete.connect(changelist.invalidate_filter_choices, sender=Category, dispatch_uid='admin-filter-delete')
+
+    # The change feed
+    post_save.connect(changes.record_save, sender=Product, dispatch_uid='changes-save')
+    post_delete.connect(changes.record_delete, sender=Product, dispatch_uid='changes-delete')
+    pre_delete.connect(changes.record_category_delete, sender=Category, dispatch_uid='changes-category-delete')
+
+    post_save.connect(invalidate_cached_product, sender=Product, dispatch_uid='product-cache-save')
+    post_delete.connect(invalidate_cached_product, sender=Product, dispatch_uid='product-cache-delete')
+    products_bulk_written.connect(invalidate_cached_products, dispatch_uid='product-cache-bulk')
+
+    pre_save.connect(remember_product_state, sender=Product, dispatch_uid='stats-pre-save')
+    post_save.connect(update_stats_on_save, sender=Product, dispatch_uid='stats-post-save')
+    pre_delete.connect(remember_product_state, sender=Product, dispatch_uid='stats-pre-delete')
+    post_delete.connect(update_stats_on_delete, sender=Product, dispatch_uid='stats-post-delete')
+    pre_delete.connect(move_stats_on_category_delete, sender=Category, dispatch_uid='stats-category-delete')
+    post_save.connect(create_stats_row, sender=Category, dispatch_uid='stats-category-create')
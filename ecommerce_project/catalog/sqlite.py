@@ -0,0 +1,63 @@
+"""
+Connection tuning for SQLite deployments.
+
+With CATALOG_SQLITE_PROFILE = 'production' every new SQLite connection is set up
+with:
+
+* busy_timeout: a connection waits this many ms for a lock instead of failing with
+  "database is locked";
+* journal_mode=WAL: readers no longer block the writer or wait for it; only writers
+  queue behind each other;
+* synchronous=NORMAL: under WAL, fsync at checkpoints rather than on every commit.
+  A power cut may lose the last commits but never corrupts the file;
+* mmap_size and cache_size: reads are served from a memory map of the file and a
+  larger per-connection page cache;
+* BEGIN IMMEDIATE for transaction.atomic() blocks (Django's transaction_mode): the
+  write lock is taken when the transaction starts. A deferred transaction that has
+  read and then writes can't wait for the lock -- SQLite fails it at once to avoid
+  a deadlock, whatever busy_timeout says.
+
+CATALOG_SQLITE_PRAGMAS adds or overrides individual pragmas. A transaction_mode set
+in the database OPTIONS takes precedence over the profile's.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+PROFILES = {
+    'production': {
+        'transaction_mode': 'IMMEDIATE',
+        'pragmas': {
+            # First, so switching the journal mode also waits for other connections
+            'busy_timeout': 5000,
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,  # negative: in KiB, so 64 MiB
+            'temp_store': 'MEMORY',
+        },
+    },
+}
+
+
+def profile():
+    name = getattr(settings, 'CATALOG_SQLITE_PROFILE', None) or None
+    if name is not None and name not in PROFILES:
+        raise ImproperlyConfigured(
+            f"CATALOG_SQLITE_PROFILE must be one of {', '.join(sorted(PROFILES))} or empty, not {name!r}"
+        )
+    return PROFILES.get(name, {})
+
+
+def pragmas():
+    return {**profile().get('pragmas', {}), **getattr(settings, 'CATALOG_SQLITE_PRAGMAS', {})}
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver."""
+    if connection.vendor != 'sqlite':
+        return
+    transaction_mode = profile().get('transaction_mode')
+    if transaction_mode and not connection.settings_dict['OPTIONS'].get('transaction_mode'):
+        connection.transaction_mode = transaction_mode
+    for name, value in pragmas().items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,159 @@
+"""
+Incremental maintenance of CategoryStats.
+
+Every write path reports what it changed as per-category deltas: save()/delete()
+through the signals in catalog.signals, bulk paths by calling record_created() /
+record_deleted() / apply_changes() directly. The signals diff against the row as
+read and locked inside the write's transaction, never against what the instance
+loaded earlier, which may be stale. rebuild() recomputes everything from
+the product table and is what `manage.py rebuild_catalog_stats` runs. Prices are
+summed as Product.price_base, in the base currency.
+
+Every category's row exists before its first product does: it is created with the
+category (catalog.signals), and migration 0008 creates the uncategorised row. Deltas
+are then a plain F() UPDATE. A row that is still missing (e.g. a category that was
+bulk-created) is created in a savepoint first. The unique constraint covers the
+category=None row too, so a writer that loses that race retries the UPDATE.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import Category, CategoryStats, Product
+
+LOW_STOCK_THRESHOLD = 10
+
+FIELDS = ('product_count', 'in_stock_count', 'low_stock_count', 'stock_quantity_sum', 'price_sum', 'stock_value')
+
+
+def _money(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def contribution(price_base, stock_quantity):
+    """What a single product adds to its category's totals."""
+    price = _money(price_base)
+    stock_quantity = stock_quantity or 0
+    return {
+        'product_count': 1,
+        'in_stock_count': 1 if stock_quantity > 0 else 0,
+        'low_stock_count': 1 if 0 < stock_quantity <= LOW_STOCK_THRESHOLD else 0,
+        'stock_quantity_sum': stock_quantity,
+        'price_sum': price,
+        'stock_value': price * stock_quantity,
+    }
+
+
+class Deltas:
+    """Accumulates per-category deltas so a batch is applied with one UPDATE per category."""
+
+    def __init__(self):
+        self.by_category = defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+
+    def add(self, category_id, price_base, stock_quantity, sign=1):
+        totals = self.by_category[category_id]
+        for field, value in contribution(price_base, stock_quantity).items():
+            totals[field] += sign * value
+
+    def apply(self):
+        if not self.by_category:
+            return
+        with transaction.atomic():
+            # Fixed order, so concurrent writers lock stats rows in the same sequence
+            ordered = sorted(self.by_category.items(), key=lambda item: (item[0] is not None, item[0] or 0))
+            for category_id, totals in ordered:
+                if not any(totals.values()):
+                    continue
+                if category_id is None:
+                    rows = CategoryStats.objects.filter(category__isnull=True)
+                else:
+                    rows = CategoryStats.objects.filter(category_id=category_id)
+                changes = {field: F(field) + value for field, value in totals.items()}
+                if not rows.update(**changes):
+                    create_row(category_id)
+                    rows.update(**changes)
+        self.by_category.clear()
+
+
+def create_row(category_id):
+    """Create an empty stats row, unless another transaction just did."""
+    try:
+        with transaction.atomic():
+            CategoryStats.objects.create(category_id=category_id)
+    except IntegrityError:
+        pass
+
+
+def record_created(products):
+    deltas = Deltas()
+    for product in products:
+        deltas.add(product.category_id, product.price_base, product.stock_quantity)
+    deltas.apply()
+
+
+def record_deleted(products):
+    deltas = Deltas()
+    for product in products:
+        deltas.add(product.category_id, product.price_base, product.stock_quantity, sign=-1)
+    deltas.apply()
+
+
+def apply_changes(changes):
+    """`changes` is an iterable of (old, new) (category_id, price_base, stock_quantity) tuples."""
+    deltas = Deltas()
+    for old, new in changes:
+        if old == new:
+            continue
+        deltas.add(*old, sign=-1)
+        deltas.add(*new)
+    deltas.apply()
+
+
+def locked_state(product):
+    """
+    (category_id, price_base, stock_quantity) of the product's row as it is now, or None
+    if there is no row. Call inside the write's transaction: the row stays locked until
+    it ends, so no other writer can change what the delta is worked out from.
+    """
+    if product.pk is None:
+        return None
+    row = (
+        Product.objects.select_for_update().filter(pk=product.pk)
+        .values_list('category_id', 'price_base', 'stock_quantity').first()
+    )
+    return (row[0], _money(row[1]), row[2]) if row else None
+
+
+def current_state(product):
+    return product.category_id, _money(product.price_base), product.stock_quantity
+
+
+def move_category_to_uncategorised(category_id):
+    """Products of a deleted category fall into the category=None bucket (SET_NULL)."""
+    stats = CategoryStats.objects.filter(category_id=category_id).values(*FIELDS).first()
+    if stats:
+        deltas = Deltas()
+        deltas.by_category[None] = stats
+        deltas.apply()
+
+
+@transaction.atomic
+def rebuild():
+    """Recompute every CategoryStats row from the product table, one per category plus the uncategorised row."""
+    low = Q(stock_quantity__gt=0, stock_quantity__lte=LOW_STOCK_THRESHOLD)
+    rows = Product.objects.order_by().values('category_id').annotate(
+        product_count=Count('id'),
+        in_stock_count=Count('id', filter=Q(stock_quantity__gt=0)),
+        low_stock_count=Count('id', filter=low),
+        stock_quantity_sum=Sum('stock_quantity'),
+        price_sum=Sum('price_base'),
+        stock_value=Sum(F('price_base') * F('stock_quantity')),
+    )
+    totals = {row['category_id']: row for row in rows}
+    CategoryStats.objects.all().delete()
+    CategoryStats.objects.bulk_create([
+        CategoryStats(**{field: totals.get(category_id, {}).get(field) or 0 for field in FIELDS}, category_id=category_id)
+        for category_id in [None, *Category.objects.values_list('pk', flat=True)]
+    ])
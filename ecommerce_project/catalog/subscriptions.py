@@ -0,0 +1,194 @@
+"""
+GraphQL over WebSocket, mounted at /graphql/ws/ by ecommerce_project.asgi.
+
+Speaks the graphql-transport-ws protocol of the `graphql-ws` client, which GraphiQL
+uses too: connection_init/connection_ack, ping/pong, then subscribe, next, error and
+complete per operation. Operations run against catalog.schema.async_schema with the
+same validation and cost limits as /graphql/; queries and mutations get one `next`.
+Subscription updates come from catalog.events. Each event is executed with a fresh
+context, so request-scoped loaders never serve rows from an earlier event.
+"""
+import asyncio
+import json
+import logging
+from contextlib import nullcontext
+from inspect import isawaitable
+
+from graphene_django.views import GraphQLView
+from graphql import ExecutionResult, GraphQLError, OperationType, create_source_event_stream, execute, get_operation_ast
+
+from . import graphql_cache, routers
+from .schema import async_schema
+
+logger = logging.getLogger(__name__)
+
+PATH = '/graphql/ws/'
+PROTOCOL = 'graphql-transport-ws'
+# Seconds a client has to send connection_init after connecting
+INIT_TIMEOUT = 10
+
+
+class SubscriptionContext:
+    """Stands in for the request as info.context."""
+
+    def __init__(self, scope):
+        self.scope = scope
+
+
+class Connection:
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self._send = send
+        self.send_lock = asyncio.Lock()
+        self.acknowledged = False
+        self.operations = {}
+
+    async def send(self, message):
+        # Operations send from their own tasks
+        async with self.send_lock:
+            await self._send(message)
+
+    async def send_json(self, message):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    async def close(self, code, reason):
+        await self.send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    async def run(self):
+        if (await self.receive())['type'] != 'websocket.connect':
+            return
+        if PROTOCOL not in self.scope.get('subprotocols', ()):
+            # Closing before accepting rejects the handshake
+            return await self.close(4406, 'Subprotocol not acceptable')
+        await self.send({'type': 'websocket.accept', 'subprotocol': PROTOCOL})
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + INIT_TIMEOUT
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(
+                        self.receive(), None if self.acknowledged else max(deadline - loop.time(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    return await self.close(4408, 'Connection initialisation timeout')
+                if message['type'] == 'websocket.disconnect':
+                    return
+                if message['type'] == 'websocket.receive' and not await self.handle(
+                    message.get('text') or message.get('bytes')
+                ):
+                    return
+        finally:
+            tasks = list(self.operations.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def handle(self, raw):
+        """Act on one client message; False once the connection has been closed."""
+        try:
+            message = json.loads(raw)
+            kind = message['type']
+        except (TypeError, ValueError, KeyError):
+            await self.close(4400, 'Invalid message')
+            return False
+
+        if kind == 'connection_init':
+            if self.acknowledged:
+                await self.close(4429, 'Too many initialisation requests')
+                return False
+            self.acknowledged = True
+            await self.send_json({'type': 'connection_ack'})
+        elif kind == 'ping':
+            await self.send_json({'type': 'pong'})
+        elif kind == 'pong':
+            pass
+        elif kind == 'subscribe':
+            if not self.acknowledged:
+                await self.close(4401, 'Unauthorized')
+                return False
+            id, payload = message.get('id'), message.get('payload')
+            if not isinstance(id, str) or not isinstance(payload, dict) or not isinstance(payload.get('query'), str):
+                await self.close(4400, 'Invalid message')
+                return False
+            if id in self.operations:
+                await self.close(4409, f'Subscriber for {id} already exists')
+                return False
+            self.operations[id] = asyncio.ensure_future(self.operate(id, payload))
+        elif kind == 'complete':
+            task = self.operations.pop(message.get('id'), None)
+            if task is not None:
+                task.cancel()
+        else:
+            await self.close(4400, 'Invalid message')
+            return False
+        return True
+
+    async def operate(self, id, payload):
+        try:
+            if await self.execute(id, payload):
+                await self.send_json({'type': 'complete', 'id': id})
+        except Exception as error:
+            logger.exception("GraphQL operation over WebSocket failed")
+            await self.send_json({'type': 'error', 'id': id, 'payload': [{'message': str(error)}]})
+        finally:
+            if self.operations.get(id) is asyncio.current_task():
+                del self.operations[id]
+
+    async def execute(self, id, payload):
+        """Run one operation; False if it ended in an `error` message."""
+        query = payload['query']
+        document, _, errors = graphql_cache.get_document(async_schema, query, graphql_cache.query_hash(query))
+        operation_name = payload.get('operationName')
+        if document is not None and get_operation_ast(document, operation_name) is None:
+            errors = [GraphQLError('Must provide a valid operation.')]
+        if errors:
+            return await self.send_errors(id, errors)
+        operation = get_operation_ast(document, operation_name).operation
+        options = {'variable_values': payload.get('variables'), 'operation_name': operation_name}
+
+        if operation != OperationType.SUBSCRIPTION:
+            with routers.use_primary() if operation == OperationType.MUTATION else nullcontext():
+                await self.send_result(id, await self.run_document(document, None, options))
+            return True
+
+        stream = await create_source_event_stream(
+            async_schema.graphql_schema, document, context_value=SubscriptionContext(self.scope), **options
+        )
+        if isinstance(stream, ExecutionResult):
+            return await self.send_errors(id, stream.errors)
+        try:
+            async for event in stream:
+                await self.send_result(id, await self.run_document(document, event, options))
+        except Exception as error:
+            # Raised by the subscription itself, e.g. a client too far behind
+            return await self.send_errors(id, [GraphQLError(str(error))])
+        finally:
+            await stream.aclose()
+        return True
+
+    async def run_document(self, document, root_value, options):
+        result = execute(
+            async_schema.graphql_schema, document, root_value=root_value,
+            context_value=SubscriptionContext(self.scope), **options,
+        )
+        return await result if isawaitable(result) else result
+
+    async def send_result(self, id, result):
+        payload = {'data': result.data}
+        if result.errors:
+            payload['errors'] = [GraphQLView.format_error(error) for error in result.errors]
+        await self.send_json({'type': 'next', 'id': id, 'payload': payload})
+
+    async def send_errors(self, id, errors):
+        await self.send_json({'type': 'error', 'id': id, 'payload': [GraphQLView.format_error(e) for e in errors]})
+        return False
+
+
+async def application(scope, receive, send):
+    """ASGI application for websocket connections."""
+    if scope['path'] != PATH:
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 1000})
+    await Connection(scope, receive, send).run()
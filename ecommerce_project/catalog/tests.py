@@ -1,3 +1,1789 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import changelist, changes, currency, events, graphql_cache, inventory, jobs, product_cache, profiling, query_cost, routers, stats
+from .loaders import AsyncBatchLoader, CatalogLoaders
+from .models import Category, CategoryStats, Job, Product, ProductChange
+from .pagination import max_page_size
+from .schema import schema
+from .subscriptions import application as websocket_application
+from .views import get_dashboard_stats
+
+
+class Context:
+    """Stand-in for the request object GraphQLView passes as context."""
+
+
+def stats_rows(*fields):
+    """{category_id: (fields...)} for every CategoryStats row."""
+    return {row[0]: row[1:] for row in CategoryStats.objects.values_list('category_id', *fields)}
+
+
+def make_products(count, categories):
+    products = Product.objects.bulk_create([
+        Product(
+            name=f"Product {i}",
+            description="A product",
+            price=Decimal('10.00') + i,
+            currency='USD',
+            stock_quantity=i % 5,
+            category=categories[i % len(categories)],
+        )
+        for i in range(count)
+    ])
+    stats.record_created(products)
+    return products
+
+
+class DataLoaderTests(TestCase):
+    def execute(self, query):
+        with CaptureQueriesContext(connection) as ctx:
+            result = schema.execute(query, context_value=Context())
+        self.assertIsNone(result.errors)
+        return result.data, len(ctx.captured_queries)
+
+    def test_products_category_query_count_is_constant(self):
+        categories = [Category.objects.create(name=f"Category {i}") for i in range(10)]
+        query = "{ products { id name category { name } } }"
+
+        make_products(5, categories)
+        data, small = self.execute(query)
+        self.assertEqual(len(data['products']), 5)
+
+        make_products(50, categories)
+        data, large = self.execute(query)
+        self.assertEqual(len(data['products']), 55)
+        self.assertEqual(small, large)
+        self.assertEqual(large, 1)
+
+    def test_categories_products_query_count_is_constant(self):
+        query = "{ categories { name products { name category { name } } } }"
+
+        categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+        make_products(6, categories)
+        _, small = self.execute(query)
+
+        categories += [Category.objects.create(name=f"More {i}") for i in range(10)]
+        make_products(60, categories)
+        data, large = self.execute(query)
+        self.assertEqual(len(data['categories']), 13)
+        self.assertEqual(sum(len(c['products']) for c in data['categories']), 66)
+        self.assertEqual(small, large)
+        self.assertEqual(large, 2)
+
+    def test_category_products_are_capped_per_category(self):
+        categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+        products = make_products(12, categories)
+        first_two = {c.pk: [str(p.pk) for p in products if p.category_id == c.pk][:2] for c in categories}
+        with self.settings(CATALOG_MAX_PAGE_SIZE=2):
+            # Prefetched through the optimizer
+            data, queries = self.execute("{ categories { id products { id } } }")
+            self.assertEqual(queries, 2)
+            self.assertEqual({int(c['id']): [p['id'] for p in c['products']] for c in data['categories']}, first_two)
+            # Batched through the loader
+            data, _ = self.execute("{ product(id: %d) { category { products { id } } } }" % products[0].pk)
+            self.assertEqual([p['id'] for p in data['product']['category']['products']], first_two[categories[0].pk])
+            loaders = CatalogLoaders()
+            self.assertEqual(len(loaders.products_by_category.load(categories[1].pk)), 2)
+
+    def test_loader_batches_queued_keys(self):
+        categories = [Category.objects.create(name=f"Category {i}") for i in range(4)]
+        make_products(8, categories)
+        products = list(Product.objects.all())
+        loaders = CatalogLoaders()
+        loaders.category_by_id.queue(p.category_id for p in products)
+        with self.assertNumQueries(1):
+            names = {loaders.category_by_id.load(p.category_id).name for p in products}
+        self.assertEqual(len(names), 4)
+
+
+class QueryOptimizerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Books", description="Reading")
+        make_products(3, [self.category])
+
+    def execute(self, query):
+        with CaptureQueriesContext(connection) as ctx:
+            result = schema.execute(query, context_value=Context())
+        self.assertIsNone(result.errors)
+        return result.data, ctx.captured_queries
+
+    def test_only_requested_columns_are_selected(self):
+        data, queries = self.execute("{ products { id name price } }")
+        self.assertEqual(len(data['products']), 3)
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertIn('"catalog_product"."price"', sql)
+        self.assertNotIn('"catalog_product"."description"', sql)
+
+    def test_category_is_joined(self):
+        data, queries = self.execute("{ products { name category { name } } }")
+        self.assertEqual(len(queries), 1)
+        self.assertIn('JOIN "catalog_category"', queries[0]['sql'])
+        self.assertEqual(data['products'][0]['category']['name'], "Books")
+
+    def test_fragments_and_back_references(self):
+        query = """
+            { categories { ...Cat } }
+            fragment Cat on CategoryType { name products { name category { description } } }
+        """
+        data, queries = self.execute(query)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(data['categories'][0]['products'][0]['category']['description'], "Reading")
+
+    def test_single_product(self):
+        product = Product.objects.first()
+        data, queries = self.execute('{ product(id: %d) { name stockQuantity } }' % product.pk)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(data['product']['name'], product.name)
+
+
+class ProductConnectionTests(TestCase):
+    QUERY = """
+        query($first: Int, $after: String, $last: Int, $before: String, $orderBy: String) {
+          productsConnection(first: $first, after: $after, last: $last, before: $before, orderBy: $orderBy) {
+            edges { cursor node { id name price } }
+            pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+          }
+        }
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name="Toys")
+        # Repeated prices exercise the id tiebreaker
+        Product.objects.bulk_create([
+            Product(name=f"Toy {i}", description="", price=Decimal(5 + i % 4), category=category)
+            for i in range(23)
+        ])
+
+    def page(self, **variables):
+        result = schema.execute(self.QUERY, variables=variables, context_value=Context())
+        self.assertIsNone(result.errors)
+        return result.data['productsConnection']
+
+    def walk(self, order_by, size):
+        seen, after = [], None
+        while True:
+            with self.assertNumQueries(1):
+                page = self.page(first=size, after=after, orderBy=order_by)
+            seen += [int(edge['node']['id']) for edge in page['edges']]
+            if not page['pageInfo']['hasNextPage']:
+                return seen
+            after = page['pageInfo']['endCursor']
+
+    def test_forward_pages_match_full_ordering(self):
+        for order_by in ('price', '-price', 'name', '-id'):
+            tiebreak = '-id' if order_by.startswith('-') else 'id'
+            expected = list(Product.objects.order_by(order_by, tiebreak).values_list('id', flat=True))
+            self.assertEqual(self.walk(order_by, 5), expected)
+
+    def test_backward_page(self):
+        first_page = self.page(first=10, orderBy='price')
+        last_of_it = first_page['pageInfo']['endCursor']
+        page = self.page(last=4, before=last_of_it, orderBy='price')
+        self.assertEqual(
+            [e['node']['id'] for e in page['edges']],
+            [e['node']['id'] for e in first_page['edges'][5:9]],
+        )
+        self.assertTrue(page['pageInfo']['hasPreviousPage'])
+
+    def test_last_with_after_keeps_both_bounds(self):
+        first_page = self.page(first=10, orderBy='price')
+        after = first_page['pageInfo']['endCursor']
+        ids = [e['node']['id'] for e in self.page(first=100, after=after, orderBy='price')['edges']]
+        page = self.page(last=20, after=after, orderBy='price')
+        self.assertEqual([e['node']['id'] for e in page['edges']], ids)
+
+        # Between two cursors: never a row at or before `after`
+        before = self.page(first=5, after=after, orderBy='price')['pageInfo']['endCursor']
+        page = self.page(last=10, after=after, before=before, orderBy='price')
+        self.assertEqual([e['node']['id'] for e in page['edges']], ids[:4])
+
+    def test_page_size_is_capped(self):
+        with self.settings(CATALOG_MAX_PAGE_SIZE=7):
+            page = self.page(first=1000)
+        self.assertEqual(len(page['edges']), 7)
+        self.assertTrue(page['pageInfo']['hasNextPage'])
+
+    def test_unpaginated_list_is_capped(self):
+        ids = [str(pk) for pk in Product.objects.order_by('pk').values_list('pk', flat=True)]
+        with self.settings(CATALOG_MAX_PAGE_SIZE=7):
+            result = schema.execute('{ products { id } }', context_value=Context())
+            cheapest = schema.execute('{ products(orderBy: "price") { price } }', context_value=Context())
+        self.assertEqual(len(result.data['products']), 7)
+        self.assertLessEqual({p['id'] for p in result.data['products']}, set(ids))
+        self.assertEqual([p['price'] for p in cheapest.data['products']], ['5.00'] * 6 + ['6.00'])
+
+    def test_invalid_cursor_and_order(self):
+        result = schema.execute(self.QUERY, variables={'after': 'garbage'}, context_value=Context())
+        self.assertEqual(result.errors[0].message, "Invalid cursor.")
+        result = schema.execute(self.QUERY, variables={'orderBy': 'description'}, context_value=Context())
+        self.assertIn("Cannot order by", result.errors[0].message)
+
+
+class SearchTests(TestCase):
+    QUERY = 'query($q: String) { products(search: $q) { name } }'
+
+    def setUp(self):
+        self.category = Category.objects.create(name="Electronics")
+        Product.objects.bulk_create([
+            Product(name="Smartphone Pro", description="A phone with a great camera", price=500, category=self.category),
+            Product(name="Camera Mini", description="Compact camera", price=300, category=self.category),
+            Product(name="Headphones", description="Noise cancelling", price=100, category=self.category),
+        ])
+
+    def search(self, term):
+        result = schema.execute(self.QUERY, variables={'q': term}, context_value=Context())
+        self.assertIsNone(result.errors)
+        return [p['name'] for p in result.data['products']]
+
+    def test_bulk_created_rows_are_indexed_and_ranked(self):
+        # Name matches outrank description-only matches
+        self.assertEqual(self.search("camera")[0], "Camera Mini")
+        self.assertEqual(set(self.search("camera")), {"Camera Mini", "Smartphone Pro"})
+
+    def test_prefix_and_multiple_words(self):
+        self.assertEqual(self.search("head"), ["Headphones"])
+        self.assertEqual(self.search("compact cam"), ["Camera Mini"])
+        self.assertEqual(self.search('"); DROP'), [])
+
+    def test_index_follows_save_and_delete(self):
+        product = Product.objects.get(name="Headphones")
+        product.name = "Earbuds"
+        product.save()
+        self.assertEqual(self.search("headphones"), [])
+        self.assertEqual(self.search("earbuds"), ["Earbuds"])
+        product.delete()
+        self.assertEqual(self.search("earbuds"), [])
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN every hot catalog query and fail if one regresses to a full table scan
+    or to sorting the table instead of walking an index.
+    """
+
+    GRAPHQL = {
+        'filter by category and price': '{ products(categoryId: %(category)d, minPrice: 10, maxPrice: 50) { id } }',
+        'order by price': '{ products(orderBy: "-price") { id } }',
+        'keyset page by price': '{ productsConnection(first: 5, after: "%(price_cursor)s", orderBy: "price") { edges { node { id } } } }',
+        'keyset page by created_at': '{ productsConnection(last: 5, orderBy: "created_at") { edges { node { id } } } }',
+        'keyset page by updated_at': '{ productsConnection(first: 5, orderBy: "-updated_at") { edges { node { id } } } }',
+        'keyset page by name': '{ productsConnection(first: 5, orderBy: "-name") { edges { node { id } } } }',
+        'product detail': '{ product(id: 1) { id name } }',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Garden")
+        make_products(50, [cls.category])
+
+    def dashboard_and_admin_querysets(self):
+        return {
+            'low stock': Product.objects.filter(stock_quantity__gt=0, stock_quantity__lte=10).order_by('stock_quantity')[:5],
+            'out of stock': Product.objects.filter(stock_quantity=0),
+            'most stocked': Product.objects.order_by('-stock_quantity', '-id')[:5],
+            'admin changelist by created_at': Product.objects.order_by('-created_at', '-id')[:100],
+        }
+
+    def explain(self, sql, params=()):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+    def assertNoFullScan(self, label, plan):
+        if connection.vendor == 'postgresql':
+            bad = re.search(r'Seq Scan on catalog_product\b|Sort Key', plan)
+        else:
+            bad = re.search(r'SCAN catalog_product$|SCAN catalog_product\b(?! USING)|TEMP B-TREE', plan, re.M)
+        self.assertIsNone(bad, f"{label} no longer uses an index:\n{plan}")
+
+    def test_graphql_queries_use_indexes(self):
+        from .pagination import encode_cursor
+
+        values = {'category': self.category.pk, 'price_cursor': encode_cursor(['20.00', 1])}
+        for label, query in self.GRAPHQL.items():
+            with CaptureQueriesContext(connection) as ctx:
+                result = schema.execute(query % values, context_value=Context())
+            self.assertIsNone(result.errors, label)
+            for captured in ctx.captured_queries:
+                self.assertNoFullScan(label, self.explain(captured['sql']))
+
+    def test_dashboard_and_admin_queries_use_indexes(self):
+        for label, queryset in self.dashboard_and_admin_querysets().items():
+            sql, params = queryset.query.sql_with_params()
+            self.assertNoFullScan(label, self.explain(sql, params))
+
+
+class DashboardStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+        make_products(10, categories)
+
+    def test_five_queries_then_cached(self):
+        # The stats rows (every KPI), the three top-5 lists and the categories
+        with self.assertNumQueries(5):
+            stats = get_dashboard_stats()
+        self.assertEqual(stats['total_products'], 10)
+        self.assertEqual(stats['products_out_of_stock'], 2)
+        self.assertEqual(stats['products_in_stock'], 8)
+        self.assertEqual(stats['total_categories'], 3)
+        expected_value = sum(p.price * p.stock_quantity for p in Product.objects.all())
+        self.assertEqual(stats['total_stock_value'], expected_value)
+
+        with self.assertNumQueries(0):
+            get_dashboard_stats()
+
+    def test_writes_invalidate_cache(self):
+        get_dashboard_stats()
+        Product.objects.first().delete()
+        self.assertEqual(get_dashboard_stats()['total_products'], 9)
+        Category.objects.create(name="New")
+        self.assertEqual(get_dashboard_stats()['total_categories'], 4)
+
+
+class CategoryStatsTests(TestCase):
+    def test_every_category_has_a_row_up_front(self):
+        books = Category.objects.create(name="Books")
+        self.assertTrue(CategoryStats.objects.filter(category=books).exists())
+        self.assertEqual(CategoryStats.objects.filter(category__isnull=True).count(), 1)
+        # A writer that loses the race to create a row carries on with the UPDATE
+        stats.create_row(books.pk)
+        stats.create_row(None)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CategoryStats.objects.create(category=None)
+
+        # Rows missing anyway (e.g. bulk-created categories) are created on first use
+        CategoryStats.objects.filter(category=books).delete()
+        make_products(2, [books])
+        self.assertEqual(CategoryStats.objects.get(category=books).product_count, 2)
+
+    def snapshot(self):
+        return {
+            row.category_id: tuple(getattr(row, field) for field in stats.FIELDS)
+            for row in CategoryStats.objects.all()
+            if row.product_count
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshot()
+        stats.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_incremental_updates_match_rebuild(self):
+        books = Category.objects.create(name="Books")
+        games = Category.objects.create(name="Games")
+        make_products(12, [books, games])
+        self.assertMatchesRebuild()
+
+        product = Product.objects.filter(category=books).first()
+        product.price = 99.99  # GraphQL mutations assign floats
+        product.stock_quantity = 7
+        product.category = games
+        product.save()
+        product.save()  # a second save must not double count
+        self.assertMatchesRebuild()
+
+        Product.objects.filter(category=games).first().delete()
+        self.assertMatchesRebuild()
+
+        books.delete()  # SET_NULL moves its products to the uncategorised bucket
+        self.assertMatchesRebuild()
+        self.assertIn(None, self.snapshot())
+
+    def test_stale_instances_diff_against_the_row(self):
+        books = Category.objects.create(name="Books")
+        games = Category.objects.create(name="Games")
+        [product] = make_products(1, [books])
+        first, second = Product.objects.get(pk=product.pk), Product.objects.get(pk=product.pk)
+        first.stock_quantity = 5
+        first.save()
+        second.stock_quantity = 7
+        second.save()
+        third = Product.objects.get(pk=product.pk)
+        third.category = games
+        third.save()  # moves the row out from under `first`
+        first.price = 3
+        first.save()
+        self.assertMatchesRebuild()
+
+        second.delete()
+        self.assertMatchesRebuild()
+        self.assertEqual(self.snapshot(), {})
+
+    def test_mutations_update_stats(self):
+        category = Category.objects.create(name="Music")
+        result = schema.execute(
+            'mutation($c: ID!) { createProduct(name: "Drum", description: "", price: 12.5, currency: "USD", '
+            'stockQuantity: 4, categoryId: $c) { product { id } } }',
+            variables={'c': category.pk}, context_value=Context(),
+        )
+        self.assertIsNone(result.errors)
+        row = CategoryStats.objects.get(category=category)
+        self.assertEqual((row.product_count, row.low_stock_count, row.stock_value), (1, 1, Decimal('50.00')))
+
+        product_id = result.data['createProduct']['product']['id']
+        schema.execute('mutation($id: ID!) { updateProduct(id: $id, stockQuantity: 0) { product { id } } }',
+                       variables={'id': product_id}, context_value=Context())
+        row.refresh_from_db()
+        self.assertEqual((row.in_stock_count, row.stock_value), (0, Decimal('0.00')))
+        self.assertMatchesRebuild()
+
+
+class CreateProductsCommandTests(TestCase):
+    def run_command(self, *args):
+        call_command('create_products', *args, stdout=StringIO())
+        return list(Product.objects.order_by('pk').values_list('name', 'price', 'stock_quantity', 'category__name'))
+
+    def test_seed_is_reproducible_and_batched(self):
+        first = self.run_command('--products', '25', '--batch-size', '7', '--seed', '42', '--clear')
+        second = self.run_command('--products', '25', '--batch-size', '7', '--seed', '42', '--clear')
+        self.assertEqual(len(first), 25)
+        self.assertEqual(first, second)
+        self.assertEqual(sum(CategoryStats.objects.values_list('product_count', flat=True)), 25)
+
+    def test_worker_pool_matches_inline_generation(self):
+        inline = self.run_command('--products', '30', '--batch-size', '8', '--seed', '7', '--clear')
+        pooled = self.run_command('--products', '30', '--batch-size', '8', '--seed', '7', '--clear', '--workers', '2')
+        self.assertEqual(inline, pooled)
+
+
+class ImportExportCommandTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_round_trip_and_upsert(self):
+        category = Category.objects.create(name="Books")
+        make_products(5, [category])
+        for fmt in ('csv', 'jsonl'):
+            call_command('export_products', self.path(f'out.{fmt}'), '--chunk-size', '2', stdout=StringIO())
+
+        with open(self.path('out.jsonl')) as handle:
+            records = [json.loads(line) for line in handle]
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[0]['category'], "Books")
+
+        # Edit one exported row, add a new one in a new category and one broken row
+        records[0]['price'] = '1.50'
+        records[0]['stock_quantity'] = 3
+        with open(self.path('in.jsonl'), 'w') as handle:
+            for record in records + [
+                {'name': "Atlas", 'price': '20', 'category': "Maps", 'stock_quantity': 2},
+                {'name': "Broken", 'price': 'free'},
+            ]:
+                handle.write(json.dumps(record) + '\n')
+
+        stderr = StringIO()
+        call_command('import_products', self.path('in.jsonl'), '--batch-size', '3', stdout=StringIO(), stderr=stderr)
+        self.assertIn("Line 7", stderr.getvalue())
+        self.assertEqual(Product.objects.count(), 6)
+        updated = Product.objects.get(pk=records[0]['id'])
+        self.assertEqual((updated.price, updated.stock_quantity), (Decimal('1.50'), 3))
+        self.assertEqual(Product.objects.get(name="Atlas").category.name, "Maps")
+
+        # CSV export of the original data restores the original values
+        call_command('import_products', self.path('out.csv'), stdout=StringIO())
+        self.assertEqual(Product.objects.get(pk=records[0]['id']).stock_quantity, 0)
+
+        incremental = stats_rows('product_count', 'stock_value')
+        stats.rebuild()
+        self.assertEqual(incremental, stats_rows('product_count', 'stock_value'))
+
+    def test_bad_rows_are_reported_not_truncated(self):
+        with open(self.path('in.jsonl'), 'w') as handle:
+            for record in [
+                {'name': "Fine", 'price': '5'},
+                {'name': "Refund", 'price': '-1'},
+                {'name': "Dollars", 'price': '5', 'currency': 'USDX'},
+                {'name': "x" * 256, 'price': '5'},
+                {'name': "Dear", 'price': '1e12'},
+                {'name': "Odd", 'price': 'NaN'},
+                {'name': "Also fine", 'price': '99999999.99', 'currency': 'eur'},
+            ]:
+                handle.write(json.dumps(record) + '\n')
+
+        stderr = StringIO()
+        call_command('import_products', self.path('in.jsonl'), stdout=StringIO(), stderr=stderr)
+        self.assertEqual(stderr.getvalue().splitlines(), [
+            "Line 2: skipped, Price cannot be negative.",
+            "Line 3: skipped, Currency must be a 3-letter code.",
+            "Line 4: skipped, Name cannot be longer than 255 characters.",
+            "Line 5: skipped, Price must be less than 100000000.",
+            "Line 6: skipped, Price must be a number.",
+        ])
+        self.assertEqual(
+            sorted(Product.objects.values_list('name', 'currency')), [("Also fine", 'EUR'), ("Fine", 'USD')]
+        )
+
+class BulkMutationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.books = Category.objects.create(name="Books")
+        self.games = Category.objects.create(name="Games")
+
+    def execute(self, query, **variables):
+        result = schema.execute(query, variables=variables, context_value=Context())
+        self.assertIsNone(result.errors)
+        return result.data
+
+    def assertStatsConsistent(self):
+        incremental = stats_rows('product_count', 'in_stock_count', 'stock_value')
+        stats.rebuild()
+        self.assertEqual(incremental, stats_rows('product_count', 'in_stock_count', 'stock_value'))
+
+    def test_create_products(self):
+        items = [
+            {'name': f"Book {i}", 'description': "", 'price': 9.5, 'currency': "USD",
+             'stockQuantity': i, 'categoryId': self.books.pk}
+            for i in range(20)
+        ]
+        items.append({'name': "Lost", 'description': "", 'price': 1, 'currency': "USD", 'categoryId': 999})
+        items.append({'name': "Cheap", 'description': "", 'price': -1, 'currency': "USD", 'categoryId': self.books.pk})
+        query = """mutation($items: [ProductInput!]!) {
+            createProducts(products: $items) { products { id category { name } } errors { index message } }
+        }"""
+        # categories, exchange rates (then cached), INSERT, stats UPDATE, the change-log
+        # INSERT, and savepoints; not one per item
+        with self.assertNumQueries(9):
+            data = self.execute(query, items=items)['createProducts']
+        self.assertEqual(len(data['products']), 20)
+        self.assertEqual(data['products'][0]['category']['name'], "Books")
+        self.assertEqual(data['errors'], [
+            {'index': 20, 'message': "Category not found."},
+            {'index': 21, 'message': "Price cannot be negative."},
+        ])
+        self.assertStatsConsistent()
+
+    def test_update_products(self):
+        products = make_products(30, [self.books])
+        items = [{'id': p.pk, 'price': 2.25, 'categoryId': self.games.pk} for p in products]
+        items.append({'id': 12345, 'price': 1})
+        query = """mutation($items: [ProductUpdateInput!]!) {
+            updateProducts(products: $items) { products { id price } errors { id message } }
+        }"""
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.execute(query, items=items)['updateProducts']
+        # products + categories in_bulk, one UPDATE, per-category stats writes, the
+        # change-log INSERT, savepoints
+        self.assertLessEqual(len(ctx.captured_queries), 11)
+        self.assertEqual(len(data['products']), 30)
+        self.assertEqual(data['errors'], [{'id': '12345', 'message': "Product not found."}])
+        self.assertEqual(Product.objects.filter(category=self.games, price=Decimal('2.25')).count(), 30)
+        self.assertStatsConsistent()
+
+    def test_nulls_and_oversized_prices_are_item_errors(self):
+        [product] = make_products(1, [self.books])
+        items = [
+            {'id': product.pk, 'price': None},
+            {'id': product.pk, 'stockQuantity': None},
+            {'id': product.pk, 'description': None},
+            {'id': product.pk, 'price': 1e12},
+            {'id': product.pk, 'price': 99999999.999},  # rounds up past the column
+            {'id': product.pk, 'name': "x" * 256},
+            {'id': product.pk, 'price': 99999999.99, 'stockQuantity': 2},
+        ]
+        data = self.execute(
+            """mutation($items: [ProductUpdateInput!]!) {
+                updateProducts(products: $items) { products { price stockQuantity } errors { index message } }
+            }""",
+            items=items,
+        )['updateProducts']
+        self.assertEqual(data['errors'], [
+            {'index': 0, 'message': "Price cannot be null."},
+            {'index': 1, 'message': "Stock quantity cannot be null."},
+            {'index': 2, 'message': "Description cannot be null."},
+            {'index': 3, 'message': "Price must be less than 100000000."},
+            {'index': 4, 'message': "Price must be less than 100000000."},
+            {'index': 5, 'message': "Name cannot be longer than 255 characters."},
+        ])
+        self.assertEqual(data['products'], [{'price': '99999999.99', 'stockQuantity': 2}])
+
+        data = self.execute(
+            """mutation($items: [ProductInput!]!) {
+                createProducts(products: $items) { products { name } errors { index message } }
+            }""",
+            items=[
+                {'name': "Dear", 'description': "", 'price': 1e12, 'currency': "USD", 'categoryId': self.books.pk},
+                {'name': "Null stock", 'description': "", 'price': 1, 'currency': "USD",
+                 'stockQuantity': None, 'categoryId': self.books.pk},
+            ],
+        )['createProducts']
+        self.assertEqual(data['errors'], [
+            {'index': 0, 'message': "Price must be less than 100000000."},
+            {'index': 1, 'message': "Stock quantity cannot be null."},
+        ])
+        self.assertStatsConsistent()
+
+    def test_delete_products(self):
+        products = make_products(10, [self.books, self.games])
+        ids = [p.pk for p in products[:6]] + ['0', 'nope']
+        self.assertEqual(len(product_cache.get_products(ids[:6])), 6)
+        data = self.execute(
+            'mutation($ids: [ID!]!) { deleteProducts(ids: $ids) { deletedCount errors { index id } } }', ids=ids
+        )['deleteProducts']
+        self.assertEqual(data['deletedCount'], 6)
+        self.assertEqual(data['errors'], [{'index': 6, 'id': '0'}, {'index': 7, 'id': 'nope'}])
+        self.assertEqual(Product.objects.count(), 4)
+        self.assertStatsConsistent()
+        # What the skipped post_delete receivers would have done
+        self.assertEqual(
+            sorted(ProductChange.objects.filter(op=ProductChange.DELETED).values_list('product_id', flat=True)),
+            ids[:6],
+        )
+        self.assertEqual(product_cache.get_products(ids[:6]), {})
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Shoes")
+        self.a, self.b = make_products(2, [self.category])
+        Product.objects.filter(pk=self.a.pk).update(stock_quantity=5)
+        Product.objects.filter(pk=self.b.pk).update(stock_quantity=1)
+        stats.rebuild()
+
+    def stock(self, product):
+        return Product.objects.values_list('stock_quantity', flat=True).get(pk=product.pk)
+
+    def test_multi_item_reservation_is_all_or_nothing(self):
+        with self.assertRaises(inventory.InsufficientStock) as ctx:
+            inventory.reserve_stock([(self.a.pk, 2), (self.b.pk, 2)])
+        self.assertEqual(ctx.exception.product_id, self.b.pk)
+        self.assertEqual((self.stock(self.a), self.stock(self.b)), (5, 1))
+
+        inventory.reserve_stock([(self.b.pk, 1), (self.a.pk, 2), (self.a.pk, 1)])
+        self.assertEqual((self.stock(self.a), self.stock(self.b)), (2, 0))
+        inventory.release_stock([(self.a.pk, 3)])
+        self.assertEqual(self.stock(self.a), 5)
+
+        stats_row = CategoryStats.objects.get(category=self.category)
+        self.assertEqual((stats_row.in_stock_count, stats_row.stock_quantity_sum), (1, 5))
+
+    def test_mutations(self):
+        result = schema.execute(
+            'mutation($items: [StockItemInput!]!) { reserveStock(items: $items) { ok products { stockQuantity } } }',
+            variables={'items': [{'productId': self.a.pk, 'quantity': 4}]}, context_value=Context(),
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['reserveStock']['products'], [{'stockQuantity': 1}])
+
+        result = schema.execute(
+            'mutation($id: ID!) { adjustStock(productId: $id, delta: -2) { product { stockQuantity } } }',
+            variables={'id': self.a.pk}, context_value=Context(),
+        )
+        self.assertEqual(result.errors[0].message, f"Insufficient stock for product {self.a.pk}.")
+
+
+class StockConcurrencyTests(TransactionTestCase):
+    def test_concurrent_reservations_never_oversell(self):
+        category = Category.objects.create(name="Hot")
+        first, second = make_products(2, [category])
+        Product.objects.filter(pk__in=[first.pk, second.pk]).update(stock_quantity=40)
+        stats.rebuild()
+        successes, failures = [], []
+
+        def checkout(index):
+            # Alternate the item order: the service must still lock in pk order
+            items = [(first.pk, 1), (second.pk, 1)]
+            if index % 2:
+                items.reverse()
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                try:
+                    inventory.reserve_stock(items)
+                    successes.append(index)
+                    break
+                except inventory.InsufficientStock:
+                    failures.append(index)
+                    break
+                except OperationalError:
+                    # SQLite allows one writer at a time; a real deployment retries too
+                    time.sleep(random.uniform(0.001, 0.01))
+            connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(i,)) for i in range(60)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(successes), 40)
+        self.assertEqual(len(failures), 20)
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[first.pk, second.pk]).values_list('stock_quantity', flat=True)),
+            [0, 0],
+        )
+        self.assertEqual(CategoryStats.objects.get(category=category).stock_quantity_sum, 0)
+
+
+class ProductCacheTests(TestCase):
+    QUERY = '{ product(id: %d) { name price stockQuantity category { name } } }'
+
+    def setUp(self):
+        cache.clear()
+        product_cache.reset_counters()
+        self.category = Category.objects.create(name="Books")
+        self.products = make_products(5, [self.category])
+
+    def fetch(self, product):
+        result = schema.execute(self.QUERY % product.pk, context_value=Context())
+        self.assertIsNone(result.errors)
+        return result.data['product']
+
+    def test_hit_skips_the_product_query(self):
+        product = self.products[0]
+        with self.assertNumQueries(2):
+            self.fetch(product)
+        # Only the category is read on a hit
+        with self.assertNumQueries(1):
+            data = self.fetch(product)
+        self.assertEqual(data['name'], product.name)
+        self.assertEqual(data['category']['name'], "Books")
+        with self.assertNumQueries(0):
+            self.assertEqual(product_cache.get_product(product.pk).price, product.price)
+        self.assertIsNone(product_cache.get_product(99999))
+
+        counters = product_cache.counters()
+        self.assertEqual((counters['hits'], counters['misses']), (2, 2))
+        self.assertEqual(counters['hit_rate'], 0.5)
+
+    def test_writes_invalidate(self):
+        product = self.products[0]
+        self.fetch(product)
+
+        result = schema.execute(
+            'mutation { updateProduct(id: %d, name: "Renamed") { product { id } } }' % product.pk,
+            context_value=Context(),
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(self.fetch(product)['name'], "Renamed")
+
+        product.refresh_from_db()
+        product.stock_quantity = 77
+        product.save()
+        self.assertEqual(self.fetch(product)['stockQuantity'], 77)
+
+        result = schema.execute(
+            'mutation($items: [ProductUpdateInput!]!) { updateProducts(products: $items) { errors { id } } }',
+            variables={'items': [{'id': product.pk, 'stockQuantity': 3}]},
+            context_value=Context(),
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(self.fetch(product)['stockQuantity'], 3)
+
+        inventory.reserve_stock([(product.pk, 2)])
+        self.assertEqual(self.fetch(product)['stockQuantity'], 1)
+
+        pk = product.pk
+        product.delete()
+        result = schema.execute(self.QUERY % pk, context_value=Context())
+        self.assertIsNone(result.data['product'])
+
+    def test_multi_get(self):
+        product_cache.get_product(self.products[0].pk)
+        pks = [p.pk for p in self.products] + [99999]
+        with self.assertNumQueries(1):
+            found = product_cache.get_products(pks)
+        self.assertEqual(sorted(found), sorted(p.pk for p in self.products))
+        with self.assertNumQueries(0):
+            product_cache.get_products(pks[:5])
+
+    def test_a_read_racing_a_write_cannot_cache_the_old_row(self):
+        product = self.products[0]
+        # A reader misses, then reads the row before the write commits...
+        _, generations = product_cache._read(cache, [product.pk])
+        stale = Product.objects.get(pk=product.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.stock_quantity = 42
+            product.save()
+        # ...and only gets round to caching it afterwards
+        cache.set(product_cache._key(product.pk), (generations[product.pk], product_cache.serialize(stale)))
+        self.assertEqual(product_cache.get_product(product.pk).stock_quantity, 42)
+
+
+class GraphQLResponseCacheTests(TestCase):
+    QUERY = '{ products(categoryId: %d) { name price } }'
+
+    def setUp(self):
+        cache.clear()
+        graphql_cache.documents.clear()
+        self.client = Client(HTTP_ACCEPT='application/json')
+        self.category = Category.objects.create(name="Books")
+        self.products = make_products(3, [self.category])
+
+    def post(self, body, **headers):
+        return self.client.post('/graphql/', json.dumps(body), content_type='application/json', **headers)
+
+    def test_repeat_reads_skip_execution(self):
+        query = self.QUERY % self.category.pk
+        first = self.client.get('/graphql/', {'query': query})
+        self.assertEqual(len(first.json()['data']['products']), 3)
+        self.assertTrue(first['ETag'])
+
+        with self.assertNumQueries(0):
+            again = self.client.get('/graphql/', {'query': query})
+        self.assertEqual(again.content, first.content)
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get('/graphql/', {'query': query}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], first['ETag'])
+
+    def test_writes_invalidate_responses(self):
+        query = self.QUERY % self.category.pk
+        first = self.client.get('/graphql/', {'query': query})
+        product = self.products[0]
+        product.name = "Renamed"
+        product.save()
+
+        fresh = self.client.get('/graphql/', {'query': query}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh['ETag'], first['ETag'])
+        self.assertIn("Renamed", [p['name'] for p in fresh.json()['data']['products']])
+
+    def test_documents_are_parsed_once(self):
+        query = 'query($id: ID!) { product(id: $id) { name } }'
+        for product in self.products:
+            self.post({'query': query, 'variables': {'id': product.pk}})
+        self.assertEqual(len(graphql_cache.documents.documents), 1)
+
+        invalid = self.post({'query': '{ products { nope } }'})
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual(len(graphql_cache.documents.documents), 1)
+
+    def test_persisted_queries(self):
+        query = self.QUERY % self.category.pk
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': graphql_cache.query_hash(query)}}
+
+        missing = self.post({'extensions': extensions}).json()
+        self.assertEqual(missing['errors'][0]['extensions']['code'], 'PERSISTED_QUERY_NOT_FOUND')
+
+        registered = self.post({'query': query, 'extensions': extensions})
+        self.assertEqual(len(registered.json()['data']['products']), 3)
+
+        with self.assertNumQueries(0):
+            by_hash = self.client.get('/graphql/', {'extensions': json.dumps(extensions)})
+        self.assertEqual(by_hash.json(), registered.json())
+
+        wrong = self.post({'query': '{ categories { name } }', 'extensions': extensions})
+        self.assertEqual(wrong.status_code, 400)
+
+    def test_mutations_are_not_cached(self):
+        query = 'mutation { updateProduct(id: %d, stockQuantity: 9) { product { stockQuantity } } }' % self.products[0].pk
+        response = self.post({'query': query})
+        self.assertEqual(response.json()['data']['updateProduct']['product']['stockQuantity'], 9)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(self.client.get('/graphql/', {'query': query}).status_code, 405)
+
+
+class QueryCostTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        graphql_cache.documents.clear()
+        self.client = Client(HTTP_ACCEPT='application/json')
+
+    def measure(self, query):
+        from graphql import parse
+        return query_cost.measure(schema.graphql_schema, parse(query))
+
+    def post(self, query, **variables):
+        return self.client.post(
+            '/graphql/', json.dumps({'query': query, 'variables': variables}), content_type='application/json'
+        )
+
+    def test_lists_multiply_their_children(self):
+        size = max_page_size()
+        self.assertEqual(self.measure('{ products { name } }'), {None: query_cost.Cost(2, size)})
+        costs = self.measure("""
+            query Nested { categories { ...Cat } }
+            fragment Cat on CategoryType { products { category { name } } }
+        """)
+        self.assertEqual(costs['Nested'], query_cost.Cost(4, size + 2 * size * size))
+
+    def test_page_size_arguments(self):
+        costs = self.measure("""
+            query Page($n: Int) {
+                small: productsConnection(first: 5) { edges { node { category { name } } } }
+                open: productsConnection(first: $n) { pageInfo { hasNextPage } }
+            }
+        """)
+        # connection + 5 edges + 5 nodes + 5 categories; then connection + pageInfo
+        self.assertEqual(costs['Page'].cost, 16 + 2)
+
+        # An empty page costs only its connection, not the default list size
+        costs = self.measure('{ productsConnection(first: 0) { edges { node { name } } } jobs(first: 0) { id } }')
+        self.assertEqual(costs[None].cost, 1)
+
+    def test_pathological_queries_are_rejected_before_execution(self):
+        query = "{ categories { products { category { products { category { name } } } } } }"
+        with self.assertNumQueries(0):
+            response = self.post(query)
+        self.assertEqual(response.status_code, 400)
+        error = response.json()['errors'][0]
+        self.assertEqual(error['extensions']['code'], 'QUERY_TOO_COMPLEX')
+        self.assertGreater(error['extensions']['cost'], query_cost.max_cost())
+
+        with self.settings(CATALOG_QUERY_MAX_DEPTH=2):
+            graphql_cache.documents.clear()
+            response = self.post("{ categories { products { name } } }")
+        self.assertIn("depth 3", response.json()['errors'][0]['message'])
+
+    def test_cost_is_reported_in_extensions(self):
+        Category.objects.create(name="Books")
+        body = self.post("{ categories { name } }").json()
+        self.assertEqual(body['data']['categories'], [{'name': "Books"}])
+        self.assertEqual(body['extensions']['cost']['estimated'], max_page_size())
+        self.assertEqual(body['extensions']['cost']['depth'], 2)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client(HTTP_ACCEPT='application/json')
+        self.category = Category.objects.create(name="Books")
+        make_products(3, [self.category])
+
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get('/graphql/', {'query': '{ categories { name } }'})
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertNotIn('profile', response.json().get('extensions', {}))
+
+    def test_sampled_graphql_request(self):
+        query = '{ categories { name products { name } } }'
+        with self.settings(CATALOG_PROFILING_SAMPLE_RATE=1.0, CATALOG_PROFILING_TRACEMALLOC=True), \
+                self.assertLogs('catalog.profiling', 'INFO') as logs:
+            response = self.client.get('/graphql/', {'query': query})
+            cached = self.client.get('/graphql/', {'query': query})
+
+        profile = response.json()['extensions']['profile']
+        self.assertEqual(profile['sql']['count'], 2)
+        self.assertIn('Query.categories', [r['field'] for r in profile['resolvers']])
+        self.assertGreater(profile['memoryPeakBytes'], 0)
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        self.assertIn('cost', response.json()['extensions'])
+
+        # The response cache stores the body without the profile of the request that filled it
+        self.assertEqual(cached.json()['extensions']['profile']['sql']['count'], 0)
+        self.assertEqual(cached.json()['extensions']['profile']['resolvers'], [])
+
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertEqual((logged['path'], logged['view'], logged['status']), ('/graphql/', 'graphql', 200))
+
+    def test_repeated_statements_are_flagged(self):
+        profile = profiling.Profile('test')
+        with connection.execute_wrapper(profile):
+            for product in Product.objects.all():
+                Category.objects.get(pk=product.category_id)
+        profile.finish()
+        report = profile.report()
+        self.assertEqual(report['sql']['count'], 4)
+        self.assertEqual(len(report['sql']['duplicates']), 1)
+        self.assertEqual(report['sql']['duplicates'][0]['count'], 3)
+
+
+class BenchmarkTests(TestCase):
+    def test_benchmark_runs_every_operation(self):
+        from .management.commands.benchmark_catalog import Benchmark
+
+        call_command('create_products', products=40, seed=1, stdout=StringIO())
+        results = Benchmark(iterations=2, warmup=0).run()
+        self.assertIn('products.filtered', results)
+        self.assertIn('dashboard', results)
+        self.assertEqual(results['product.detail']['samples'], 2)
+        self.assertLessEqual(results['product.detail']['queries_max'], 2)
+
+    def test_compare_flags_regressions(self):
+        from .management.commands.benchmark_catalog import compare
+
+        def run(p95, queries):
+            return {'datasets': {'10000': {'operations': {'product.detail': {'p95_ms': p95, 'queries_max': queries}}}}}
+
+        self.assertEqual(compare(run(10, 2), run(11, 2)), [])
+        self.assertEqual(len(compare(run(10, 2), run(13, 2))), 1)
+        self.assertEqual(len(compare(run(10, 2), run(10, 3))), 1)
+
+
+class AsyncGraphQLTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client(HTTP_ACCEPT='application/json')
+        self.async_client = AsyncClient(HTTP_ACCEPT='application/json')
+        categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+        self.products = make_products(9, categories)
+
+    async def execute(self, query, **variables):
+        response = await self.async_client.post(
+            '/graphql/async/', json.dumps({'query': query, 'variables': variables}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    async def test_matches_sync_view(self):
+        query = """query($id: ID!) {
+            product(id: $id) { name category { name } }
+            categories { name products { name category { name } } }
+            productsConnection(first: 2, orderBy: "-price") { edges { node { name } } }
+        }"""
+        variables = {'id': self.products[0].pk}
+        expected = await sync_to_async(self.client.post)(
+            '/graphql/', json.dumps({'query': query, 'variables': variables}), content_type='application/json'
+        )
+        await sync_to_async(cache.clear)()
+        body = await self.execute(query, **variables)
+        self.assertNotIn('errors', body)
+        self.assertEqual(body['data'], expected.json()['data'])
+
+    async def test_ported_resolvers_match_sync_view(self):
+        await self.products[1].adelete()
+        self.products[2].stock_quantity = 40
+        await sync_to_async(self.products[2].save)()
+        job = await Job.objects.acreate(kind='reprice', status='succeeded', progress=3, total=3)
+        query = """query($id: ID!, $job: ID!) {
+            product(id: $id) { name price }
+            missing: product(id: "0") { name }
+            page: productsConnection(first: 3, orderBy: "-price") { edges { cursor node { name } } pageInfo { hasNextPage endCursor } }
+            tail: productsConnection(last: 2, categoryId: $id) { edges { node { name } } pageInfo { hasPreviousPage } }
+            productFacets(priceBuckets: [12]) { total inStock categories { categoryId count } priceBuckets { min max count } }
+            productChanges(first: 2) { cursor hasMore changes { version op productId product { name } } }
+            more: productChanges(first: 1) { hasMore }
+            job(id: $job) { kind status progress total }
+            jobs(status: "succeeded") { id }
+        }"""
+        variables = {'id': self.products[0].pk, 'job': job.pk}
+        expected = await sync_to_async(self.client.post)(
+            '/graphql/', json.dumps({'query': query, 'variables': variables}), content_type='application/json'
+        )
+        self.assertNotIn('errors', expected.json())
+        await sync_to_async(cache.clear)()
+        body = await self.execute(query, **variables)
+        self.assertNotIn('errors', body)
+        self.assertEqual(body['data'], expected.json()['data'])
+        self.assertEqual([c['op'] for c in body['data']['productChanges']['changes']], ['DELETED', 'UPDATED'])
+        self.assertTrue(body['data']['more']['hasMore'])
+        self.assertEqual(len(body['data']['jobs']), 1)
+        # Served from the product cache the second time
+        self.assertEqual((await self.execute(query, **variables))['data'], body['data'])
+
+    async def test_loaders_batch_within_a_tick(self):
+        # Counted by the profiler, which hooks the connection the async ORM really uses
+        with self.settings(CATALOG_PROFILING_SAMPLE_RATE=1.0):
+            body = await self.execute("{ categories { name products { name category { name } } } }")
+        self.assertEqual(sum(len(c['products']) for c in body['data']['categories']), 9)
+        self.assertEqual(body['extensions']['profile']['sql']['count'], 2)
+        self.assertIn('Query.categories', [r['field'] for r in body['extensions']['profile']['resolvers']])
+
+        calls = []
+
+        async def batch(keys):
+            calls.append(sorted(keys))
+            return {key: key * 2 for key in keys}
+
+        loader = AsyncBatchLoader(batch)
+        results = await asyncio.gather(*(loader.load(key) for key in [3, 1, 2, 1]))
+        self.assertEqual(results, [6, 2, 4, 2])
+        self.assertEqual(calls, [[1, 2, 3]])
+
+    async def test_session_users_are_not_served_the_shared_cache(self):
+        async def post():
+            return await self.async_client.post(
+                '/graphql/async/', json.dumps({'query': '{ productsConnection(first: 2) { edges { node { name } } } }'}),
+                content_type='application/json',
+            )
+
+        # Only cached responses carry an ETag
+        self.assertIn('ETag', (await post()).headers)
+        await self.async_client.aforce_login(await User.objects.acreate_user('shopper', password='password'))
+        response = await post()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(response.json()['data']['productsConnection']['edges']), 2)
+        self.assertNotIn('ETag', response.headers)
+
+    async def test_mutations(self):
+        product = self.products[0]
+        body = await self.execute(
+            'mutation($id: ID!) { adjustStock(productId: $id, delta: 5) { product { stockQuantity category { name } } } }',
+            id=product.pk,
+        )
+        self.assertEqual(body['data']['adjustStock']['product']['stockQuantity'], product.stock_quantity + 5)
+        self.assertEqual(body['data']['adjustStock']['product']['category']['name'], "Category 0")
+
+
+@override_settings(CATALOG_READ_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        # Known healthy, so no connection is attempted for these made-up aliases
+        now = time.monotonic()
+        routers._health.update({'replica1': (now, True), 'replica2': (now, True)})
+        self.addCleanup(routers._health.clear)
+
+    def in_request(self, pinned=False):
+        token = routers.begin(pinned)
+        self.addCleanup(routers.end, token)
+        return routers._state.get()
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+
+    def test_reads_go_to_replicas_until_the_request_writes(self):
+        state = self.in_request()
+        self.assertIn(self.router.db_for_read(Product), ['replica1', 'replica2'])
+        self.assertTrue(state.read_replica)
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_pinned_requests_and_primary_blocks_use_primary(self):
+        self.in_request(pinned=True)
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+        routers._state.get().pinned = False
+        with routers.use_primary():
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+        self.assertNotEqual(self.router.db_for_read(Product), 'default')
+
+    def test_unhealthy_replicas_are_skipped(self):
+        self.in_request()
+        routers._health['replica1'] = (time.monotonic(), False)
+        self.assertEqual({self.router.db_for_read(Product) for _ in range(20)}, {'replica2'})
+        routers._health['replica2'] = (time.monotonic(), False)
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'catalog'))
+        self.assertIsNone(self.router.allow_migrate('default', 'catalog'))
+
+    def test_writing_client_sticks_to_primary(self):
+        def view(request):
+            routers.ReplicaRouter().db_for_write(Product)
+            return HttpResponse()
+
+        response = routers.ReplicaRoutingMiddleware(view)(RequestFactory().post('/'))
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+        seen = []
+
+        def reader(request):
+            seen.append(routers.ReplicaRouter().db_for_read(Product))
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.COOKIES[routers.PIN_COOKIE] = response.cookies[routers.PIN_COOKIE].value
+        reply = routers.ReplicaRoutingMiddleware(reader)(request)
+        routers.ReplicaRoutingMiddleware(reader)(RequestFactory().get('/'))
+        self.assertEqual(seen[0], 'default')
+        self.assertNotEqual(seen[1], 'default')
+        self.assertNotIn(routers.PIN_COOKIE, reply.cookies)
+
+    def test_recent_replica_reads_are_not_cached(self):
+        state = self.in_request()
+        cache.set(routers.LAST_WRITE_KEY, time.time(), None)
+        self.addCleanup(cache.delete, routers.LAST_WRITE_KEY)
+        self.assertFalse(routers.replica_may_be_stale())
+        self.router.db_for_read(Product)
+        self.assertTrue(state.read_replica)
+        self.assertTrue(routers.replica_may_be_stale())
+        cache.set(routers.LAST_WRITE_KEY, time.time() - 60, None)
+        self.assertFalse(routers.replica_may_be_stale())
+
+    async def test_primary_blocks_reach_sync_resolvers(self):
+        def read():
+            return self.router.db_for_read(Product)
+
+        token = routers.begin()
+        try:
+            with routers.use_primary():
+                self.assertEqual(await sync_to_async(read)(), 'default')
+            self.assertNotEqual(await sync_to_async(read)(), 'default')
+        finally:
+            routers.end(token)
+
+
+class SQLiteTuningTests(SimpleTestCase):
+    def connect(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        wrapper = connections['default'].__class__(
+            {**connection.settings_dict, 'NAME': os.path.join(directory.name, 'db.sqlite3')}, 'sqlite-tuning'
+        )
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        return wrapper.connection.execute(f'PRAGMA {name}').fetchone()[0]
+
+    @override_settings(CATALOG_SQLITE_PROFILE='production', CATALOG_SQLITE_PRAGMAS={'mmap_size': 1 << 20})
+    def test_production_profile(self):
+        wrapper = self.connect()
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), -64 * 1024)
+        self.assertEqual(self.pragma(wrapper, 'mmap_size'), 1 << 20)
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+
+    @override_settings(CATALOG_SQLITE_PROFILE='')
+    def test_default_profile_leaves_sqlite_alone(self):
+        wrapper = self.connect()
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+        self.assertIsNone(wrapper.transaction_mode)
+
+    @override_settings(CATALOG_SQLITE_PROFILE='fast')
+    def test_unknown_profile(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.connect()
+
+
+class CurrencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Imports")
+        self.usd = Product.objects.create(name="Kettle", description="", price=100, currency='USD', category=self.category)
+        self.ngn = Product.objects.create(name="Fan", description="", price=100000, currency='NGN', category=self.category)
+        self.eur = Product.objects.create(name="Lamp", description="", price=50, currency='EUR', category=self.category)
+
+    def names(self, query):
+        result = schema.execute(query, context_value=Context())
+        self.assertIsNone(result.errors)
+        return [p['name'] for p in result.data['products']]
+
+    def test_prices_compare_in_the_base_currency(self):
+        self.assertEqual((self.usd.price_base, self.ngn.price_base, self.eur.price_base),
+                         (Decimal('100.00'), Decimal('65.00'), Decimal('54.00')))
+        self.assertEqual(self.names('{ products(orderBy: "-price") { name } }'), ["Kettle", "Fan", "Lamp"])
+        self.assertEqual(sorted(self.names('{ products(minPrice: 60) { name } }')), ["Fan", "Kettle"])
+        self.assertEqual(CategoryStats.objects.get(category=self.category).price_sum, Decimal('219.00'))
+        self.assertEqual(get_dashboard_stats()['top_expensive_products'], [self.usd, self.ngn, self.eur])
+
+    def test_bulk_writes_keep_price_base(self):
+        self.eur.price = 10
+        Product.objects.bulk_update([self.eur], ['price'])
+        self.eur.refresh_from_db()
+        self.assertEqual(self.eur.price_base, Decimal('10.80'))
+        [gbp] = Product.objects.bulk_create([Product(name="Mug", description="", price=10, currency='GBP')])
+        self.assertEqual(Product.objects.get(pk=gbp.pk).price_base, Decimal('12.70'))
+
+    def test_rate_change_reprices(self):
+        product_cache.get_product(self.eur.pk)
+        self.assertEqual(currency.set_rates({'EUR': 3}), 1)
+        self.assertEqual(product_cache.get_product(self.eur.pk).price_base, Decimal('150.00'))
+        self.assertEqual(self.names('{ products(orderBy: "-price") { name } }'), ["Lamp", "Kettle", "Fan"])
+        self.assertEqual(CategoryStats.objects.get(category=self.category).price_sum, Decimal('315.00'))
+        with self.assertRaises(ValueError):
+            currency.set_rates({'USD': 2})
+
+    def test_unknown_currency_is_rejected(self):
+        result = schema.execute(
+            'mutation($c: ID!) { createProducts(products: [{name: "Yen", description: "", price: 1, '
+            'currency: "JPY", categoryId: $c}]) { errors { message } } }',
+            variables={'c': self.category.pk}, context_value=Context(),
+        )
+        self.assertEqual(result.data['createProducts']['errors'][0]['message'], "No exchange rate for currency 'JPY'.")
+        with self.assertRaises(currency.UnknownCurrency):
+            Product.objects.create(name="Yen", description="", price=1, currency='JPY')
+
+    def test_admin_reports_rates_store_rates_would_refuse(self):
+        client = Client()
+        client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        product = {'name': "Yen", 'description': "Fan", 'price': '100', 'currency': 'JPY',
+                   'stock_quantity': '1', 'category': self.category.pk}
+
+        response = client.post('/admin/catalog/product/add/', product)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['adminform'].form.errors['currency'],
+                         ["No exchange rate for currency 'JPY'. Add one first."])
+
+        response = client.post('/admin/catalog/exchangerate/add/', {'currency': 'USD', 'rate': '2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['adminform'].form.errors['rate'],
+                         ["USD is the base currency; its rate is always 1."])
+        response = client.post('/admin/catalog/exchangerate/add/', {'currency': 'jpy', 'rate': '0'})
+        self.assertEqual(response.context['adminform'].form.errors['rate'], ["The rate for JPY must be positive."])
+
+        response = client.post('/admin/catalog/exchangerate/add/', {'currency': 'jpy', 'rate': '0.0067'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(client.post('/admin/catalog/product/add/', product).status_code, 302)
+        self.assertEqual(Product.objects.get(name="Yen").price_base, Decimal('0.67'))
+
+
+@override_settings(CATALOG_ADMIN_COUNT_LIMIT=50)
+class ProductAdminTests(TestCase):
+    URL = '/admin/catalog/product/'
+
+    def setUp(self):
+        cache.clear()
+        self.categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+        self.products = make_products(150, self.categories)
+        self.client = Client()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in ctx.captured_queries]
+
+    def test_pages_follow_the_cursor_without_offset(self):
+        seen = []
+        response, queries = self.get(self.URL)
+        while True:
+            cl = response.context['cl']
+            seen.extend(product.pk for product in cl.result_list)
+            self.assertFalse(any('OFFSET' in sql for sql in queries))
+            if not cl.next_cursor:
+                break
+            response, queries = self.get(self.URL + cl.next_page_url)
+        self.assertEqual(seen, sorted((p.pk for p in self.products), reverse=True))
+        self.assertEqual(self.client.get(self.URL + '?after=garbage').status_code, 302)
+
+    def test_count_is_capped_or_estimated(self):
+        response, queries = self.get(self.URL)
+        self.assertEqual(response.context['cl'].paginator.count_label, '50+')
+        self.assertIn('LIMIT 51', next(sql for sql in queries if 'COUNT' in sql))
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        response, queries = self.get(self.URL)
+        self.assertEqual(response.context['cl'].paginator.count_label, 'about 150')
+        self.assertFalse(any('COUNT' in sql for sql in queries))
+
+        response, _ = self.get(self.URL + '?currency=EUR')
+        self.assertEqual(response.context['cl'].paginator.count_label, '0')
+
+    def test_search_uses_the_full_text_index(self):
+        response, queries = self.get(self.URL + '?q=product+14')
+        self.assertEqual({p.name for p in response.context['cl'].result_list}, {"Product 14"} | {
+            f"Product {i}" for i in range(140, 150)
+        })
+        self.assertTrue(any('catalog_product_fts' in sql for sql in queries))
+        self.assertFalse(any('LIKE' in sql for sql in queries))
+
+    def test_filter_choices_are_cached_until_a_category_changes(self):
+        self.get(self.URL)
+        _, queries = self.get(self.URL)
+        self.assertFalse(any('FROM "catalog_category"' in sql for sql in queries))
+        self.assertFalse(any('DISTINCT' in sql for sql in queries))
+
+        Category.objects.create(name="Garden")
+        self.assertIsNone(cache.get(changelist.CATEGORY_CHOICES_KEY))
+        response, _ = self.get(self.URL)
+        self.assertIn(b"Garden", response.content)
+
+
+@override_settings(CATALOG_JOB_CHUNK_SIZE=10)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.big = Category.objects.create(name="Big")
+        self.small = Category.objects.create(name="Small")
+        make_products(25, [self.big])
+        make_products(3, [self.small])
+
+    def delete_category(self, category):
+        result = schema.execute(
+            'mutation($id: ID!) { deleteCategory(id: $id) { ok job { id status } } }',
+            variables={'id': category.pk}, context_value=Context(),
+        )
+        self.assertIsNone(result.errors)
+        return result.data['deleteCategory']
+
+    def test_large_category_is_deleted_by_a_chunked_job(self):
+        self.assertEqual(self.delete_category(self.small), {'ok': True, 'job': None})
+        self.assertFalse(Category.objects.filter(pk=self.small.pk).exists())
+
+        data = self.delete_category(self.big)
+        self.assertEqual(data['job']['status'], 'queued')
+        self.assertTrue(Category.objects.filter(pk=self.big.pk).exists())
+
+        with CaptureQueriesContext(connection) as ctx:
+            [job] = jobs.run_pending()
+        self.assertEqual((job.status, job.progress, job.total, job.result), ('succeeded', 25, 25, {'uncategorised': 25}))
+        # One UPDATE per chunk rather than one over the whole category
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "catalog_product" SET "category_id" = NULL, "updated_at"')]
+        self.assertEqual(len(updates), 3)
+        self.assertFalse(Category.objects.filter(pk=self.big.pk).exists())
+        self.assertEqual(Product.objects.filter(category__isnull=True).count(), 28)
+        self.assertEqual(CategoryStats.objects.get(category__isnull=True).product_count, 28)
+
+        result = schema.execute(
+            'query($id: ID!) { job(id: $id) { kind status progress total } jobs(status: "succeeded") { id } }',
+            variables={'id': job.pk}, context_value=Context(),
+        )
+        self.assertEqual(result.data['job'], {'kind': 'delete_category', 'status': 'succeeded', 'progress': 25, 'total': 25})
+        self.assertEqual(result.data['jobs'], [{'id': str(job.pk)}])
+
+    def test_job_status_is_never_served_from_the_response_cache(self):
+        job = jobs.enqueue('delete_category', category_id=self.big.pk)
+        client = Client(HTTP_ACCEPT='application/json')
+        query = '{ job(id: %d) { status } }' % job.pk
+        self.assertEqual(client.get('/graphql/', {'query': query}).json()['data']['job']['status'], 'queued')
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING)
+        self.assertEqual(client.get('/graphql/', {'query': query}).json()['data']['job']['status'], 'running')
+
+    def test_claims_are_exclusive_and_lost_workers_are_replaced(self):
+        job = jobs.enqueue('clear_catalog')
+        self.assertEqual(jobs.claim('a').pk, job.pk)
+        self.assertIsNone(jobs.claim('b'))
+
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=an_hour_ago)
+        claimed = jobs.claim('b')
+        self.assertEqual((claimed.pk, claimed.worker, claimed.attempts), (job.pk, 'b', 2))
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=an_hour_ago, attempts=3)
+        self.assertIsNone(jobs.claim('c'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_failures_are_recorded(self):
+        jobs.enqueue('reprice', currencies=['JPY'])
+        with self.assertLogs('catalog.jobs', 'ERROR'):
+            [job] = jobs.run_pending()
+        self.assertEqual((job.status, job.error), (Job.FAILED, "No exchange rate for currency 'JPY'."))
+
+    def test_background_repricing_and_worker_command(self):
+        eur = Product.objects.create(name="Lamp", description="", price=10, currency='EUR', category=self.small)
+        call_command('set_exchange_rates', 'EUR=2', '--background', stdout=StringIO())
+        self.assertEqual(Product.objects.get(pk=eur.pk).price_base, Decimal('10.80'))
+
+        call_command('run_catalog_worker', '--once', stdout=StringIO())
+        self.assertEqual(Product.objects.get(pk=eur.pk).price_base, Decimal('20.00'))
+        self.assertEqual(Job.objects.get().result, {'repriced': 1})
+
+
+class ProductChangeFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.books = Category.objects.create(name="Books")
+
+    def log(self):
+        return list(ProductChange.objects.order_by('id').values_list('product_id', 'op'))
+
+    def feed(self, since=None, first=None):
+        result = schema.execute(
+            'query($since: String, $first: Int) { productChanges(since: $since, first: $first) '
+            '{ cursor hasMore changes { version op productId product { name } } } }',
+            variables={'since': since, 'first': first}, context_value=Context(),
+        )
+        self.assertIsNone(result.errors)
+        return result.data['productChanges']
+
+    def test_every_write_path_is_logged(self):
+        lamp = Product.objects.create(name="Lamp", description="", price=10, currency='USD', category=self.books)
+        lamp.stock_quantity = 5
+        lamp.save()
+        created = schema.execute(
+            'mutation($items: [ProductInput!]!) { createProducts(products: $items) { products { id } } }',
+            variables={'items': [{'name': "Desk", 'description': "", 'price': 50, 'currency': "EUR",
+                                  'categoryId': self.books.pk}]},
+            context_value=Context(),
+        ).data['createProducts']['products']
+        desk = int(created[0]['id'])
+        inventory.reserve_stock([(lamp.pk, 2)])
+        currency.set_rates({'EUR': '2'})
+        lamp_id = lamp.pk
+        lamp.delete()
+        self.books.delete()
+        self.assertEqual(self.log(), [
+            (lamp_id, 'created'), (lamp_id, 'updated'), (desk, 'created'), (lamp_id, 'updated'),
+            (desk, 'updated'), (lamp_id, 'deleted'), (desk, 'updated'),
+        ])
+
+    def test_jobs_log_their_changes(self):
+        make_products(3, [self.books])
+        jobs.run(jobs.enqueue('delete_category', category_id=self.books.pk))
+        jobs.run(jobs.enqueue('clear_catalog'))
+        self.assertEqual([op for _, op in self.log()], ['updated'] * 3 + ['deleted'] * 3)
+
+    def test_query_pages_through_the_feed(self):
+        lamp = Product.objects.create(name="Lamp", description="", price=10, currency='USD', category=self.books)
+        desk = Product.objects.create(name="Desk", description="", price=50, currency='USD', category=self.books)
+        desk_id = desk.pk
+        desk.delete()
+
+        page = self.feed(first=2)
+        self.assertTrue(page['hasMore'])
+        self.assertEqual(page['changes'], [
+            {'version': page['changes'][0]['version'], 'op': 'CREATED', 'productId': str(lamp.pk), 'product': {'name': "Lamp"}},
+            {'version': page['cursor'], 'op': 'CREATED', 'productId': str(desk_id), 'product': None},
+        ])
+        page = self.feed(since=page['cursor'])
+        self.assertEqual(([c['op'] for c in page['changes']], page['hasMore']), (['DELETED'], False))
+        # Nothing new: the same cursor comes back
+        self.assertEqual(self.feed(since=page['cursor']), {'cursor': page['cursor'], 'hasMore': False, 'changes': []})
+
+    def test_ndjson_stream(self):
+        lamp = Product.objects.create(name="Lamp", description="", price=10, currency='USD', category=self.books)
+        lamp.price = 12
+        lamp.save()
+        response = self.client.get('/catalog/changes/', {'limit': 1})
+        [line] = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual((line['op'], line['product']['price']), ('created', '12.00'))
+        self.assertEqual(response['X-Catalog-Cursor'], line['version'])
+
+        response = self.client.get('/catalog/changes/', {'since': response['X-Catalog-Cursor']})
+        [line] = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(line['op'], 'updated')
+        self.assertEqual(self.client.get('/catalog/changes/', {'limit': 0}).status_code, 400)
+
+    def test_pruned_cursors_are_refused(self):
+        for name in ("A", "B", "C"):
+            Product.objects.create(name=name, description="", price=1, currency='USD', category=self.books)
+        first = ProductChange.objects.order_by('id').first().pk
+        ProductChange.objects.filter(pk__lte=first + 1).update(changed_at=timezone.now() - timedelta(days=60))
+        call_command('prune_product_changes', stdout=StringIO())
+        self.assertEqual(ProductChange.objects.count(), 1)
+
+        result = schema.execute('{ productChanges(since: "%d") { cursor } }' % first, context_value=Context())
+        self.assertEqual(result.errors[0].message,
+                         "The change log no longer reaches back to this cursor. Re-sync from the start of the feed.")
+        self.assertEqual(self.client.get('/catalog/changes/', {'since': first}).status_code, 400)
+        self.assertEqual(len(self.feed(since=str(first + 1))['changes']), 1)
+
+
+class WebSocket:
+    """Drives the /graphql/ws/ ASGI application the way a server would."""
+
+    def __init__(self, path='/graphql/ws/', subprotocols=('graphql-transport-ws',)):
+        self.incoming, self.outgoing = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'websocket', 'path': path, 'subprotocols': list(subprotocols), 'headers': []}
+        self.task = asyncio.ensure_future(websocket_application(scope, self.incoming.get, self.outgoing.put))
+
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        return await self.receive()
+
+    async def receive(self, timeout=5):
+        return await asyncio.wait_for(self.outgoing.get(), timeout)
+
+    async def send_json(self, message):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+    async def receive_json(self):
+        return json.loads((await self.receive())['text'])
+
+    async def open(self):
+        await self.connect()
+        await self.send_json({'type': 'connection_init'})
+        assert (await self.receive_json())['type'] == 'connection_ack'
+
+    async def subscribe(self, id, query, **variables):
+        await self.send_json({'type': 'subscribe', 'id': id, 'payload': {'query': query, 'variables': variables}})
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, 5)
+
+
+@override_settings(CATALOG_SUBSCRIPTION_TICK=0.01, CATALOG_SUBSCRIPTION_BROKER='catalog.events.LocalBroker')
+class SubscriptionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.books = Category.objects.create(name="Books")
+        self.games = Category.objects.create(name="Games")
+        self.products = make_products(4, [self.books])
+
+    async def update(self, pk, **fields):
+        await Product.objects.filter(pk=pk).aupdate(**fields)
+        events.publish([pk])
+
+    def test_writes_are_published_on_commit(self):
+        published = []
+        broker = events.broker()
+        broker.subscribe(published.append)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                result = schema.execute(
+                    'mutation($id: ID!) { reserveStock(items: [{productId: $id, quantity: 1}]) { ok } }',
+                    variables={'id': self.products[1].pk}, context_value=Context(),
+                )
+                self.assertIsNone(result.errors)
+                self.assertEqual(published, [])
+        finally:
+            broker.unsubscribe(published.append)
+        self.assertEqual(published, [[self.products[1].pk]])
+
+    async def test_product_updates_are_pushed_and_coalesced_per_tick(self):
+        lamp, desk = self.products[0], self.products[1]
+        ws = WebSocket()
+        await ws.open()
+        await ws.subscribe('1', 'subscription($ids: [ID!]!) { productUpdated(ids: $ids) '
+                                '{ productId product { stockQuantity category { name } } } }', ids=[lamp.pk, desk.pk])
+        await asyncio.sleep(0.05)
+        # Three writes inside one tick arrive as one message with the latest state
+        await self.update(lamp.pk, stock_quantity=7)
+        await self.update(lamp.pk, stock_quantity=8)
+        await self.update(self.products[2].pk, stock_quantity=9)
+        message = await ws.receive_json()
+        self.assertEqual(message, {'type': 'next', 'id': '1', 'payload': {'data': {'productUpdated': [
+            {'productId': str(lamp.pk), 'product': {'stockQuantity': 8, 'category': {'name': "Books"}}},
+        ]}}})
+
+        await Product.objects.filter(pk=desk.pk).adelete()
+        events.publish([desk.pk])
+        message = await ws.receive_json()
+        self.assertEqual(message['payload']['data']['productUpdated'], [{'productId': str(desk.pk), 'product': None}])
+
+        await ws.send_json({'type': 'complete', 'id': '1'})
+        await ws.send_json({'type': 'ping'})
+        self.assertEqual(await ws.receive_json(), {'type': 'pong'})
+        await ws.disconnect()
+        self.assertEqual(events.hub().subscriptions, set())
+
+    async def test_stock_changes_by_category(self):
+        product = self.products[0]
+        ws = WebSocket()
+        await ws.open()
+        await ws.subscribe('s', 'subscription($c: ID!) { stockChanged(categoryId: $c) { productId stockQuantity categoryId } }',
+                           c=self.books.pk)
+        await asyncio.sleep(0.05)
+        await self.update(product.pk, stock_quantity=3)
+        message = await ws.receive_json()
+        self.assertEqual(message['payload']['data']['stockChanged'],
+                         [{'productId': str(product.pk), 'stockQuantity': 3, 'categoryId': str(self.books.pk)}])
+
+        # A write that leaves the stock alone is not reported; leaving the category is
+        await self.update(product.pk, name="Renamed")
+        await self.update(product.pk, category_id=self.games.pk)
+        message = await ws.receive_json()
+        self.assertEqual(message['payload']['data']['stockChanged'],
+                         [{'productId': str(product.pk), 'stockQuantity': 3, 'categoryId': str(self.games.pk)}])
+        await ws.disconnect()
+
+    @override_settings(CATALOG_SUBSCRIPTION_MAX_PENDING=2)
+    async def test_clients_too_far_behind_are_cut_off(self):
+        ws = WebSocket()
+        await ws.open()
+        await ws.subscribe('s', 'subscription($c: ID!) { stockChanged(categoryId: $c) { productId } }', c=self.books.pk)
+        await asyncio.sleep(0.05)
+        await Product.objects.filter(category=self.books).aupdate(stock_quantity=20)
+        events.publish([p.pk for p in self.products])
+        message = await ws.receive_json()
+        self.assertEqual((message['type'], message['id']), ('error', 's'))
+        self.assertIn("Re-sync", message['payload'][0]['message'])
+        await ws.disconnect()
+
+    async def test_protocol_errors(self):
+        ws = WebSocket(subprotocols=())
+        self.assertEqual((await ws.connect())['code'], 4406)
+
+        ws = WebSocket()
+        await ws.connect()
+        await ws.subscribe('1', '{ categories { name } }')
+        self.assertEqual((await ws.receive())['code'], 4401)
+
+        ws = WebSocket()
+        await ws.open()
+        await ws.subscribe('1', '{ categories { name } }')
+        self.assertEqual(await ws.receive_json(), {'type': 'next', 'id': '1', 'payload': {'data': {'categories': [
+            {'name': "Books"}, {'name': "Games"},
+        ]}}})
+        self.assertEqual(await ws.receive_json(), {'type': 'complete', 'id': '1'})
+        await ws.subscribe('2', 'subscription { productUpdated(ids: ["1"]) { nope } }')
+        message = await ws.receive_json()
+        self.assertEqual((message['type'], message['id']), ('error', '2'))
+        await ws.send_json({'type': 'connection_init'})
+        self.assertEqual((await ws.receive())['code'], 4429)
+
+    def test_subscriptions_are_not_served_over_http(self):
+        response = Client(HTTP_ACCEPT='application/json').post(
+            '/graphql/', json.dumps({'query': 'subscription { productUpdated(ids: ["1"]) { productId } }'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['errors'][0]['message'], "Subscriptions are only served over WebSocket, at /graphql/ws/.")
+
+    def test_change_log_broker_sees_other_processes(self):
+        broker = events.ChangeLogBroker()
+        delivered = []
+        broker.subscribe(delivered.append)
+        broker.poll()
+        lamp = Product.objects.create(name="Lamp", description="", price=10, currency='USD', category=self.books)
+        broker.poll()
+        broker.poll()
+        self.assertEqual(delivered, [{lamp.pk}])
+
+
+class ProductFacetTests(TestCase):
+    QUERY = """query($categoryId: ID, $minPrice: Float, $buckets: [Float!]) {
+        productFacets(categoryId: $categoryId, minPrice: $minPrice, priceBuckets: $buckets) {
+            total inStock outOfStock
+            categories { categoryId count }
+            currencies { currency count }
+            priceBuckets { min max count }
+        }
+    }"""
+
+    def setUp(self):
+        cache.clear()
+        self.books = Category.objects.create(name="Books")
+        self.games = Category.objects.create(name="Games")
+        # Prices 10..15, stock i % 5, alternating categories
+        self.products = make_products(6, [self.books, self.games])
+        Product.objects.filter(pk=self.products[5].pk).update(currency='EUR', price=Decimal('10.00'), price_base=Decimal('10.80'))
+
+    def facets(self, **variables):
+        result = schema.execute(self.QUERY, variables=variables, context_value=Context())
+        self.assertIsNone(result.errors)
+        return result.data['productFacets']
+
+    @override_settings(CATALOG_FACET_CACHE_TIMEOUT=0)
+    def test_all_facets_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.facets(buckets=[11, 13])
+        self.assertEqual(data, {
+            'total': 6, 'inStock': 4, 'outOfStock': 2,
+            'categories': [{'categoryId': str(self.books.pk), 'count': 3}, {'categoryId': str(self.games.pk), 'count': 3}],
+            'currencies': [{'currency': 'USD', 'count': 5}, {'currency': 'EUR', 'count': 1}],
+            'priceBuckets': [
+                {'min': None, 'max': 11.0, 'count': 2},
+                {'min': 11.0, 'max': 13.0, 'count': 2},
+                {'min': 13.0, 'max': None, 'count': 2},
+            ],
+        })
+
+        data = self.facets(categoryId=self.books.pk, minPrice=11)
+        self.assertEqual((data['total'], data['categories']), (2, [{'categoryId': str(self.books.pk), 'count': 2}]))
+        self.assertEqual(len(data['priceBuckets']), len(settings.CATALOG_FACET_PRICE_BUCKETS) + 1)
+
+    def test_cached_until_a_product_write(self):
+        self.assertEqual(self.facets()['total'], 6)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.facets()['total'], 6)
+        Product.objects.create(name="Lamp", description="", price=10, currency='USD', category=self.books)
+        self.assertEqual(self.facets()['total'], 7)
+
+    def test_bad_buckets(self):
+        result = schema.execute(self.QUERY, variables={'buckets': [20, 10]}, context_value=Context())
+        self.assertEqual(result.errors[0].message, "Price bucket bounds must be in increasing order.")
@@ -0,0 +1,60 @@
+"""
+Field checks for the write paths that skip Model.full_clean(): the bulk mutations
+and import_products. Each catches what the database would otherwise reject in the
+middle of a batch (or, on SQLite, silently accept), so one bad item is reported on
+its own instead of failing every item written with it.
+"""
+from decimal import Decimal, InvalidOperation
+
+from .currency import rates
+from .models import Product
+
+CENT = Decimal('0.01')
+
+# Fields whose column is NOT NULL, with how messages name them
+NOT_NULL = {
+    'name': "Name",
+    'description': "Description",
+    'price': "Price",
+    'currency': "Currency",
+    'stock_quantity': "Stock quantity",
+}
+
+
+def price_limit():
+    """The first price the price column cannot hold (10 ** (max_digits - decimal_places))."""
+    field = Product._meta.get_field('price')
+    return Decimal(10) ** (field.max_digits - field.decimal_places)
+
+
+def product_field_error(data, exchange_rates=None):
+    """
+    The first problem with the product field values in `data` (only the fields it
+    contains are checked), or None.
+    """
+    for field, label in NOT_NULL.items():
+        if field in data and data[field] is None:
+            return f"{label} cannot be null."
+    if 'name' in data and not data['name']:
+        return "Name cannot be empty."
+    if 'name' in data and len(data['name']) > Product._meta.get_field('name').max_length:
+        return f"Name cannot be longer than {Product._meta.get_field('name').max_length} characters."
+    if 'price' in data:
+        try:
+            price = Decimal(str(data['price']))
+        except InvalidOperation:
+            return "Price must be a number."
+        if not price.is_finite():
+            return "Price must be a number."
+        if price < 0:
+            return "Price cannot be negative."
+        # Compared before rounding too: quantize() fails on values past Decimal's precision
+        if price >= price_limit() or price.quantize(CENT) >= price_limit():
+            return f"Price must be less than {price_limit()}."
+    if data.get('stock_quantity') is not None and data['stock_quantity'] < 0:
+        return "Stock quantity cannot be negative."
+    if 'currency' in data and len(data['currency']) != 3:
+        return "Currency must be a 3-letter code."
+    if 'currency' in data and data['currency'] not in (exchange_rates if exchange_rates is not None else rates()):
+        return f"No exchange rate for currency '{data['currency']}'."
+    return None
@@ -1,10 +1,16 @@
 from django.views.generic import TemplateView # Import TemplateView
-from django.db.models import Count, Sum, Avg, F
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from decimal import Decimal
 import json
 
 from unfold.views import UnfoldModelAdminViewMixin # Import UnfoldMixin
 
-from .models import Product, Category # Import your Django models
+from .models import Product, Category, CategoryStats, ProductChange # Import your Django models
+from . import changes, product_cache, routers
+from .currency import base_currency
 
 class AnalyticsDashboardView(UnfoldModelAdminViewMixin, TemplateView):
     # Required attributes for UnfoldModelAdminViewMixin
@@ -20,68 +26,141 @@ class AnalyticsDashboardView(UnfoldModelAdminViewMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context.update(get_dashboard_stats())
+        # Live per-process numbers, deliberately outside the cached dashboard dict
+        context['product_cache_stats'] = product_cache.counters()
+        return context
 
-        # --- 1. Overview Metrics (KPIs) ---
-        total_products = Product.objects.count()
-        products_in_stock = Product.objects.filter(stock_quantity__gt=0).count()
-        products_out_of_stock = Product.objects.filter(stock_quantity=0).count()
-        total_categories = Category.objects.count()
-
-        # Handle cases where no products exist to prevent ZeroDivisionError or None
-        if total_products > 0:
-            average_product_price = Product.objects.aggregate(avg_price=Avg('price'))['avg_price'] or 0
-            total_stock_value = Product.objects.annotate(
-                item_value=F('price') * F('stock_quantity')
-            ).aggregate(total=Sum('item_value'))['total'] or 0
-        else:
-            average_product_price = 0
-            total_stock_value = 0
-
-        # --- 2. Top/Bottom Lists ---
-        top_expensive_products = Product.objects.order_by('-price')[:5]
-        top_stocked_products = Product.objects.order_by('-stock_quantity')[:5]
-        
-        # Low stock: products between 1 and 10 in stock
-        low_stock_products = Product.objects.filter(
-            stock_quantity__gt=0, stock_quantity__lte=10
-        ).order_by('stock_quantity')[:5]
-
-        # Categories with most products
-        categories_with_product_counts = Category.objects.annotate(
-            product_count=Count('products')
-        ).order_by('-product_count')[:5]
-
-        # --- 3. Data for Charts ---
-        # Product Count by Category for a bar chart
-        category_product_counts = list(Category.objects.annotate(
-            count=Count('products')
-        ).order_by('name').values('name', 'count')) # Convert to list of dicts for JSON
-
-        # Stock Distribution for a pie chart (In Stock vs. Out of Stock)
-        stock_distribution_data = {
-            'in_stock': products_in_stock,
-            'out_of_stock': products_out_of_stock,
-        }
-
-        # Add all calculated data to the context
-        context.update({
-            # KPIs
-            'total_products': total_products,
-            'products_in_stock': products_in_stock,
-            'products_out_of_stock': products_out_of_stock,
-            'total_categories': total_categories,
-            'average_product_price': average_product_price,
-            'total_stock_value': total_stock_value,
-
-            # Lists
-            'top_expensive_products': top_expensive_products,
-            'top_stocked_products': top_stocked_products,
-            'low_stock_products': low_stock_products,
-            'categories_with_product_counts': categories_with_product_counts,
-
-            # Chart Data (JSON stringified for JavaScript)
-            'category_chart_data_json': json.dumps(category_product_counts),
-            'stock_distribution_data_json': json.dumps(stock_distribution_data),
-        })
-
-        return context
\ No newline at end of file
+
+def dashboard_cache_key():
+    return 'catalog:dashboard'
+
+
+def invalidate_dashboard_cache(**kwargs):
+    cache.delete(dashboard_cache_key())
+
+
+def get_dashboard_stats():
+    """Dashboard context, cached for settings.CATALOG_DASHBOARD_CACHE_TIMEOUT seconds."""
+    stats = cache.get(dashboard_cache_key())
+    if stats is None:
+        stats = compute_dashboard_stats()
+        if not routers.replica_may_be_stale():
+            timeout = getattr(settings, 'CATALOG_DASHBOARD_CACHE_TIMEOUT', 300)
+            cache.set(dashboard_cache_key(), stats, timeout)
+    return stats
+
+
+def compute_dashboard_stats():
+    # --- 1. Overview Metrics (KPIs) ---
+    # Summed from the incrementally maintained per-category rows (catalog.stats),
+    # so this is O(#categories) no matter how many products there are
+    all_stats = list(CategoryStats.objects.all())
+    total_products = sum(row.product_count for row in all_stats)
+    products_in_stock = sum(row.in_stock_count for row in all_stats)
+    products_out_of_stock = total_products - products_in_stock
+    price_sum = sum((row.price_sum for row in all_stats), Decimal('0'))
+    average_product_price = price_sum / total_products if total_products else 0
+    total_stock_value = sum((row.stock_value for row in all_stats), Decimal('0'))
+
+    # --- 2. Top/Bottom Lists ---
+    # Base-currency prices, so 1,000 NGN doesn't outrank 100 USD
+    top_expensive_products = list(Product.objects.order_by('-price_base', '-id')[:5])
+    top_stocked_products = list(Product.objects.order_by('-stock_quantity')[:5])
+
+    # Low stock: products between 1 and 10 in stock
+    low_stock_products = list(Product.objects.filter(
+        stock_quantity__gt=0, stock_quantity__lte=10
+    ).order_by('stock_quantity')[:5])
+
+    counts = {row.category_id: row.product_count for row in all_stats}
+    categories = list(Category.objects.order_by('name'))
+    for category in categories:
+        category.product_count = counts.get(category.pk, 0)
+    categories_with_product_counts = sorted(
+        categories, key=lambda category: category.product_count, reverse=True
+    )[:5]
+
+    # --- 3. Data for Charts ---
+    # Product Count by Category for a bar chart
+    category_product_counts = [
+        {'name': category.name, 'count': category.product_count} for category in categories
+    ]
+
+    # Stock Distribution for a pie chart (In Stock vs. Out of Stock)
+    stock_distribution_data = {
+        'in_stock': products_in_stock,
+        'out_of_stock': products_out_of_stock,
+    }
+
+    return {
+        # KPIs
+        'total_products': total_products,
+        'products_in_stock': products_in_stock,
+        'products_out_of_stock': products_out_of_stock,
+        'total_categories': len(categories),
+        'average_product_price': average_product_price,
+        'total_stock_value': total_stock_value,
+        'base_currency': base_currency(),
+
+        # Lists
+        'top_expensive_products': top_expensive_products,
+        'top_stocked_products': top_stocked_products,
+        'low_stock_products': low_stock_products,
+        'categories_with_product_counts': categories_with_product_counts,
+
+        # Chart Data (JSON stringified for JavaScript)
+        'category_chart_data_json': json.dumps(category_product_counts),
+        'stock_distribution_data_json': json.dumps(stock_distribution_data),
+    }
+
+
+CHANGES_CHUNK_SIZE = 1000
+
+
+@require_GET
+def product_changes_stream(request):
+    """
+    GET /catalog/changes/?since=<version>&limit=<n>: the product change feed
+    (catalog.changes) as NDJSON, one change per line, oldest first. The
+    X-Catalog-Cursor header is the `since` to send next time.
+    """
+    try:
+        since = changes.check_since(request.GET.get('since'))
+        limit = request.GET.get('limit')
+        limit = int(limit) if limit not in (None, '') else None
+        if limit is not None and limit < 1:
+            raise ValueError
+        # Fix the end of the stream up front so the cursor can go in a header
+        cursor = upto = changes.latest_version()
+        if limit is not None:
+            last = list(
+                ProductChange.objects.filter(id__gt=since, id__lte=upto).order_by('id')
+                .values_list('id', flat=True)[limit - 1:limit]
+            )
+            cursor = last[0] if last else upto
+    except ValueError:
+        return HttpResponseBadRequest("'limit' must be a positive integer.")
+    except Exception as exc:
+        return HttpResponseBadRequest(str(exc))
+
+    def lines():
+        after = since
+        while after < cursor:
+            page = list(ProductChange.objects.filter(id__gt=after, id__lte=cursor).order_by('id')[:CHANGES_CHUNK_SIZE])
+            if not page:
+                return
+            products = changes.product_payloads({c.product_id for c in page if c.op != c.DELETED})
+            for change in page:
+                yield json.dumps({
+                    'version': str(change.pk),
+                    'op': change.op,
+                    'product_id': change.product_id,
+                    'changed_at': change.changed_at.isoformat(),
+                    'product': products.get(change.product_id),
+                }) + '\n'
+            after = page[-1].pk
+
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['X-Catalog-Cursor'] = str(max(cursor, since))
+    return response
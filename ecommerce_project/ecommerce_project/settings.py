@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,12 +50,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'catalog.routers.ReplicaRoutingMiddleware',  # before anything that reads the database
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'catalog.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'ecommerce_project.urls'
@@ -84,9 +87,40 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open across requests (checked before reuse) instead of
+        # reconnecting on every one. On PostgreSQL, psycopg 3 can pool them per
+        # process instead: 'OPTIONS': {'pool': True} with CONN_MAX_AGE = 0.
+        # Not under ASGI (asgi.py sets CATALOG_ASGI): async code runs its queries on
+        # short-lived threads, each with its own connection, which would then stay
+        # open until the server restarts. Django advises disabling them there.
+        'CONN_MAX_AGE': 0 if os.environ.get('CATALOG_ASGI') else 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# 'production' tunes every SQLite connection for concurrent use: WAL, synchronous=
+# NORMAL, mmap, a larger page cache, busy_timeout and BEGIN IMMEDIATE transactions
+# (see catalog.sqlite). Empty leaves SQLite's defaults. CATALOG_SQLITE_PRAGMAS
+# overrides single pragmas, e.g. {'mmap_size': 1073741824}.
+CATALOG_SQLITE_PROFILE = os.environ.get('CATALOG_SQLITE_PROFILE', '')
+CATALOG_SQLITE_PRAGMAS = {}
+
+# Read replicas, as extra aliases with the same settings as 'default' but another
+# NAME (or HOST). Locally, CATALOG_REPLICA_SQLITE=/tmp/r1.sqlite3,/tmp/r2.sqlite3
+# adds copies of the database as replicas; keep them in sync yourself.
+for number, name in enumerate(filter(None, os.environ.get('CATALOG_REPLICA_SQLITE', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'NAME': name, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['catalog.routers.ReplicaRouter']
+
+# Aliases that request-time reads are spread over (writes always go to 'default').
+# A client is kept on 'default' for CATALOG_REPLICA_STICKY_SECONDS after it writes,
+# which should exceed the worst replica lag. An unreachable replica is skipped and
+# re-checked every CATALOG_REPLICA_HEALTH_INTERVAL seconds.
+CATALOG_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+CATALOG_REPLICA_STICKY_SECONDS = 5
+CATALOG_REPLICA_HEALTH_INTERVAL = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -133,3 +167,84 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 GRAPHENE = {
     "SCHEMA": "ecommerce_project.schema.schema" # Path to your root schema file
 }
+
+# Hard cap on `first`/`last` for cursor-paginated catalog queries
+CATALOG_MAX_PAGE_SIZE = 100
+
+# Seconds the admin analytics dashboard context is cached for. Product/Category
+# saves and deletes invalidate it immediately, as do the bulk write paths.
+CATALOG_DASHBOARD_CACHE_TIMEOUT = 300
+
+# The product changelist counts exactly up to CATALOG_ADMIN_COUNT_LIMIT rows; past that
+# it shows the database's row estimate (run ANALYZE periodically on SQLite to keep it
+# fresh) or "N+" when filtered. Category filter choices are cached for
+# CATALOG_ADMIN_FILTER_CACHE_TIMEOUT seconds and dropped on any Category save/delete.
+CATALOG_ADMIN_COUNT_LIMIT = 10000
+CATALOG_ADMIN_FILTER_CACHE_TIMEOUT = 300
+
+# Background jobs (catalog.jobs, run by `manage.py run_catalog_worker`) work in
+# chunks of CATALOG_JOB_CHUNK_SIZE products, one transaction each; deleting a category
+# with more products than that is queued as a job. A running job whose heartbeat is
+# older than CATALOG_JOB_STALE_SECONDS is re-queued, CATALOG_JOB_MAX_ATTEMPTS times at most.
+CATALOG_JOB_CHUNK_SIZE = 1000
+CATALOG_JOB_STALE_SECONDS = 300
+CATALOG_JOB_MAX_ATTEMPTS = 3
+
+# Product change feed (catalog.changes): on databases other than SQLite, changes younger
+# than CATALOG_CHANGE_FEED_LAG seconds are held back so concurrent commits cannot land
+# behind a consumer's cursor. `manage.py prune_product_changes` drops changes older than
+# CATALOG_CHANGE_LOG_RETENTION_DAYS; consumers further behind must re-sync from scratch.
+CATALOG_CHANGE_FEED_LAG = 5
+CATALOG_CHANGE_LOG_RETENTION_DAYS = 30
+
+# GraphQL subscriptions (/graphql/ws/ under ASGI, catalog.events): changed products are
+# loaded and pushed once every CATALOG_SUBSCRIPTION_TICK seconds. A subscription with
+# more than CATALOG_SUBSCRIPTION_MAX_PENDING unsent products is ended. The default
+# broker only sees this process's writes; 'catalog.events.ChangeLogBroker' follows the
+# change log and so sees writes from every process.
+CATALOG_SUBSCRIPTION_BROKER = 'catalog.events.LocalBroker'
+CATALOG_SUBSCRIPTION_TICK = 0.25
+CATALOG_SUBSCRIPTION_MAX_PENDING = 1000
+
+# Per-process memory cache by default. With several workers, point this at a shared
+# backend (django.core.cache.backends.redis.RedisCache or PyMemcacheCache) so an
+# invalidation in one process is seen by all of them.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Product prices are filtered, sorted and totalled in this currency (Product.price_base).
+# CATALOG_EXCHANGE_RATES seeds the exchange-rate table when it is first created: the
+# value of one unit of each currency in the base currency. Later changes go through
+# `manage.py set_exchange_rates` or the admin, which re-price the catalog.
+CATALOG_BASE_CURRENCY = 'USD'
+CATALOG_EXCHANGE_RATES = {'EUR': '1.08', 'GBP': '1.27', 'NGN': '0.00065'}
+
+# productFacets price buckets: base-currency bounds between buckets (the first and last
+# buckets are open-ended). Facet counts are cached for CATALOG_FACET_CACHE_TIMEOUT
+# seconds (0 disables this) and never served after a product write.
+CATALOG_FACET_PRICE_BUCKETS = [10, 25, 50, 100, 250, 500, 1000]
+CATALOG_FACET_CACHE_TIMEOUT = 300
+
+# Cache alias and TTL (seconds) for the read-through single-product cache
+CATALOG_PRODUCT_CACHE = "default"
+CATALOG_PRODUCT_CACHE_TIMEOUT = 600
+
+# /graphql/ response cache: anonymous query results are kept this many seconds (any
+# catalog write invalidates them sooner); parsed documents are kept in a per-process LRU
+CATALOG_GRAPHQL_CACHE = "default"
+CATALOG_GRAPHQL_RESPONSE_CACHE_TIMEOUT = 60
+CATALOG_GRAPHQL_DOCUMENT_CACHE_SIZE = 256
+
+# /graphql/ rejects operations nested deeper, or estimated to resolve more objects,
+# than this. Unpaginated lists are costed as CATALOG_MAX_PAGE_SIZE rows, their cap.
+CATALOG_QUERY_MAX_DEPTH = 10
+CATALOG_QUERY_MAX_COST = 50000
+
+# Fraction (0-1) of /graphql/ and dashboard requests to profile: SQL and resolver
+# timings, duplicate queries, and (if enabled) the Python allocation peak. Reports go
+# to the `catalog.profiling` logger, a Server-Timing header and GraphQL extensions.
+CATALOG_PROFILING_SAMPLE_RATE = 0.0
+CATALOG_PROFILING_TRACEMALLOC = False
@@ -17,14 +17,22 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt 
-from graphene_django.views import GraphQLView
-from catalog.schema import schema
+from catalog.graphql_cache import AsyncGraphQLView, CachingGraphQLView
+from catalog.schema import async_schema, schema
+from catalog.views import product_changes_stream
 from django.conf import settings
 from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path("graphql/", csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema))),
+    path("graphql/", csrf_exempt(CachingGraphQLView.as_view(graphiql=True, schema=schema))),
+    # Same API executed on the event loop; only worth using under ASGI (asgi.py), which
+    # also serves its subscriptions at /graphql/ws/
+    path("graphql/async/", csrf_exempt(AsyncGraphQLView.as_view(
+        graphiql=True, schema=async_schema, subscription_path="/graphql/ws/",
+    ))),
+    # Product change feed as NDJSON (catalog.changes)
+    path("catalog/changes/", product_changes_stream),
 ]
 
 if settings.DEBUG: